@@ -1,10 +1,23 @@
+import time
+
+_T0 = time.perf_counter()
+
 import argparse
 import logging  # NUEVO: Importar logging
 
-from providers.chatgpt import ChatGPTProvider
-from providers.deepseek import DeepSeekProvider
-from rag.retrieve import Retriever
-from rag.pipeline import RAGPipeline
+# Solo módulos livianos al arrancar: torch, sentence-transformers, faiss, pandas
+# y el SDK de OpenAI se importan recién si la pregunta se responde en este proceso.
+from providers.registry import create_provider, provider_names
+from rag.fusion import RETRIEVAL_MODES
+from rag.pipeline import RETRIEVAL_STRATEGIES
+from rag.rerank import RERANK_CANDIDATES, RERANK_BUDGET_S
+from rag.context import CONTEXT_TOKEN_BUDGET
+from rag.hierarchy import TOP_GROUPS
+from rag.daemon import DAEMON_SOCKET, DaemonUnavailable, ask
+from rag import metrics
+
+# La CLI responde una pregunta y termina: sin histogramas ni trazas
+metrics.set_enabled(False)
 
 # NUEVO: Configuración básica de logging
 # Esto mostrará logs en la consola con el nivel, nombre del módulo y mensaje.
@@ -17,37 +30,112 @@ logging.basicConfig(
 # NUEVO: Obtener una instancia del logger para este archivo
 logger = logging.getLogger(__name__)
 
-PROVIDERS = {
-    "chatgpt": ChatGPTProvider,
-    "deepseek": DeepSeekProvider,
-}
+# Opciones de la CLI que se reenvían tal cual al daemon
+DAEMON_REQUEST_FIELDS = ("question", "provider", "k", "cache", "strategy", "hyde_skip_threshold",
+                         "retrieval_mode", "rerank", "rerank_candidates", "rerank_budget", "context_budget",
+                         "hierarchical", "top_groups", "doc_filter")
+
+
+def run_with_daemon(args) -> tuple[dict, dict]:
+    """Responde con el daemon (componentes ya cargados); DaemonUnavailable si no está corriendo."""
+    start = time.perf_counter()
+    response = ask({field: getattr(args, field) for field in DAEMON_REQUEST_FIELDS}, args.socket)
+    timings = {"modo": f"daemon caliente ({args.socket})", "pipeline_s": response["pipeline_s"],
+               "ida_y_vuelta_s": time.perf_counter() - start}
+    return response, timings
+
+
+def run_in_process(args) -> tuple[dict, dict]:
+    """Carga todo en este proceso (arranque en frío) y ejecuta el pipeline."""
+    start = time.perf_counter()
+    from rag.retrieve import Retriever
+    from rag.pipeline import RAGPipeline
+    from rag.cache import PipelineCache, SQLiteCache
+    imported = time.perf_counter()
+
+    # 1. Instanciar los componentes
+    provider = create_provider(args.provider)
+    retriever = Retriever(mode=args.retrieval_mode, hierarchical=args.hierarchical,
+                          top_groups=args.top_groups, doc_filter=args.doc_filter)
+
+    cache = None
+    if args.cache == "sqlite":
+        cache = PipelineCache(SQLiteCache(), watch_paths=(retriever.index_path, retriever.chunks_path))
+
+    reranker = None
+    if args.rerank:
+        from rag.rerank import Reranker
+        reranker = Reranker(budget_s=args.rerank_budget)
+
+    # 2. Instanciar el pipeline con sus dependencias
+    pipeline = RAGPipeline(provider=provider, retriever=retriever, k=args.k, cache=cache,
+                           strategy=args.strategy, hyde_skip_threshold=args.hyde_skip_threshold,
+                           reranker=reranker, rerank_candidates=args.rerank_candidates,
+                           context_budget=args.context_budget or None)
+    loaded = time.perf_counter()
+
+    # 3. Ejecutar el pipeline
+    # Usamos logger en lugar de print para un registro consistente
+    logger.info(f"Procesando pregunta: '{args.question}' con el proveedor {provider.name}")
+    result = pipeline.run(args.question)
+    timings = {"modo": "en proceso (arranque en frío)", "importaciones_s": imported - start,
+               "carga_s": loaded - imported, "pipeline_s": time.perf_counter() - loaded}
+    return {**result, "provider": provider.name,
+            "cache": cache.stats() if cache is not None else None}, timings
+
 
 def main():
     parser = argparse.ArgumentParser(description="UFRO Assistant CLI")
     parser.add_argument("question", type=str, help="Pregunta del usuario")
-    parser.add_argument("--provider", type=str, choices=PROVIDERS.keys(), default="chatgpt", help="Proveedor LLM")
+    parser.add_argument("--provider", type=str, choices=provider_names(), default="chatgpt", help="Proveedor LLM")
     parser.add_argument("--k", type=int, default=4, help="Número de chunks a recuperar")
+    parser.add_argument("--cache", type=str, choices=["none", "sqlite"], default="none",
+                        help="Caché de respuestas en disco (data/cache.sqlite)")
+    parser.add_argument("--strategy", type=str, choices=RETRIEVAL_STRATEGIES, default="hyde",
+                        help="Estrategia de recuperación")
+    parser.add_argument("--hyde-skip-threshold", type=float, default=None,
+                        help="Similitud de la búsqueda directa a partir de la cual se omite HyDE (modos dense e hybrid)")
+    parser.add_argument("--retrieval-mode", type=str, choices=RETRIEVAL_MODES, default="dense",
+                        help="Búsqueda densa (FAISS), léxica (BM25) o híbrida")
+    parser.add_argument("--hierarchical", action="store_true",
+                        help="Busca primero las páginas más parecidas y luego solo entre sus chunks")
+    parser.add_argument("--top-groups", type=int, default=TOP_GROUPS,
+                        help="Páginas (o documentos) que pasan a la etapa fina de la búsqueda jerárquica")
+    parser.add_argument("--doc-filter", type=str, nargs="+", default=None,
+                        help="Restringe la búsqueda a documentos cuyo id contenga alguno de estos textos")
+    parser.add_argument("--rerank", action="store_true",
+                        help="Re-ordena los candidatos con un cross-encoder en CPU")
+    parser.add_argument("--rerank-candidates", type=int, default=RERANK_CANDIDATES,
+                        help="Candidatos a recuperar antes del re-ranking")
+    parser.add_argument("--rerank-budget", type=float, default=RERANK_BUDGET_S,
+                        help="Segundos máximos de re-ranking antes de volver al orden de FAISS")
+    parser.add_argument("--context-budget", type=int, default=CONTEXT_TOKEN_BUDGET,
+                        help="Tokens máximos de contexto enviados al LLM (0 = sin límite)")
+    parser.add_argument("--socket", type=str, default=DAEMON_SOCKET,
+                        help="Socket del daemon (python -m rag.daemon)")
+    parser.add_argument("--no-daemon", action="store_true",
+                        help="Ejecuta siempre en este proceso, aunque el daemon esté corriendo")
+    parser.add_argument("--timing", action="store_true",
+                        help="Muestra los tiempos de arranque, carga y pipeline")
     args = parser.parse_args()
+    if args.hyde_skip_threshold is not None and args.retrieval_mode == "lexical":
+        parser.error("--hyde-skip-threshold usa la similitud coseno de FAISS; no aplica con --retrieval-mode lexical")
 
     # NUEVO: Bloque try...except para capturar cualquier error inesperado
     try:
-        # 1. Instanciar los componentes
-        provider_class = PROVIDERS[args.provider]
-        provider = provider_class()
-        retriever = Retriever()
-
-        # 2. Instanciar el pipeline con sus dependencias
-        pipeline = RAGPipeline(provider=provider, retriever=retriever, k=args.k)
-
-        # 3. Ejecutar el pipeline
-        # Usamos logger en lugar de print para un registro consistente
-        logger.info(f"Procesando pregunta: '{args.question}' con el proveedor {provider.name}")
-        result = pipeline.run(args.question)
+        result = None
+        if not args.no_daemon:
+            try:
+                result, timings = run_with_daemon(args)
+            except DaemonUnavailable as e:
+                logger.info(f"Daemon no disponible ({e}); se ejecuta en este proceso.")
+        if result is None:
+            result, timings = run_in_process(args)
 
         # 4. Imprimir el resultado formateado
-        print(f"\n Respuesta ({provider.name}):")
+        print(f"\n Respuesta ({result['provider']}):")
         print(result["answer"])
-        
+
         print("\n Fuentes consultadas:")
         if result["sources"]:
             unique_sources = {f"- Documento: {s['doc_id']}, Página: {s['page']}" for s in result["sources"]}
@@ -55,7 +143,16 @@ def main():
                 print(source)
         else:
             print("- No se recuperaron fuentes para esta pregunta.")
-            
+
+        if result.get("cache") is not None:
+            logger.info(f"Estadísticas de caché: {result['cache']}")
+
+        if args.timing:
+            # total_s se mide desde el inicio del script (sin el arranque del intérprete)
+            print(f"\n Tiempos ({timings.pop('modo')}):")
+            for name, seconds in {**timings, "total_s": time.perf_counter() - _T0}.items():
+                print(f"- {name}: {seconds:.3f}")
+
     except Exception as e:
         # NUEVO: Manejo de errores de último recurso
         logger.error(f"Ha ocurrido un error fatal en la aplicación: {e}", exc_info=True)
@@ -63,4 +160,4 @@ def main():
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,135 @@
+import os
+import sys
+import json
+import time
+import argparse
+import logging
+import resource
+import tempfile
+import subprocess
+import numpy as np
+import pandas as pd
+
+from rag.embed import DATA_PATH, MODEL_NAME
+from rag.encoders import ENCODER_BACKENDS, cosine_agreement, load_encoder
+from eval.benchmark import git_commit
+from eval.bench_index import percentiles_ms, rss_mb
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+# Compara los backends de embeddings (torch, onnx, onnx-int8):
+# latencia por consulta, throughput por lotes, memoria y concordancia con PyTorch
+# (coseno por texto y solapamiento del top-k). Cada backend corre en su propio
+# proceso para que la memoria medida sea solo la suya.
+
+DEFAULT_TEXTS = 512
+
+
+def run_backend(backend: str, questions: list, texts: list, batch_size: int, repeats: int) -> tuple[dict, np.ndarray]:
+    rss_before = rss_mb()
+    start = time.perf_counter()
+    model = load_encoder(MODEL_NAME, backend)
+    load_s = time.perf_counter() - start
+    rss_loaded = rss_mb()
+    model.encode(questions[:2])  # calentamiento
+
+    latencies, question_vectors = [], []
+    for repeat in range(repeats):
+        for question in questions:
+            t0 = time.perf_counter()
+            vector = model.encode([question])
+            latencies.append(time.perf_counter() - t0)
+            if repeat == 0:
+                question_vectors.append(vector[0])
+
+    t0 = time.perf_counter()
+    text_vectors = model.encode(texts, batch_size=batch_size)
+    batch_s = time.perf_counter() - t0
+
+    row = {
+        "backend": backend,
+        "load_s": round(load_s, 3),
+        **percentiles_ms(latencies),
+        f"texts_per_s_batch_{batch_size}": round(len(texts) / batch_s, 1),
+        "load_rss_mb": round(rss_loaded - rss_before, 1),
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+    }
+    return row, np.vstack([np.array(question_vectors), np.asarray(text_vectors)]).astype(np.float32)
+
+
+def topk_overlap(vectors: np.ndarray, reference: np.ndarray, n_questions: int, k: int) -> float:
+    """Solapamiento del top-k de cada pregunta sobre los textos de muestra, contra PyTorch."""
+    def top_ids(v):
+        v = v / np.clip(np.linalg.norm(v, axis=1, keepdims=True), 1e-12, None)
+        scores = v[:n_questions] @ v[n_questions:].T
+        return np.argsort(-scores, axis=1)[:, :k]
+    found, expected = top_ids(vectors), top_ids(reference)
+    return float(np.mean([len(set(a) & set(b)) / k for a, b in zip(found, expected)]))
+
+
+def spawn(backend: str, args, vectors_path: str) -> dict:
+    """Ejecuta un backend en un proceso nuevo; devuelve su fila (o None si falló)."""
+    cmd = [sys.executable, "-m", "eval.bench_encoders", "--worker", backend, "--vectors-out", vectors_path,
+           "--gold-set", args.gold_set, "--texts", str(args.texts), "--batch-size", str(args.batch_size),
+           "--repeats", str(args.repeats)]
+    proc = subprocess.run(cmd, capture_output=True, text=True)
+    if proc.returncode != 0:
+        logging.warning(f"Backend {backend} omitido: {proc.stderr.strip().splitlines()[-1:]}")
+        return None
+    return json.loads(proc.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de backends de embeddings (torch vs ONNX)")
+    parser.add_argument("--backends", nargs="+", default=list(ENCODER_BACKENDS), choices=ENCODER_BACKENDS)
+    parser.add_argument("--gold-set", default="eval/gold_set.jsonl")
+    parser.add_argument("--texts", type=int, default=DEFAULT_TEXTS, help="Chunks para medir throughput")
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument("--repeats", type=int, default=5, help="Repeticiones del gold set para la latencia")
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--output", default="eval/bench_encoders.json")
+    parser.add_argument("--worker", choices=ENCODER_BACKENDS, help=argparse.SUPPRESS)
+    parser.add_argument("--vectors-out", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    with open(args.gold_set, 'r', encoding='utf-8') as f:
+        questions = [json.loads(line)["question"] for line in f]
+
+    if args.worker:
+        chunks = pd.read_parquet(DATA_PATH, columns=["text"])["text"]
+        texts = chunks.sample(min(args.texts, len(chunks)), random_state=0).tolist()
+        row, vectors = run_backend(args.worker, questions, texts, args.batch_size, args.repeats)
+        np.save(args.vectors_out, vectors)
+        print(json.dumps(row))
+        return
+
+    backends = ["torch", *[b for b in args.backends if b != "torch"]]
+    rows, vectors = [], {}
+    with tempfile.TemporaryDirectory() as tmp:
+        for backend in backends:
+            path = os.path.join(tmp, f"{backend}.npy")
+            row = spawn(backend, args, path)
+            if row is None:
+                continue
+            vectors[backend] = np.load(path)
+            rows.append(row)
+            logging.info(f"{backend}: {row}")
+
+    reference = vectors.get("torch")
+    for row in rows:
+        if reference is not None:
+            agreement = cosine_agreement(vectors[row["backend"]], reference)
+            row["cos_mean"], row["cos_min"] = agreement["mean"], agreement["min"]
+            row[f"top{args.k}_overlap"] = round(topk_overlap(vectors[row["backend"]], reference,
+                                                             len(questions), args.k), 4)
+
+    report = {"commit": git_commit(), "model": MODEL_NAME, "questions": len(questions), "rows": rows}
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print("\n--- BENCHMARK DE BACKENDS DE EMBEDDINGS ---")
+    print(pd.DataFrame(rows).to_string(index=False))
+    print(f"Resultados guardados en {args.output}")
+
+
+if __name__ == "__main__":
+    main()
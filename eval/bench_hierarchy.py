@@ -0,0 +1,133 @@
+import json
+import time
+import argparse
+import logging
+import numpy as np
+import pandas as pd
+
+from rag.embed import DATA_PATH, EmbeddingEngine, embed_with_cache, ensure_vector_ids
+from rag.manifest import EmbeddingCache
+from rag.index_factory import build_index, make_meta, prepare_vectors
+from rag.hierarchy import HIERARCHY_LEVELS, GroupIndex, top_k_subset
+from eval.benchmark import REPLICA_COSINE, perturb
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+# Compara la búsqueda jerárquica (página/documento → chunk) con la plana exacta:
+# recall@k de chunks contra la plana, acierto del documento esperado del gold set,
+# candidatos revisados en la etapa fina y latencia por consulta.
+# Con --scales el corpus se replica (con ruido, como documentos nuevos) para ver
+# cómo crece la latencia de cada búsqueda al aumentar el número de chunks.
+
+def load_corpus() -> tuple[pd.DataFrame, np.ndarray]:
+    """Chunks y sus vectores (desde la caché de embeddings cuando es posible)."""
+    df = ensure_vector_ids(pd.read_parquet(DATA_PATH))
+    vectors, _ = embed_with_cache(df["text"].tolist(), df["text_hash"].tolist(), EmbeddingCache(), EmbeddingEngine)
+    return df, vectors
+
+def load_gold_set(path: str) -> tuple[list[str], list[set]]:
+    with open(path, 'r', encoding='utf-8') as f:
+        items = [json.loads(line) for line in f]
+    return [item["question"] for item in items], [set(item.get("expected_citations", [])) for item in items]
+
+def replicate(df: pd.DataFrame, vectors: np.ndarray, factor: int, cosine: float, seed: int = 0):
+    """
+    Corpus `factor` veces más grande: cada copia es un documento nuevo
+    ("<doc_id>#<n>") con vectores perturbados hasta coseno ≈ `cosine` con el
+    original. El id de cada chunk es su fila.
+    """
+    rng = np.random.default_rng(seed)
+    frames, blocks = [df[["doc_id", "page"]]], [vectors]
+    for n in range(1, factor):
+        frames.append(df[["doc_id", "page"]].assign(doc_id=df["doc_id"].astype(str) + f"#{n}"))
+        blocks.append(perturb(vectors, cosine, rng))
+    scaled = pd.concat(frames, ignore_index=True)
+    scaled["vector_id"] = np.arange(len(scaled), dtype=np.int64)
+    return scaled, prepare_vectors(np.vstack(blocks), {"normalize": True})
+
+def doc_hit_rate(found_ids: list, doc_ids: np.ndarray, expected: list[set]) -> float:
+    """Fracción de preguntas con algún documento esperado entre los resultados (las copias cuentan)."""
+    hits = [bool({str(d).split("#")[0] for d in doc_ids[ids[ids != -1]]} & exp)
+            for ids, exp in zip(found_ids, expected) if exp]
+    return float(np.mean(hits)) if hits else float("nan")
+
+def recall_at_k(found_ids: list, exact_ids: list) -> float:
+    return float(np.mean([len(set(f) & set(e)) / max(1, len(e)) for f, e in zip(found_ids, exact_ids)]))
+
+def summarize(method: str, scale: int, n_chunks: int, found: list, exact: list, latencies: list,
+              candidates: list, doc_ids: np.ndarray, expected: list[set], k: int) -> dict:
+    row = {
+        "scale": scale,
+        "chunks": n_chunks,
+        "method": method,
+        f"recall@{k}": round(recall_at_k(found, exact), 4),
+        f"doc_hit@{k}": round(doc_hit_rate(found, doc_ids, expected), 4),
+        "candidates": int(np.mean(candidates)),
+        "p50_ms": round(float(np.percentile(latencies, 50)), 4),
+        "p99_ms": round(float(np.percentile(latencies, 99)), 4),
+    }
+    logging.info(row)
+    return row
+
+def benchmark(df: pd.DataFrame, vectors: np.ndarray, queries: np.ndarray, expected: list[set],
+              scale: int, levels, top_groups, k: int, cosine: float) -> list[dict]:
+    scaled, corpus = replicate(df, vectors, scale, cosine)
+    doc_ids = scaled["doc_id"].to_numpy()
+    queries = prepare_vectors(queries, {"normalize": True})
+
+    meta = make_meta("flat", corpus.shape[1])
+    index = build_index(meta, corpus, scaled["vector_id"].to_numpy())
+    exact, latencies = [], []
+    for q in queries:
+        t0 = time.perf_counter()
+        _, I = index.search(q.reshape(1, -1), k)
+        latencies.append((time.perf_counter() - t0) * 1000)
+        exact.append(I[0])
+    rows = [summarize("flat", scale, len(scaled), exact, exact, latencies, [len(scaled)] * len(queries),
+                      doc_ids, expected, k)]
+    del index
+
+    for level in levels:
+        groups = GroupIndex.build(scaled, corpus, level)
+        for n_groups in top_groups:
+            found, latencies, candidates = [], [], []
+            for q in queries:
+                t0 = time.perf_counter()
+                ids = groups.candidates(q.reshape(1, -1), n_groups)[0]
+                _, top = top_k_subset(corpus[ids], ids, q, k)
+                latencies.append((time.perf_counter() - t0) * 1000)
+                found.append(top)
+                candidates.append(len(ids))
+            rows.append(summarize(f"{level}/top{n_groups}", scale, len(scaled), found, exact, latencies,
+                                  candidates, doc_ids, expected, k))
+    return rows
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de búsqueda jerárquica (recall@k vs plana y latencia)")
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--levels", nargs="+", default=list(HIERARCHY_LEVELS), choices=HIERARCHY_LEVELS)
+    parser.add_argument("--top-groups", nargs="+", type=int, default=[4, 8, 16, 32])
+    parser.add_argument("--scales", nargs="+", type=int, default=[1, 10, 100],
+                        help="Veces que se replica el corpus")
+    parser.add_argument("--replica-cosine", type=float, default=REPLICA_COSINE,
+                        help="Coseno medio de cada vector replicado con su original")
+    parser.add_argument("--gold-set", default="eval/gold_set.jsonl")
+    parser.add_argument("--output", default="eval/bench_hierarchy.json")
+    args = parser.parse_args()
+
+    df, vectors = load_corpus()
+    questions, expected = load_gold_set(args.gold_set)
+    queries = EmbeddingEngine().encode(questions, show_progress=False)
+
+    rows = []
+    for scale in args.scales:
+        rows += benchmark(df, vectors, queries, expected, scale, args.levels, args.top_groups, args.k, args.replica_cosine)
+
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(rows, f, ensure_ascii=False, indent=2)
+    print("\n--- BÚSQUEDA JERÁRQUICA VS PLANA ---")
+    print(pd.DataFrame(rows).to_string(index=False))
+    print(f"Resultados guardados en {args.output}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+import os
+import json
+import time
+import argparse
+import logging
+import numpy as np
+import pandas as pd
+import faiss
+
+from rag.embed import DATA_PATH, EmbeddingEngine, embed_with_cache, ensure_vector_ids
+from rag.manifest import EmbeddingCache
+from rag.index_factory import INDEX_TYPES, build_index, make_meta, prepare_vectors
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+# Compara cada tipo de índice contra la búsqueda exacta ("flat"):
+# recall@k, latencia p50/p95/p99 por consulta, QPS por tamaño de lote,
+# tiempo de construcción, tamaño y memoria. eval.benchmark lo reutiliza por escala.
+
+def load_corpus_vectors() -> tuple[np.ndarray, np.ndarray]:
+    """Vectores de los chunks (desde la caché de embeddings cuando es posible) y sus ids."""
+    df = ensure_vector_ids(pd.read_parquet(DATA_PATH))
+    vectors, _ = embed_with_cache(df["text"].tolist(), df["text_hash"].tolist(), EmbeddingCache(), EmbeddingEngine)
+    return vectors, df["vector_id"].to_numpy(dtype=np.int64)
+
+def load_query_vectors(gold_set_path: str) -> np.ndarray:
+    with open(gold_set_path, 'r', encoding='utf-8') as f:
+        questions = [json.loads(line)["question"] for line in f]
+    return EmbeddingEngine().encode(questions, show_progress=False)
+
+def recall_at_k(approx_ids: np.ndarray, exact_ids: np.ndarray) -> float:
+    hits = [len(set(a[a != -1]) & set(e[e != -1])) / max(1, (e != -1).sum()) for a, e in zip(approx_ids, exact_ids)]
+    return float(np.mean(hits))
+
+def rss_mb() -> float:
+    """Memoria residente actual del proceso (Linux); NaN si no está disponible."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 1e6
+    except (OSError, ValueError):
+        return float("nan")
+
+def percentiles_ms(latencies: list) -> dict:
+    p50, p95, p99 = np.percentile(np.array(latencies) * 1000, [50, 95, 99])
+    return {"p50_ms": round(float(p50), 4), "p95_ms": round(float(p95), 4), "p99_ms": round(float(p99), 4)}
+
+def benchmark(index_types, corpus: np.ndarray, ids: np.ndarray, queries: np.ndarray, k: int,
+              batch_sizes=(), exact_ids: np.ndarray = None) -> list[dict]:
+    """Una fila por tipo de índice; `exact_ids` evita recalcular la búsqueda exacta si ya se tiene."""
+    if exact_ids is None:
+        flat_meta = make_meta("flat", corpus.shape[1])
+        exact = build_index(flat_meta, prepare_vectors(corpus, flat_meta), ids)
+        _, exact_ids = exact.search(prepare_vectors(queries, flat_meta), k)
+        del exact
+
+    rows = []
+    for index_type in index_types:
+        meta = make_meta(index_type, corpus.shape[1])
+        rss_before = rss_mb()
+        start = time.perf_counter()
+        index = build_index(meta, prepare_vectors(corpus, meta), ids)
+        build_s = time.perf_counter() - start
+        rss_after = rss_mb()
+
+        prepared = prepare_vectors(queries, meta)
+        latencies = []
+        found = []
+        for q in prepared:
+            t0 = time.perf_counter()
+            _, I = index.search(q.reshape(1, -1), k)
+            latencies.append(time.perf_counter() - t0)
+            found.append(I[0])
+
+        qps = {}
+        for batch_size in batch_sizes:
+            t0 = time.perf_counter()
+            for i in range(0, len(prepared), batch_size):
+                index.search(prepared[i:i + batch_size], k)
+            qps[f"qps_batch_{batch_size}"] = round(len(prepared) / (time.perf_counter() - t0), 1)
+
+        rows.append({
+            "index_type": index_type,
+            "params": meta["params"],
+            "build_s": round(build_s, 4),
+            f"recall@{k}": round(recall_at_k(np.array(found), exact_ids), 4),
+            **percentiles_ms(latencies),
+            **qps,
+            "size_mb": round(len(faiss.serialize_index(index)) / 1e6, 3),
+            "rss_delta_mb": round(rss_after - rss_before, 1),
+        })
+        logging.info(f"{index_type}: {rows[-1]}")
+        del index
+    return rows
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de tipos de índice FAISS (recall@k vs flat y latencia)")
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--types", nargs="+", default=[t for t in INDEX_TYPES if t != "flat_l2"], choices=INDEX_TYPES)
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[], help="Mide también QPS por lote")
+    parser.add_argument("--gold-set", default="eval/gold_set.jsonl")
+    parser.add_argument("--output", default="eval/bench_index.json")
+    args = parser.parse_args()
+
+    corpus, ids = load_corpus_vectors()
+    queries = load_query_vectors(args.gold_set)
+    rows = benchmark(args.types, corpus, ids, queries, args.k, args.batch_sizes)
+
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(rows, f, ensure_ascii=False, indent=2)
+    print("\n--- BENCHMARK DE ÍNDICES ---")
+    print(pd.DataFrame(rows).drop(columns=["params"]).to_string(index=False))
+    print(f"Resultados guardados en {args.output}")
+
+if __name__ == "__main__":
+    main()
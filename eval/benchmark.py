@@ -0,0 +1,183 @@
+import csv
+import copy
+import json
+import time
+import argparse
+import logging
+import platform
+import subprocess
+from datetime import datetime, timezone
+import numpy as np
+import pandas as pd
+import faiss
+
+from rag.embed import DATA_PATH, EmbeddingEngine
+from rag.retrieve import Retriever, RETRIEVAL_MODES
+from rag.index_factory import INDEX_TYPES
+from eval.bench_index import benchmark, load_corpus_vectors, percentiles_ms
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+# Benchmark del camino de recuperación, sin LLM ni claves de proveedores:
+# - throughput de embeddings (chunks/s)
+# - por escala del corpus sintético y tipo de índice: tiempo de construcción,
+#   latencia p50/p95/p99 por consulta, QPS por tamaño de lote, memoria y recall@k vs flat
+# - latencia de extremo a extremo de Retriever.search y recall@k contra las
+#   `expected_citations` del gold set, por modo (dense/lexical/hybrid) y con/sin jerarquía
+# El reporte (JSON + CSV) incluye el commit para comparar entre versiones.
+
+DEFAULT_SCALES = [10_000, 100_000]
+DEFAULT_BATCH_SIZES = [1, 8, 32, 128]
+# Coseno medio de cada réplica (y de las consultas sintéticas) con su vector de origen:
+# parecidas pero no idénticas, con independencia de la dimensión del modelo
+REPLICA_COSINE = 0.95
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def perturb(vectors: np.ndarray, cosine: float, rng: np.random.Generator) -> np.ndarray:
+    """
+    Copia de `vectors` con ruido gaussiano tal que cada fila conserva, en promedio,
+    coseno `cosine` con la original. El ruido por componente se escala con la
+    norma de la fila y 1/sqrt(dim): σ = ‖v‖·tan(acos(cosine))/√dim.
+    """
+    vectors = np.asarray(vectors, dtype=np.float32)
+    sigma = np.linalg.norm(vectors, axis=1, keepdims=True) * np.tan(np.arccos(cosine)) / np.sqrt(vectors.shape[1])
+    return (vectors + rng.standard_normal(vectors.shape, dtype=np.float32) * sigma).astype(np.float32)
+
+
+def scale_corpus(vectors: np.ndarray, n: int, seed: int = 0) -> tuple[np.ndarray, np.ndarray]:
+    """Replica el corpus real hasta `n` vectores con ruido; ids 0..n-1."""
+    rng = np.random.default_rng(seed)
+    reps = vectors[np.arange(n) % len(vectors)]
+    return perturb(reps, REPLICA_COSINE, rng), np.arange(n, dtype=np.int64)
+
+
+def make_queries(corpus: np.ndarray, gold_vectors: np.ndarray, n: int, seed: int = 1) -> np.ndarray:
+    """Preguntas del gold set más vectores del corpus perturbados, hasta `n` consultas."""
+    rng = np.random.default_rng(seed)
+    extra = max(0, n - len(gold_vectors))
+    sampled = corpus[rng.integers(0, len(corpus), extra)]
+    sampled = perturb(sampled, REPLICA_COSINE, rng)
+    return np.vstack([gold_vectors, sampled]).astype(np.float32)[:n]
+
+
+def bench_embeddings(texts: list, sample: int) -> dict:
+    engine = EmbeddingEngine()
+    texts = texts[:sample]
+    engine.encode(texts[:8], show_progress=False)  # calentamiento
+    start = time.perf_counter()
+    engine.encode(texts, show_progress=False)
+    elapsed = time.perf_counter() - start
+    return {"texts": len(texts), "seconds": round(elapsed, 3), "chunks_per_s": round(len(texts) / elapsed, 1)}
+
+
+def citation_recall(found: list, expected: list) -> float:
+    """
+    Fracción de documentos esperados (`expected_citations` del gold set) que
+    aparecen entre los resultados, promediada sobre las preguntas que tienen alguno.
+    """
+    scores = [len({d["doc_id"] for d in docs} & set(exp)) / len(exp) for docs, exp in zip(found, expected) if exp]
+    return float(np.mean(scores)) if scores else float("nan")
+
+
+def bench_retriever(questions: list, expected: list, k: int, repeats: int) -> list[dict]:
+    """
+    Latencia de Retriever.search (embedding + búsqueda + lectura de chunks) y
+    recall@k contra el gold set, por modo y con/sin búsqueda jerárquica.
+    """
+    base = Retriever()
+    modes = RETRIEVAL_MODES if base.lexical is not None else ("dense",)
+    hierarchical = (False, True) if base.hierarchy is not None else (False,)
+    rows = []
+    for mode in modes:
+        for flag in hierarchical:
+            if flag and mode == "lexical":
+                continue  # BM25 no usa el índice de grupos
+            retriever = copy.copy(base)
+            retriever.hierarchical = flag
+            retriever.search(questions[0], k, mode=mode)  # calentamiento
+            latencies = []
+            for _ in range(repeats):
+                for question in questions:
+                    t0 = time.perf_counter()
+                    retriever.search(question, k, mode=mode)
+                    latencies.append(time.perf_counter() - t0)
+            t0 = time.perf_counter()
+            found = retriever.search_batch(questions, k, mode=mode)
+            batch_qps = len(questions) / (time.perf_counter() - t0)
+            rows.append({"mode": mode, "hierarchical": flag, "index_type": retriever.index_type,
+                         "vectors": int(retriever.index.ntotal),
+                         f"recall@{k}": round(citation_recall(found, expected), 4),
+                         **percentiles_ms(latencies), "qps_search_batch": round(batch_qps, 1)})
+            logging.info(f"Retriever ({mode}, jerárquica={flag}): {rows[-1]}")
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark offline de recuperación (sin LLM)")
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--scales", type=int, nargs="+", default=DEFAULT_SCALES,
+                        help="Tamaños del corpus sintético (ej. 100000 1000000)")
+    parser.add_argument("--types", nargs="+", default=[t for t in INDEX_TYPES if t != "flat_l2"], choices=INDEX_TYPES)
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=DEFAULT_BATCH_SIZES)
+    parser.add_argument("--num-queries", type=int, default=200)
+    parser.add_argument("--embed-sample", type=int, default=512, help="Chunks a codificar para medir throughput")
+    parser.add_argument("--repeats", type=int, default=5, help="Repeticiones del gold set en Retriever.search")
+    parser.add_argument("--gold-set", default="eval/gold_set.jsonl")
+    parser.add_argument("--output", default="eval/benchmark", help="Prefijo de los reportes (.json y .csv)")
+    args = parser.parse_args()
+
+    with open(args.gold_set, 'r', encoding='utf-8') as f:
+        gold = [json.loads(line) for line in f]
+    questions = [item["question"] for item in gold]
+    expected = [item.get("expected_citations", []) for item in gold]
+
+    corpus, _ = load_corpus_vectors()
+    gold_vectors = EmbeddingEngine().encode(questions, show_progress=False)
+    texts = pd.read_parquet(DATA_PATH, columns=["text"])["text"].tolist()
+
+    report = {
+        "commit": git_commit(),
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "platform": platform.platform(),
+        "python": platform.python_version(),
+        "faiss": faiss.__version__,
+        "dim": int(corpus.shape[1]),
+        "corpus_chunks": int(len(corpus)),
+        "k": args.k,
+        "embedding": bench_embeddings(texts, args.embed_sample),
+        "retriever": bench_retriever(questions, expected, args.k, args.repeats),
+        "indexes": [],
+    }
+    logging.info(f"Embeddings: {report['embedding']}")
+
+    for scale in args.scales:
+        scaled, ids = scale_corpus(corpus, scale)
+        queries = make_queries(scaled, gold_vectors, args.num_queries)
+        for row in benchmark(args.types, scaled, ids, queries, args.k, args.batch_sizes):
+            report["indexes"].append({"scale": scale, **row, "params": json.dumps(row["params"])})
+
+    with open(f"{args.output}.json", "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    with open(f"{args.output}.csv", "w", encoding="utf-8", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=["commit", *report["indexes"][0].keys()] if report["indexes"] else ["commit"])
+        writer.writeheader()
+        for row in report["indexes"]:
+            writer.writerow({"commit": report["commit"], **row})
+
+    print("\n--- BENCHMARK DE RECUPERACIÓN ---")
+    print(f"Embeddings: {report['embedding']['chunks_per_s']} chunks/s")
+    print(pd.DataFrame(report["retriever"]).to_string(index=False))
+    print(pd.DataFrame(report["indexes"]).drop(columns=["params"]).to_string(index=False))
+    print(f"Reportes guardados en {args.output}.json y {args.output}.csv")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,13 +1,18 @@
 
-import json
+import os
 import re
+import json
+import time
+import asyncio
+import argparse
+import numpy as np
 import pandas as pd
 import logging
-from sentence_transformers import SentenceTransformer, util
+from sentence_transformers import SentenceTransformer
 
 # Importa tus clases del proyecto
 from rag.pipeline import RAGPipeline
-from rag.retrieve import Retriever
+from rag.retrieve import Retriever, RETRIEVAL_MODES
 from providers.chatgpt import ChatGPTProvider
 from providers.deepseek import DeepSeekProvider
 
@@ -20,13 +25,16 @@ def calculate_exact_match(generated_answer: str, expected_answer: str) -> float:
     """Calcula si las respuestas son idénticas después de normalizar."""
     return 1.0 if generated_answer.strip().lower() == expected_answer.strip().lower() else 0.0
 
-def calculate_cosine_similarity(generated_answer: str, expected_answer: str, model) -> float:
-    """Calcula la similitud semántica entre dos textos."""
-    if not generated_answer or not expected_answer:
-        return 0.0
-    emb1 = model.encode(generated_answer, convert_to_tensor=True)
-    emb2 = model.encode(expected_answer, convert_to_tensor=True)
-    return util.cos_sim(emb1, emb2).item()
+def calculate_cosine_similarities(generated_answers: list, expected_answers: list, model) -> list[float]:
+    """Similitud coseno fila a fila; codifica todas las respuestas en una sola llamada al modelo."""
+    if not generated_answers:
+        return []
+    embeddings = model.encode(list(generated_answers) + list(expected_answers), normalize_embeddings=True,
+                              batch_size=64, show_progress_bar=False)
+    generated, expected = embeddings[:len(generated_answers)], embeddings[len(generated_answers):]
+    similarities = np.sum(np.asarray(generated) * np.asarray(expected), axis=1)
+    return [float(sim) if gen and exp else 0.0
+            for sim, gen, exp in zip(similarities, generated_answers, expected_answers)]
 
 def calculate_citation_presence(generated_answer: str, final_docs: list) -> float:
     """Mide si la respuesta generada cita las fuentes que se le proporcionaron."""
@@ -59,14 +67,92 @@ def calculate_precision_at_k(retrieved_docs: list, expected_citations: list) ->
     return len(relevant_retrieved) / len(expected_citations)
 
 # --- 2. Orquestador de la Evaluación ---
+#
+# Cada pregunta genera UNA respuesta hipotética (HyDE) y UNA búsqueda, que se
+# reutilizan para prec@k y para el contexto de todos los proveedores. Las
+# síntesis (preguntas × proveedores) corren en paralelo con un límite de
+# concurrencia, y cada resultado se guarda en un checkpoint JSONL: si la
+# evaluación se interrumpe, al relanzarla solo se procesa lo que falta.
+
+INITIAL_K = 20
+FINAL_K = 3
+HYDE_PROVIDER = "DeepSeek"
+
+def load_checkpoint(path: str) -> tuple[dict, dict]:
+    """Lee el checkpoint: (respuestas HyDE por pregunta, resultados por (pregunta, proveedor))."""
+    hyde, items = {}, {}
+    if not os.path.exists(path):
+        return hyde, items
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue  # línea a medio escribir por una interrupción
+            if record["kind"] == "hyde":
+                hyde[record["question"]] = record["hypothetical_answer"]
+            else:
+                items[(record["question"], record["provider"])] = record
+    return hyde, items
+
+def append_checkpoint(f, record: dict):
+    f.write(json.dumps(record, ensure_ascii=False) + "\n")
+    f.flush()
+
+async def generate_hyde(pipeline: RAGPipeline, questions: list, hyde: dict, semaphore, checkpoint):
+    async def one(question):
+        async with semaphore:
+            answer = await pipeline.agenerate_hypothetical_answer(question)
+        hyde[question] = answer
+        append_checkpoint(checkpoint, {"kind": "hyde", "question": question, "hypothetical_answer": answer})
+        logging.info(f"HyDE {len(hyde)}/{len(questions)}: '{question}'")
+
+    await asyncio.gather(*(one(q) for q in questions if q not in hyde))
+
+async def synthesize_all(jobs: list, items: dict, semaphore, checkpoint):
+    async def one(pipeline, provider_name, item, docs, precisions):
+        async with semaphore:
+            start = time.perf_counter()
+            raw_answer = await pipeline.asynthesize(item['question'], docs)
+            latency = time.perf_counter() - start
+        record = {
+            "kind": "item",
+            "provider": provider_name,
+            "question": item['question'],
+            "generated_answer": pipeline.postprocess(raw_answer),
+            "expected_answer": item['expected_answer'],
+            "sources": [{"doc_id": d.get("doc_id"), "page": d.get("page")} for d in docs],
+            "latency_s": round(latency, 3),
+            **precisions,
+        }
+        items[(item['question'], provider_name)] = record
+        append_checkpoint(checkpoint, record)
+        logging.info(f"[{len(items)}] {provider_name}: '{item['question']}' ({latency:.2f}s)")
+
+    await asyncio.gather(*(one(*job) for job in jobs))
 
 def main():
+    parser = argparse.ArgumentParser(description="Evaluación del pipeline RAG sobre el gold set")
+    parser.add_argument("--gold-set", default="eval/gold_set.jsonl")
+    parser.add_argument("--output", default="eval/evaluation_results.csv")
+    parser.add_argument("--checkpoint", default="eval/evaluation_checkpoint.jsonl",
+                        help="Resultados parciales; se retoman al relanzar")
+    parser.add_argument("--fresh", action="store_true", help="Ignora el checkpoint y evalúa todo de nuevo")
+    parser.add_argument("--concurrency", type=int, default=8, help="Llamadas simultáneas al LLM")
+    args = parser.parse_args()
+
     logging.info("Iniciando evaluación...")
+    start = time.perf_counter()
 
-    gold_set_path = 'eval/gold_set.jsonl'
-    with open(gold_set_path, 'r', encoding='utf-8') as f:
+    with open(args.gold_set, 'r', encoding='utf-8') as f:
         gold_set = [json.loads(line) for line in f]
 
+    if args.fresh and os.path.exists(args.checkpoint):
+        os.remove(args.checkpoint)
+    hyde, items = load_checkpoint(args.checkpoint)
+    if items or hyde:
+        logging.info(f"Retomando desde {args.checkpoint}: {len(hyde)} HyDE y {len(items)} resultados ya calculados.")
+
     retriever = Retriever()
     providers = {
         "ChatGPT": ChatGPTProvider(),
@@ -74,54 +160,72 @@ def main():
     }
     # V--- ¡AQUÍ ESTABA EL ERROR! CORREGIDO ---V
     similarity_model = SentenceTransformer('all-MiniLM-L6-v2') 
-    
-    results = []
-    INITIAL_K = 20 
-
-    for i, item in enumerate(gold_set):
-        logging.info(f"Procesando pregunta {i+1}/{len(gold_set)}: '{item['question']}'")
-        
-        # --- Paso A: Simular Recuperación Inicial y Calcular Prec@k ---
-        pipeline_for_hyde = RAGPipeline(provider=providers["DeepSeek"], retriever=retriever, k=3)
-        hypothetical_answer_for_eval = pipeline_for_hyde.generate_hypothetical_answer(item['question'])
-        
-        initial_docs = retriever.search(hypothetical_answer_for_eval, top_k=INITIAL_K)
-        precision = calculate_precision_at_k(initial_docs, item['expected_citations'])
-        
-        # --- Paso B: Generar respuestas para cada proveedor ---
-        for provider_name, provider_instance in providers.items():
-            pipeline = RAGPipeline(provider=provider_instance, retriever=retriever, k=3)
-            
-            result = pipeline.run(item['question'])
-            generated_answer = result['answer']
-
-            # --- Paso C: Calcular métricas de generación ---
-            em = calculate_exact_match(generated_answer, item['expected_answer'])
-            sim = calculate_cosine_similarity(generated_answer, item['expected_answer'], similarity_model)
-            cite_present = calculate_citation_presence(generated_answer, result['sources'])
-            
-            results.append({
-                "provider": provider_name,
-                "question": item['question'],
-                "generated_answer": generated_answer,
-                "expected_answer": item['expected_answer'],
-                "precision_at_k": precision,
-                "exact_match": em,
-                "cosine_similarity": sim,
-                "citation_presence": cite_present,
-            })
+    pipelines = {name: RAGPipeline(provider=p, retriever=retriever, k=FINAL_K) for name, p in providers.items()}
+
+    pending = [item for item in gold_set
+               if any((item['question'], name) not in items for name in providers)]
+
+    async def run_pending():
+        semaphore = asyncio.Semaphore(args.concurrency)
+        with open(args.checkpoint, 'a', encoding='utf-8') as checkpoint:
+            # --- Paso A: HyDE una vez por pregunta (en paralelo) ---
+            questions = [item['question'] for item in pending]
+            await generate_hyde(pipelines[HYDE_PROVIDER], questions, hyde, semaphore, checkpoint)
+
+            # --- Paso B: una búsqueda por lote para prec@k (por modo) y para el contexto ---
+            hypothetical_answers = [hyde[q] for q in questions]
+            modes = RETRIEVAL_MODES if retriever.lexical is not None else ("dense",)
+            docs_per_mode = {}
+            for mode in modes:
+                docs_per_mode[mode] = await asyncio.to_thread(
+                    retriever.search_batch, hypothetical_answers, INITIAL_K, mode)
+            initial_docs = docs_per_mode["dense"]  # el Retriever() por defecto es denso
+            final_docs = await asyncio.to_thread(retriever.search_batch, hypothetical_answers, FINAL_K)
+
+            # --- Paso C: síntesis preguntas × proveedores con el mismo contexto ---
+            jobs = []
+            for i, item in enumerate(pending):
+                precisions = {"precision_at_k": calculate_precision_at_k(initial_docs[i], item['expected_citations'])}
+                for mode, docs in docs_per_mode.items():
+                    precisions[f"precision_at_k_{mode}"] = calculate_precision_at_k(docs[i], item['expected_citations'])
+                for provider_name, pipeline in pipelines.items():
+                    if (item['question'], provider_name) in items:
+                        continue
+                    context = pipeline.build_context(final_docs[i])
+                    jobs.append((pipeline, provider_name, item, context, precisions))
+            await synthesize_all(jobs, items, semaphore, checkpoint)
+
+    if pending:
+        asyncio.run(run_pending())
+
+    # --- Paso D: métricas de generación (un solo encode para todas las respuestas) ---
+    results = [items[(item['question'], name)] for item in gold_set for name in providers
+               if (item['question'], name) in items]
+    generated = [r['generated_answer'] for r in results]
+    expected = [r['expected_answer'] for r in results]
+    similarities = calculate_cosine_similarities(generated, expected, similarity_model)
+    for record, sim in zip(results, similarities):
+        record["exact_match"] = calculate_exact_match(record['generated_answer'], record['expected_answer'])
+        record["cosine_similarity"] = sim
+        record["citation_presence"] = calculate_citation_presence(record['generated_answer'], record['sources'])
 
     # --- 3. Reporte de Resultados ---
-    df_results = pd.DataFrame(results)
-    df_results.to_csv("eval/evaluation_results.csv", index=False)
-    logging.info("Resultados detallados guardados en 'eval/evaluation_results.csv'")
-    
-    summary = df_results.groupby('provider')[['precision_at_k', 'exact_match', 'cosine_similarity', 'citation_presence']].mean()
+    if not results:
+        logging.warning("No hay resultados que reportar (¿gold set vacío?).")
+        return
+    df_results = pd.DataFrame(results).drop(columns=["kind", "sources"])
+    df_results.to_csv(args.output, index=False)
+    logging.info(f"Resultados detallados guardados en '{args.output}'")
+
+    metric_columns = [c for c in df_results.columns if c.startswith("precision_at_k")]
+    metric_columns += ['exact_match', 'cosine_similarity', 'citation_presence', 'latency_s']
+    summary = df_results.groupby('provider')[metric_columns].mean()
     
     print("\n--- RESUMEN DE LA EVALUACIÓN ---")
     print(summary)
+    print(f"Tiempo total: {time.perf_counter() - start:.1f}s")
     print("---------------------------------")
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
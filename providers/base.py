@@ -1,3 +1,4 @@
+import asyncio
 from abc import ABC, abstractmethod
 
 class Provider(ABC):
@@ -17,8 +18,19 @@ class Provider(ABC):
         Args:
             messages: lista de mensajes en formato [{"role": "user", "content": "texto"}]
             **kwargs: parámetros adicionales como temperature, max_tokens, etc.
+                Con stream=True la respuesta se entrega por partes.
 
         Returns:
-            str: respuesta generada por el modelo.
+            str: respuesta generada por el modelo, o un iterador de fragmentos
+            de texto si se pidió stream=True.
         """
         pass
+
+    async def achat(self, messages: list[dict], **kwargs) -> str:
+        """
+        Versión asíncrona de `chat`.
+
+        Por defecto ejecuta `chat` en un hilo; los proveedores con cliente
+        asíncrono propio la sobrescriben para no ocupar hilos mientras esperan.
+        """
+        return await asyncio.to_thread(self.chat, messages, **kwargs)
@@ -3,18 +3,26 @@
 import os
 import logging  # NUEVO
 from openai import OpenAI, APITimeoutError, APIConnectionError  # NUEVO: Importar excepciones
+from .base import Provider
+from .pool import get_async_client
+from rag.metrics import record_usage, span
 
 # NUEVO
 logger = logging.getLogger(__name__)
 
-class ChatGPTProvider:
-    def __init__(self, model="openai/gpt-4.1-mini"):
+class ChatGPTProvider(Provider):
+    def __init__(self, model="openai/gpt-4.1-mini", timeout: float = 20.0, max_retries: int = 2):
+        self.api_key = os.getenv("OPENAI_API_KEY")
+        # Permite apuntar a otro servidor compatible con OpenAI (ej. uno local de pruebas)
+        self.base_url = os.getenv("OPENAI_BASE_URL", "https://openrouter.ai/api/v1")
+        self.timeout = timeout  # Esperar máximo 20 segundos por una respuesta (por defecto)
+        self.max_retries = max_retries  # Reintentar la llamada hasta 2 veces si falla (por defecto)
         self.client = OpenAI(
-            api_key=os.getenv("OPENAI_API_KEY"),
-            base_url="https://openrouter.ai/api/v1",
+            api_key=self.api_key,
+            base_url=self.base_url,
             # NUEVO: Añadir timeout y reintentos
-            timeout=20.0,  # Esperar máximo 20 segundos por una respuesta
-            max_retries=2, # Reintentar la llamada hasta 2 veces si falla
+            timeout=self.timeout,
+            max_retries=self.max_retries,
         )
         self.model = model
 
@@ -23,20 +31,68 @@ class ChatGPTProvider:
         return "ChatGPT (via OpenRouter)"
 
     def chat(self, messages, **kwargs):
+        # Con stream=True se devuelve un iterador de fragmentos de texto
+        if kwargs.pop("stream", False):
+            return self._chat_stream(messages, **kwargs)
+
         # NUEVO: Manejo de errores específico para la llamada a la API
         try:
-            response = self.client.chat.completions.create(
+            with span("llm", provider=self.name):
+                response = self.client.chat.completions.create(
+                    model=self.model,
+                    messages=messages,
+                    **kwargs
+                )
+            record_usage(self.name, response.usage)
+            return response.choices[0].message.content
+        except APITimeoutError as e:
+            logger.error(f"La petición a la API de OpenAI ha expirado: {e}")
+            raise  # Re-lanzamos la excepción para que el pipeline la maneje
+        except APIConnectionError as e:
+            logger.error(f"Error de conexión con la API de OpenAI: {e}")
+            raise
+        except Exception as e:
+            logger.error(f"Un error inesperado ocurrió en el proveedor de ChatGPT: {e}")
+            raise
+
+    def _chat_stream(self, messages, **kwargs):
+        try:
+            stream = self.client.chat.completions.create(
                 model=self.model,
                 messages=messages,
+                stream=True,
                 **kwargs
             )
+            for chunk in stream:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
+        except APITimeoutError as e:
+            logger.error(f"La petición a la API de OpenAI ha expirado: {e}")
+            raise
+        except APIConnectionError as e:
+            logger.error(f"Error de conexión con la API de OpenAI: {e}")
+            raise
+        except Exception as e:
+            logger.error(f"Un error inesperado ocurrió en el proveedor de ChatGPT: {e}")
+            raise
+
+    async def achat(self, messages, **kwargs):
+        client = get_async_client(self.api_key, self.base_url, self.timeout, self.max_retries)
+        try:
+            with span("llm", provider=self.name):
+                response = await client.chat.completions.create(
+                    model=self.model,
+                    messages=messages,
+                    **kwargs
+                )
+            record_usage(self.name, response.usage)
             return response.choices[0].message.content
         except APITimeoutError as e:
             logger.error(f"La petición a la API de OpenAI ha expirado: {e}")
-            raise  # Re-lanzamos la excepción para que el pipeline la maneje
+            raise
         except APIConnectionError as e:
             logger.error(f"Error de conexión con la API de OpenAI: {e}")
             raise
         except Exception as e:
             logger.error(f"Un error inesperado ocurrió en el proveedor de ChatGPT: {e}")
-            raise
\ No newline at end of file
+            raise
@@ -5,6 +5,8 @@ import logging # NUEVO
 from dotenv import load_dotenv
 from openai import OpenAI, APITimeoutError, APIConnectionError # NUEVO
 from .base import Provider
+from .pool import get_async_client
+from rag.metrics import record_usage, span
 
 load_dotenv()
 
@@ -12,13 +14,18 @@ load_dotenv()
 logger = logging.getLogger(__name__)
 
 class DeepSeekProvider(Provider):
-    def __init__(self, model: str = "deepseek-chat"):
+    def __init__(self, model: str = "deepseek-chat", timeout: float = 20.0, max_retries: int = 2):
+        self.api_key = os.getenv("DEEPSEEK_API_KEY")
+        # Permite apuntar a otro servidor compatible con OpenAI (ej. uno local de pruebas)
+        self.base_url = os.getenv("DEEPSEEK_BASE_URL", "https://api.deepseek.com")
+        self.timeout = timeout
+        self.max_retries = max_retries
         self.client = OpenAI(
-            api_key=os.getenv("DEEPSEEK_API_KEY"),
-            base_url="https://api.deepseek.com",
+            api_key=self.api_key,
+            base_url=self.base_url,
             # NUEVO: Añadir timeout y reintentos
-            timeout=20.0,
-            max_retries=2,
+            timeout=self.timeout,
+            max_retries=self.max_retries,
         )
         self.model = model
 
@@ -27,13 +34,61 @@ class DeepSeekProvider(Provider):
         return "deepseek"
 
     def chat(self, messages: list[dict], **kwargs) -> str:
+        # Con stream=True se devuelve un iterador de fragmentos de texto
+        if kwargs.pop("stream", False):
+            return self._chat_stream(messages, **kwargs)
+
         # NUEVO: Manejo de errores específico para la llamada a la API
         try:
-            response = self.client.chat.completions.create(
+            with span("llm", provider=self.name):
+                response = self.client.chat.completions.create(
+                    model=self.model,
+                    messages=messages,
+                    **kwargs
+                )
+            record_usage(self.name, response.usage)
+            return response.choices[0].message.content
+        except APITimeoutError as e:
+            logger.error(f"La petición a la API de DeepSeek ha expirado: {e}")
+            raise
+        except APIConnectionError as e:
+            logger.error(f"Error de conexión con la API de DeepSeek: {e}")
+            raise
+        except Exception as e:
+            logger.error(f"Un error inesperado ocurrió en el proveedor de DeepSeek: {e}")
+            raise
+
+    def _chat_stream(self, messages, **kwargs):
+        try:
+            stream = self.client.chat.completions.create(
                 model=self.model,
                 messages=messages,
+                stream=True,
                 **kwargs
             )
+            for chunk in stream:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
+        except APITimeoutError as e:
+            logger.error(f"La petición a la API de DeepSeek ha expirado: {e}")
+            raise
+        except APIConnectionError as e:
+            logger.error(f"Error de conexión con la API de DeepSeek: {e}")
+            raise
+        except Exception as e:
+            logger.error(f"Un error inesperado ocurrió en el proveedor de DeepSeek: {e}")
+            raise
+
+    async def achat(self, messages: list[dict], **kwargs) -> str:
+        client = get_async_client(self.api_key, self.base_url, self.timeout, self.max_retries)
+        try:
+            with span("llm", provider=self.name):
+                response = await client.chat.completions.create(
+                    model=self.model,
+                    messages=messages,
+                    **kwargs
+                )
+            record_usage(self.name, response.usage)
             return response.choices[0].message.content
         except APITimeoutError as e:
             logger.error(f"La petición a la API de DeepSeek ha expirado: {e}")
@@ -43,4 +98,4 @@ class DeepSeekProvider(Provider):
             raise
         except Exception as e:
             logger.error(f"Un error inesperado ocurrió en el proveedor de DeepSeek: {e}")
-            raise
\ No newline at end of file
+            raise
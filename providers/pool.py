@@ -0,0 +1,46 @@
+# providers/pool.py
+
+import asyncio
+import weakref
+import httpx
+from openai import AsyncOpenAI
+
+# Conexiones HTTP por proveedor; suficiente para varias preguntas concurrentes
+MAX_CONNECTIONS = 32
+MAX_KEEPALIVE_CONNECTIONS = 16
+
+# Un cliente asíncrono por (event loop, endpoint): httpx ata su pool de
+# conexiones al loop en que se creó, así que no se puede compartir entre loops.
+_clients = weakref.WeakKeyDictionary()
+
+
+def get_async_client(api_key: str, base_url: str, timeout: float, max_retries: int) -> AsyncOpenAI:
+    """Devuelve el cliente AsyncOpenAI compartido (con pool de conexiones) para este endpoint."""
+    loop = asyncio.get_running_loop()
+    per_loop = _clients.setdefault(loop, {})
+    key = (base_url, api_key, timeout, max_retries)
+    client = per_loop.get(key)
+    if client is None:
+        http_client = httpx.AsyncClient(
+            timeout=timeout,
+            limits=httpx.Limits(
+                max_connections=MAX_CONNECTIONS,
+                max_keepalive_connections=MAX_KEEPALIVE_CONNECTIONS,
+            ),
+        )
+        client = AsyncOpenAI(
+            api_key=api_key,
+            base_url=base_url,
+            timeout=timeout,
+            max_retries=max_retries,
+            http_client=http_client,
+        )
+        per_loop[key] = client
+    return client
+
+
+async def aclose_clients():
+    """Cierra los clientes asíncronos creados en el loop actual."""
+    per_loop = _clients.pop(asyncio.get_running_loop(), {})
+    for client in per_loop.values():
+        await client.close()
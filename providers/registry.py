@@ -0,0 +1,26 @@
+# providers/registry.py
+
+import importlib
+
+# Nombre → "módulo:fábrica". Los módulos (y el SDK de OpenAI) se importan
+# recién cuando se pide el proveedor, así la CLI arranca sin cargarlos.
+PROVIDERS = {
+    "chatgpt": "providers.chatgpt:ChatGPTProvider",
+    "deepseek": "providers.deepseek:DeepSeekProvider",
+    # ChatGPT con DeepSeek de respaldo: hedging por p95 y circuit breaker
+    "routed": "providers.routed:default_routed_provider",
+}
+
+
+def provider_names() -> list[str]:
+    return list(PROVIDERS)
+
+
+def get_provider_factory(name: str):
+    """Clase o función que construye el proveedor `name` (KeyError si no existe)."""
+    module_name, attr = PROVIDERS[name].split(":")
+    return getattr(importlib.import_module(module_name), attr)
+
+
+def create_provider(name: str, **kwargs):
+    return get_provider_factory(name)(**kwargs)
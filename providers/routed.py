@@ -0,0 +1,278 @@
+# providers/routed.py
+
+import time
+import asyncio
+import logging
+import threading
+import contextvars
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import Optional
+import numpy as np
+from .base import Provider
+
+logger = logging.getLogger(__name__)
+
+# Latencias recientes por backend usadas para estimar el p95
+LATENCY_WINDOW = 200
+# Con menos muestras que esto aún no se confía en el p95 y se usa HEDGE_DEFAULT_S
+MIN_SAMPLES = 20
+HEDGE_DEFAULT_S = 3.0
+# Percentil de latencia a partir del cual se lanza la copia al siguiente backend
+HEDGE_PERCENTILE = 95
+HEDGE_MIN_S = 0.2
+# Circuit breaker: fallos consecutivos para abrir y segundos antes de volver a probar
+FAILURE_THRESHOLD = 5
+RESET_TIMEOUT_S = 30.0
+
+_hedge_executor = ThreadPoolExecutor(max_workers=32, thread_name_prefix="hedge")
+
+
+class CircuitOpenError(RuntimeError):
+    """Todos los backends tienen el circuito abierto."""
+
+
+class BackendStats:
+    """Latencia móvil, tasa de errores y estado del circuit breaker de un backend."""
+
+    def __init__(self, window: int = LATENCY_WINDOW):
+        self._lock = threading.Lock()
+        self.latencies = deque(maxlen=window)
+        self.outcomes = deque(maxlen=window)  # True = éxito
+        self.consecutive_failures = 0
+        self.opened_at = None
+        self.requests = 0
+        self.hedges = 0
+        self.wins = 0
+
+    def record_success(self, latency: float):
+        with self._lock:
+            self.latencies.append(latency)
+            self.outcomes.append(True)
+            self.consecutive_failures = 0
+            self.opened_at = None
+
+    def record_failure(self, failure_threshold: int):
+        with self._lock:
+            self.outcomes.append(False)
+            self.consecutive_failures += 1
+            if self.consecutive_failures >= failure_threshold and self.opened_at is None:
+                self.opened_at = time.monotonic()
+                return True
+        return False
+
+    def is_available(self, reset_timeout: float) -> bool:
+        """Cerrado, o abierto hace más de `reset_timeout` (medio abierto); no consume la prueba."""
+        with self._lock:
+            return self.opened_at is None or time.monotonic() - self.opened_at >= reset_timeout
+
+    def acquire(self, reset_timeout: float) -> bool:
+        """
+        Se llama al enviar de verdad una petición (y la cuenta). Con el circuito
+        medio abierto la toma como la única prueba del período; False si otra ya la tomó.
+        """
+        with self._lock:
+            if self.opened_at is not None:
+                if time.monotonic() - self.opened_at < reset_timeout:
+                    return False
+                self.opened_at = time.monotonic()
+            self.requests += 1
+            return True
+
+    def record_hedge(self):
+        with self._lock:
+            self.hedges += 1
+
+    def record_win(self):
+        with self._lock:
+            self.wins += 1
+
+    def percentile(self, q: float) -> Optional[float]:
+        with self._lock:
+            if len(self.latencies) < MIN_SAMPLES:
+                return None
+            return float(np.percentile(self.latencies, q))
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            latencies = list(self.latencies)
+            outcomes = list(self.outcomes)
+            return {
+                "requests": self.requests,
+                "hedges": self.hedges,
+                "wins": self.wins,
+                "p50_s": round(float(np.percentile(latencies, 50)), 3) if latencies else None,
+                "p95_s": round(float(np.percentile(latencies, 95)), 3) if latencies else None,
+                "error_rate": round(outcomes.count(False) / len(outcomes), 3) if outcomes else 0.0,
+                "circuit": "open" if self.opened_at is not None else "closed",
+            }
+
+
+class RoutedProvider(Provider):
+    """
+    Envía cada petición al backend preferido disponible y, si tarda más que su
+    p95 reciente (`hedge_percentile`), lanza una copia ("hedge") al siguiente;
+    gana la primera respuesta exitosa. Si más del 5% de las respuestas son
+    lentas, el p95 cae dentro de la cola y conviene bajar el percentil.
+
+    Los backends con fallos consecutivos quedan fuera (circuito abierto)
+    durante `reset_timeout` segundos; después reciben una sola petición de
+    prueba, que se consume solo cuando de verdad se les envía algo.
+
+    El orden de `backends` es la preferencia; los que tienen el circuito
+    abierto se omiten hasta que toque probarlos de nuevo.
+    """
+
+    def __init__(self, backends: list[Provider], hedge: bool = True,
+                 failure_threshold: int = FAILURE_THRESHOLD, reset_timeout: float = RESET_TIMEOUT_S,
+                 hedge_default_s: float = HEDGE_DEFAULT_S, hedge_percentile: float = HEDGE_PERCENTILE):
+        if not backends:
+            raise ValueError("RoutedProvider necesita al menos un backend")
+        self.backends = backends
+        self.hedge = hedge
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.hedge_default_s = hedge_default_s
+        self.hedge_percentile = hedge_percentile
+        self.stats = {b.name: BackendStats() for b in backends}
+        self.model = "+".join(getattr(b, "model", "") for b in backends)
+
+    @property
+    def name(self) -> str:
+        return "routed(" + ", ".join(b.name for b in self.backends) + ")"
+
+    def _ordered(self) -> list[Provider]:
+        available = [b for b in self.backends if self.stats[b.name].is_available(self.reset_timeout)]
+        if not available:
+            raise CircuitOpenError("Todos los proveedores tienen el circuito abierto")
+        return available
+
+    def hedge_delay(self, backend: Provider) -> float:
+        latency = self.stats[backend.name].percentile(self.hedge_percentile)
+        return self.hedge_default_s if latency is None else max(HEDGE_MIN_S, latency)
+
+    def _record(self, backend: Provider, start: float, error: Optional[BaseException]):
+        stats = self.stats[backend.name]
+        if error is None:
+            stats.record_success(time.perf_counter() - start)
+        elif stats.record_failure(self.failure_threshold):
+            logger.warning(f"Circuito abierto para {backend.name} tras {self.failure_threshold} fallos seguidos.")
+
+    def _acquire(self, backend: Provider):
+        """Reserva el envío a `backend` (CircuitOpenError si otra petición ya tomó su prueba)."""
+        if not self.stats[backend.name].acquire(self.reset_timeout):
+            raise CircuitOpenError(f"{backend.name}: circuito abierto (otra petición lo está probando)")
+
+    def _call(self, backend: Provider, messages, kwargs):
+        self._acquire(backend)
+        start = time.perf_counter()
+        try:
+            result = backend.chat(messages, **kwargs)
+        except Exception as e:
+            self._record(backend, start, e)
+            raise
+        self._record(backend, start, None)
+        return result
+
+    async def _acall(self, backend: Provider, messages, kwargs):
+        self._acquire(backend)
+        start = time.perf_counter()
+        try:
+            result = await backend.achat(messages, **kwargs)
+        except asyncio.CancelledError:
+            raise  # perdió la carrera: no cuenta como fallo
+        except Exception as e:
+            self._record(backend, start, e)
+            raise
+        self._record(backend, start, None)
+        return result
+
+    def _submit(self, backend: Provider, messages, kwargs):
+        # copy_context: las etapas del backend quedan en la traza de la petición
+        return _hedge_executor.submit(contextvars.copy_context().run, self._call, backend, messages, kwargs)
+
+    def chat(self, messages: list[dict], **kwargs) -> str:
+        if kwargs.pop("stream", False):
+            # Sin hedging para streaming: se usa el primer backend disponible
+            for backend in self._ordered():
+                try:
+                    self._acquire(backend)
+                except CircuitOpenError:
+                    continue
+                return backend.chat(messages, stream=True, **kwargs)
+            raise CircuitOpenError("Todos los proveedores tienen el circuito abierto")
+
+        order = self._ordered()
+        pending = {self._submit(order[0], messages, kwargs): order[0]}
+        remaining = order[1:]
+        last_error = None
+        timeout = self.hedge_delay(order[0]) if self.hedge else None
+        while pending:
+            done, _ = wait(pending, timeout=timeout if remaining else None, return_when=FIRST_COMPLETED)
+            if not done:
+                # El backend actual superó su p95: se lanza la copia al siguiente
+                backend = remaining.pop(0)
+                self.stats[backend.name].record_hedge()
+                logger.info(f"Hedge: enviando la petición también a {backend.name}.")
+                pending[self._submit(backend, messages, kwargs)] = backend
+                timeout = self.hedge_delay(backend)
+                continue
+            for future in done:
+                backend = pending.pop(future)
+                if future.exception() is None:
+                    # Las copias perdedoras terminan solas; su latencia igual se registra
+                    self.stats[backend.name].record_win()
+                    return future.result()
+                last_error = future.exception()
+            if not pending and remaining:
+                # Falló sin que hubiera copia en curso: se pasa al siguiente de inmediato
+                backend = remaining.pop(0)
+                pending[self._submit(backend, messages, kwargs)] = backend
+                timeout = self.hedge_delay(backend)
+        raise last_error
+
+    async def achat(self, messages: list[dict], **kwargs) -> str:
+        order = self._ordered()
+        pending = {asyncio.ensure_future(self._acall(order[0], messages, kwargs)): order[0]}
+        remaining = order[1:]
+        last_error = None
+        timeout = self.hedge_delay(order[0]) if self.hedge else None
+        try:
+            while pending:
+                done, _ = await asyncio.wait(pending, timeout=timeout if remaining else None,
+                                             return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    backend = remaining.pop(0)
+                    self.stats[backend.name].record_hedge()
+                    logger.info(f"Hedge: enviando la petición también a {backend.name}.")
+                    pending[asyncio.ensure_future(self._acall(backend, messages, kwargs))] = backend
+                    timeout = self.hedge_delay(backend)
+                    continue
+                for task in done:
+                    backend = pending.pop(task)
+                    if task.exception() is None:
+                        self.stats[backend.name].record_win()
+                        return task.result()
+                    last_error = task.exception()
+                if not pending and remaining:
+                    backend = remaining.pop(0)
+                    pending[asyncio.ensure_future(self._acall(backend, messages, kwargs))] = backend
+                    timeout = self.hedge_delay(backend)
+            raise last_error
+        finally:
+            # En asyncio sí se puede cancelar la copia que perdió
+            for task in pending:
+                task.cancel()
+
+    def snapshot(self) -> dict:
+        return {name: stats.snapshot() for name, stats in self.stats.items()}
+
+
+def default_routed_provider() -> RoutedProvider:
+    """
+    ChatGPT (OpenRouter) con DeepSeek como segundo backend. Los backends no
+    reintentan por su cuenta: el router ya cambia de proveedor ante fallos.
+    """
+    from .chatgpt import ChatGPTProvider
+    from .deepseek import DeepSeekProvider
+    return RoutedProvider([ChatGPTProvider(max_retries=0), DeepSeekProvider(max_retries=0)])
@@ -0,0 +1,329 @@
+import json
+import time
+import asyncio
+import logging
+import argparse
+from pathlib import Path
+from typing import Iterator, Optional
+
+from providers.base import Provider
+from .manifest import text_hash
+
+logger = logging.getLogger(__name__)
+
+# Responde en lote las preguntas de un archivo JSONL ({"id": ..., "question": ...}
+# por línea) con un solo Retriever cargado:
+# - las preguntas se leen por ventanas de `batch_size`; cada ventana hace HyDE en
+#   paralelo y UNA codificación + búsqueda FAISS para todas sus preguntas;
+# - las llamadas al LLM comparten un límite de concurrencia y cada proveedor
+#   tiene además un límite de llamadas por minuto;
+# - cada respuesta se agrega al JSONL de salida apenas está lista, así que al
+#   relanzar se saltan los (id, proveedor) ya respondidos.
+# Con --cache sqlite las respuestas quedan también en data/cache.sqlite (pre-calentado).
+
+DEFAULT_BATCH_SIZE = 32
+DEFAULT_CONCURRENCY = 8
+# Estrategias cuya recuperación se hace en lote; el resto usa RAGPipeline.aretrieve por pregunta
+BATCHED_STRATEGIES = ("direct", "hyde")
+NO_DOCS_ANSWER = "No se encontró información para esta pregunta."
+
+
+class RateLimiter:
+    """Token bucket asíncrono: a lo más `per_minute` llamadas por minuto (ráfagas de `burst`)."""
+
+    def __init__(self, per_minute: float, burst: int = 1):
+        self.rate = per_minute / 60.0
+        self.capacity = float(max(1, burst))
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class ThrottledProvider(Provider):
+    """
+    Envuelve un proveedor para el modo lote: cada `achat` espera su turno en el
+    límite por minuto del proveedor y luego un cupo de la concurrencia global.
+    Conserva `name` y `model`, así las claves de caché son las mismas de la web y la CLI.
+    """
+
+    def __init__(self, provider: Provider, semaphore: asyncio.Semaphore,
+                 rate_limiter: Optional[RateLimiter] = None):
+        self.provider = provider
+        self.semaphore = semaphore
+        self.rate_limiter = rate_limiter
+        self.model = getattr(provider, "model", "")
+
+    @property
+    def name(self) -> str:
+        return self.provider.name
+
+    def chat(self, messages: list[dict], **kwargs) -> str:
+        return self.provider.chat(messages, **kwargs)
+
+    async def achat(self, messages: list[dict], **kwargs) -> str:
+        if self.rate_limiter is not None:
+            await self.rate_limiter.acquire()
+        async with self.semaphore:
+            return await self.provider.achat(messages, **kwargs)
+
+
+def read_questions(path: str) -> Iterator[dict]:
+    """Lee el JSONL de a una línea; sin "id" se usa un hash de la pregunta (estable entre corridas)."""
+    with open(path, "r", encoding="utf-8") as f:
+        for line_number, line in enumerate(f, start=1):
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                logger.warning(f"Línea {line_number} inválida; se omite.")
+                continue
+            question = record.get("question")
+            if not question:
+                logger.warning(f"Línea {line_number} sin 'question'; se omite.")
+                continue
+            yield {"id": str(record.get("id") or text_hash(question)), "question": question}
+
+
+def windows(items: Iterator[dict], size: int) -> Iterator[list]:
+    window = []
+    for item in items:
+        window.append(item)
+        if len(window) >= size:
+            yield window
+            window = []
+    if window:
+        yield window
+
+
+def load_answered(path: Path) -> set:
+    """(id, proveedor) ya respondidos en la salida; los que terminaron en error se reintentan."""
+    answered = set()
+    if not path.exists():
+        return answered
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue  # línea a medio escribir por una interrupción
+            if "error" not in record:
+                answered.add((record["id"], record["provider"]))
+    return answered
+
+
+class ResultWriter:
+    """Agrega una línea por respuesta y la vacía a disco de inmediato."""
+
+    def __init__(self, path: Path):
+        from .cache import _json_default
+        self._default = _json_default
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self._file = open(path, "a", encoding="utf-8")
+        self.answered = 0
+        self.cached = 0
+        self.errors = 0
+        self.synthesized = set()  # ids de preguntas respondidas por un LLM (sin contar la caché)
+
+    def write(self, record: dict):
+        self._file.write(json.dumps(record, ensure_ascii=False, default=self._default) + "\n")
+        self._file.flush()
+        if "error" in record:
+            self.errors += 1
+        else:
+            self.answered += 1
+            if record.get("cached"):
+                self.cached += 1
+            else:
+                self.synthesized.add(record["id"])
+
+    def close(self):
+        self._file.close()
+
+
+def _sources(docs: list) -> list[dict]:
+    return [{"doc_id": d.get("doc_id"), "page": d.get("page"), "chunk_id": d.get("chunk_id")} for d in docs]
+
+
+async def retrieve_window(pipeline, questions: list) -> list:
+    """Documentos de cada pregunta (o la excepción que la hizo fallar), en el mismo orden."""
+    if pipeline.strategy not in BATCHED_STRATEGIES:
+        return await asyncio.gather(*(pipeline.aretrieve(q) for q in questions), return_exceptions=True)
+
+    if pipeline.strategy == "hyde":
+        texts = await asyncio.gather(*(pipeline.ahypothetical_answer(q) for q in questions),
+                                     return_exceptions=True)
+    else:
+        texts = list(questions)
+    ok = [i for i, t in enumerate(texts) if not isinstance(t, BaseException)]
+    results = list(texts)
+    if ok:
+        # Una sola codificación y búsqueda FAISS para toda la ventana
+        found = await asyncio.to_thread(pipeline.retriever.search_batch, [texts[i] for i in ok], pipeline.final_k)
+        for i, docs in zip(ok, found):
+            results[i] = docs
+    return results
+
+
+async def answer_one(pipeline, provider_name: str, item: dict, docs: list, writer: ResultWriter):
+    start = time.perf_counter()
+    try:
+        context = await asyncio.to_thread(pipeline.build_context, docs)
+        if context:
+            answer = pipeline.postprocess(await pipeline.asynthesize(item["question"], context))
+            await asyncio.to_thread(pipeline.store_answer, item["question"], {"answer": answer, "sources": context})
+        else:
+            answer = NO_DOCS_ANSWER
+        writer.write({"id": item["id"], "provider": provider_name, "question": item["question"],
+                      "answer": answer, "sources": _sources(context),
+                      "latency_s": round(time.perf_counter() - start, 3)})
+    except Exception as e:
+        logger.error(f"{provider_name} falló en '{item['id']}': {e}")
+        writer.write({"id": item["id"], "provider": provider_name, "question": item["question"], "error": str(e)})
+
+
+async def run_batch(items: Iterator[dict], pipelines: dict, writer: ResultWriter, answered: set,
+                    batch_size: int = DEFAULT_BATCH_SIZE, max_pending: int = 4 * DEFAULT_CONCURRENCY):
+    """
+    Recorre las preguntas por ventanas. Las síntesis quedan corriendo en segundo
+    plano mientras se prepara la ventana siguiente (hasta `max_pending` a la vez).
+    """
+    pending = set()
+    for window in windows(items, batch_size):
+        for provider_name, pipeline in pipelines.items():
+            todo = []
+            for item in window:
+                key = (item["id"], provider_name)
+                if key in answered:
+                    continue
+                answered.add(key)  # también descarta ids repetidos en la entrada
+                cached = await asyncio.to_thread(pipeline.cached_answer, item["question"])
+                if cached is not None:
+                    writer.write({"id": item["id"], "provider": provider_name, "question": item["question"],
+                                  "answer": cached["answer"], "sources": _sources(cached["sources"]),
+                                  "latency_s": 0.0, "cached": True})
+                    continue
+                todo.append(item)
+            if not todo:
+                continue
+
+            retrieved = await retrieve_window(pipeline, [item["question"] for item in todo])
+            for item, docs in zip(todo, retrieved):
+                if isinstance(docs, BaseException):
+                    logger.error(f"{provider_name}: la recuperación falló en '{item['id']}': {docs}")
+                    writer.write({"id": item["id"], "provider": provider_name, "question": item["question"],
+                                  "error": str(docs)})
+                    continue
+                pending.add(asyncio.create_task(answer_one(pipeline, provider_name, item, docs, writer)))
+            while len(pending) >= max_pending:
+                _, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+        logger.info(f"Respondidas {writer.answered} ({writer.errors} errores, {len(pending)} en curso).")
+    if pending:
+        await asyncio.wait(pending)
+
+
+def parse_rate_limits(values: list) -> dict:
+    """["chatgpt=120", "deepseek=60"] → {"chatgpt": 120.0, "deepseek": 60.0} (llamadas por minuto)."""
+    limits = {}
+    for value in values or []:
+        name, _, rate = value.partition("=")
+        if not rate:
+            raise argparse.ArgumentTypeError(f"Formato esperado proveedor=llamadas_por_minuto: {value}")
+        try:
+            limits[name] = float(rate)
+        except ValueError:
+            raise argparse.ArgumentTypeError(f"Tasa no numérica en --rate-limit: {value}") from None
+        # RateLimiter divide por la tasa: 0 o negativa no tiene sentido
+        if not limits[name] > 0:
+            raise argparse.ArgumentTypeError(f"La tasa debe ser mayor que 0: {value}")
+    return limits
+
+
+def main():
+    from providers.registry import create_provider, provider_names
+    from .fusion import RETRIEVAL_MODES
+    from .pipeline import RETRIEVAL_STRATEGIES
+    from .context import CONTEXT_TOKEN_BUDGET
+    from . import metrics
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(name)s - %(message)s')
+    parser = argparse.ArgumentParser(description="Responde en lote las preguntas de un archivo JSONL")
+    parser.add_argument("input", help='JSONL con {"id": ..., "question": ...} por línea')
+    parser.add_argument("--output", default=None, help="JSONL de respuestas (por defecto <input>.answers.jsonl)")
+    parser.add_argument("--providers", nargs="+", choices=provider_names(), default=["chatgpt"],
+                        help="Cada pregunta se responde con cada proveedor")
+    parser.add_argument("--concurrency", type=int, default=DEFAULT_CONCURRENCY, help="Llamadas simultáneas al LLM")
+    parser.add_argument("--rate-limit", nargs="*", default=[], metavar="PROVEEDOR=RPM",
+                        help="Llamadas por minuto por proveedor, ej. chatgpt=120 deepseek=60")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE,
+                        help="Preguntas que se codifican y buscan juntas")
+    parser.add_argument("--k", type=int, default=4, help="Número de chunks a recuperar")
+    parser.add_argument("--strategy", choices=RETRIEVAL_STRATEGIES, default="hyde")
+    parser.add_argument("--retrieval-mode", choices=RETRIEVAL_MODES, default="dense")
+    parser.add_argument("--context-budget", type=int, default=CONTEXT_TOKEN_BUDGET,
+                        help="Tokens máximos de contexto enviados al LLM (0 = sin límite)")
+    parser.add_argument("--cache", choices=["none", "sqlite"], default="none",
+                        help="Con sqlite reutiliza y guarda respuestas en data/cache.sqlite")
+    args = parser.parse_args()
+
+    metrics.set_enabled(False)
+    try:
+        rate_limits = parse_rate_limits(args.rate_limit)
+    except argparse.ArgumentTypeError as e:
+        parser.error(str(e))
+    unknown = set(rate_limits) - set(args.providers)
+    if unknown:
+        parser.error(f"--rate-limit para proveedores no seleccionados: {', '.join(sorted(unknown))}")
+    output = Path(args.output) if args.output else Path(args.input).with_suffix(".answers.jsonl")
+    answered = load_answered(output)
+    if answered:
+        logger.info(f"Retomando: {len(answered)} respuestas ya escritas en {output}.")
+
+    from .retrieve import Retriever
+    from .pipeline import RAGPipeline
+    from .cache import PipelineCache, SQLiteCache
+
+    retriever = Retriever(mode=args.retrieval_mode)
+    cache = None
+    if args.cache == "sqlite":
+        cache = PipelineCache(SQLiteCache(), watch_paths=(retriever.index_path, retriever.chunks_path))
+    providers = {name: create_provider(name) for name in args.providers}
+
+    async def run():
+        semaphore = asyncio.Semaphore(args.concurrency)
+        pipelines = {
+            name: RAGPipeline(ThrottledProvider(provider, semaphore,
+                                                RateLimiter(rate_limits[name]) if name in rate_limits else None),
+                              retriever, k=args.k, cache=cache, strategy=args.strategy,
+                              context_budget=args.context_budget or None)
+            for name, provider in providers.items()
+        }
+        await run_batch(read_questions(args.input), pipelines, writer, answered,
+                        batch_size=args.batch_size, max_pending=4 * args.concurrency)
+
+    writer = ResultWriter(output)
+    start = time.perf_counter()
+    try:
+        asyncio.run(run())
+    finally:
+        writer.close()
+        elapsed = time.perf_counter() - start
+        per_minute = len(writer.synthesized) / (elapsed / 60) if elapsed > 0 else 0.0
+        print(f"\n {writer.answered} respuestas ({writer.cached} desde caché, {writer.errors} errores) "
+              f"en {elapsed:.1f}s → {len(writer.synthesized)} preguntas sintetizadas, {per_minute:.1f} preguntas/min. "
+              f"Salida: {output}")
+
+
+if __name__ == "__main__":
+    main()
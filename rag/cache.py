@@ -0,0 +1,280 @@
+import os
+import re
+import json
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+import unicodedata
+from collections import OrderedDict
+from typing import Optional
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_WATCH_PATHS = ("data/index.faiss", "data/processed/chunks.parquet")
+
+
+def normalize_query(query: str) -> str:
+    """Normaliza una pregunta para usarla como clave (mayúsculas, espacios, signos)."""
+    query = unicodedata.normalize("NFC", query).lower()
+    query = re.sub(r"\s+", " ", query)
+    return query.strip(" ¿?¡!.")
+
+
+def make_key(kind: str, query: str, provider: str, model: str, k: int, search: tuple = ()) -> str:
+    """`search` son las opciones de recuperación (modo, filtro, jerarquía, estrategia) que cambian el resultado."""
+    raw = json.dumps([kind, normalize_query(query), provider, model, k, search], ensure_ascii=False)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def files_fingerprint(paths) -> str:
+    """Huella (tamaño + fecha de modificación) de los archivos vigilados."""
+    parts = []
+    for path in paths:
+        try:
+            st = os.stat(path)
+            parts.append(f"{path}:{st.st_size}:{st.st_mtime_ns}")
+        except FileNotFoundError:
+            parts.append(f"{path}:missing")
+    return "|".join(parts)
+
+
+def _json_default(obj):
+    # Los metadatos que vienen de pandas/numpy (ej. page como int64)
+    if hasattr(obj, "item"):
+        return obj.item()
+    return str(obj)
+
+
+class LRUCache:
+    """Caché en memoria con política LRU y expiración por TTL."""
+
+    def __init__(self, max_size: int = 1024, ttl: Optional[float] = 3600.0):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            value, expires_at = item
+            if expires_at is not None and expires_at < time.time():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key: str, value):
+        expires_at = time.time() + self.ttl if self.ttl else None
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+class SQLiteCache:
+    """Caché persistente en disco (SQLite), compartible entre procesos y ejecuciones."""
+
+    def __init__(self, path: str = "data/cache.sqlite", ttl: Optional[float] = 7 * 24 * 3600.0):
+        self.path = path
+        self.ttl = ttl
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=5.0)
+        self._lock = threading.Lock()
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL)"
+            )
+
+    def get(self, key: str):
+        with self._lock:
+            row = self._conn.execute("SELECT value, expires_at FROM cache WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        value, expires_at = row
+        if expires_at is not None and expires_at < time.time():
+            with self._lock, self._conn:
+                self._conn.execute("DELETE FROM cache WHERE key = ?", (key,))
+            return None
+        return json.loads(value)
+
+    def set(self, key: str, value):
+        expires_at = time.time() + self.ttl if self.ttl else None
+        payload = json.dumps(value, ensure_ascii=False, default=_json_default)
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO cache (key, value, expires_at) VALUES (?, ?, ?)",
+                (key, payload, expires_at),
+            )
+
+    def clear(self):
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM cache")
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM cache").fetchone()[0]
+
+
+class PipelineCache:
+    """
+    Caché de HyDE, variantes de la pregunta y respuestas finales del RAGPipeline.
+
+    Las claves combinan pregunta normalizada, proveedor, modelo, k y las
+    opciones de búsqueda (`RAGPipeline.cache_scope`). Si cambia
+    el índice FAISS o chunks.parquet (tamaño o fecha de modificación), todo el
+    contenido se invalida automáticamente.
+    """
+
+    def __init__(self, backend=None, watch_paths=DEFAULT_WATCH_PATHS):
+        self.backend = backend if backend is not None else LRUCache()
+        self.watch_paths = tuple(watch_paths)
+        self.hits = {"hyde": 0, "answer": 0}
+        self.misses = {"hyde": 0, "answer": 0}
+        self._lock = threading.Lock()
+        self._fingerprint = files_fingerprint(self.watch_paths)
+
+    def _check_fingerprint(self):
+        fingerprint = files_fingerprint(self.watch_paths)
+        if fingerprint != self._fingerprint:
+            logger.info("El índice o los chunks cambiaron; se invalida la caché.")
+            self.backend.clear()
+            self._fingerprint = fingerprint
+
+    def get(self, kind: str, query: str, provider: str, model: str, k: int, search: tuple = ()):
+        self._check_fingerprint()
+        value = self.backend.get(make_key(kind, query, provider, model, k, search) + self._fingerprint_suffix())
+        with self._lock:
+            counters = self.misses if value is None else self.hits
+            counters[kind] = counters.get(kind, 0) + 1
+        return value
+
+    def set(self, kind: str, query: str, provider: str, model: str, k: int, value, search: tuple = ()):
+        self.backend.set(make_key(kind, query, provider, model, k, search) + self._fingerprint_suffix(), value)
+
+    def _fingerprint_suffix(self) -> str:
+        # Un backend persistente puede sobrevivir a una reconstrucción del índice
+        # hecha por otro proceso; incluir la huella en la clave evita servir datos viejos.
+        return ":" + hashlib.sha1(self._fingerprint.encode("utf-8")).hexdigest()[:12]
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "hits": dict(self.hits),
+                "misses": dict(self.misses),
+                "size": len(self.backend),
+            }
+
+
+class SemanticCache:
+    """
+    Caché semántica de respuestas: encuentra preguntas ya respondidas que sean
+    paráfrasis de la actual (similitud coseno ≥ `threshold`).
+
+    Las preguntas se guardan en un índice FAISS en memoria (producto interno
+    sobre vectores normalizados), con tamaño acotado y expulsión LRU. Las
+    entradas solo se reutilizan con el mismo `scope` (proveedor, modelo, k y búsqueda).
+    """
+
+    SEARCH_CANDIDATES = 8
+
+    def __init__(self, threshold: float = 0.92, max_size: int = 512, ttl: Optional[float] = 3600.0,
+                 watch_paths=DEFAULT_WATCH_PATHS):
+        self.threshold = threshold
+        self.max_size = max_size
+        self.ttl = ttl
+        self.watch_paths = tuple(watch_paths)
+        self._index = None
+        self._entries = OrderedDict()  # id → (scope, value, latency, expires_at)
+        self._next_id = 0
+        self._lock = threading.Lock()
+        self._fingerprint = files_fingerprint(self.watch_paths)
+        self.lookups = 0
+        self.hits = 0
+        self.saved_latency = 0.0
+
+    @staticmethod
+    def _prepare(vector) -> np.ndarray:
+        vec = np.array(vector, dtype=np.float32).reshape(1, -1)
+        return vec / max(float(np.linalg.norm(vec)), 1e-12)
+
+    def _clear_locked(self):
+        self._index = None
+        self._entries.clear()
+
+    def _check_fingerprint_locked(self):
+        fingerprint = files_fingerprint(self.watch_paths)
+        if fingerprint != self._fingerprint:
+            logger.info("El índice o los chunks cambiaron; se invalida la caché semántica.")
+            self._clear_locked()
+            self._fingerprint = fingerprint
+
+    def lookup(self, vector, scope: tuple):
+        """Devuelve (valor, similitud) de la pregunta más parecida, o None."""
+        vec = self._prepare(vector)
+        with self._lock:
+            self.lookups += 1
+            self._check_fingerprint_locked()
+            if self._index is None or self._index.ntotal == 0:
+                return None
+            scores, ids = self._index.search(vec, min(self.SEARCH_CANDIDATES, self._index.ntotal))
+            now = time.time()
+            for score, entry_id in zip(scores[0], ids[0]):
+                if entry_id == -1 or score < self.threshold:
+                    break
+                entry = self._entries.get(int(entry_id))
+                if entry is None or entry[0] != scope:
+                    continue
+                _, value, latency, expires_at = entry
+                if expires_at is not None and expires_at < now:
+                    self._remove_locked(int(entry_id))
+                    continue
+                self._entries.move_to_end(int(entry_id))
+                self.hits += 1
+                self.saved_latency += latency
+                return value, float(score)
+            return None
+
+    def add(self, vector, scope: tuple, value, latency: float):
+        """Registra una respuesta; `latency` es lo que costó generarla."""
+        vec = self._prepare(vector)
+        expires_at = time.time() + self.ttl if self.ttl else None
+        with self._lock:
+            if self._index is None:
+                import faiss  # solo se carga si la caché semántica se usa
+                self._index = faiss.IndexIDMap(faiss.IndexFlatIP(vec.shape[1]))
+            entry_id = self._next_id
+            self._next_id += 1
+            self._index.add_with_ids(vec, np.array([entry_id], dtype=np.int64))
+            self._entries[entry_id] = (scope, value, latency, expires_at)
+            while len(self._entries) > self.max_size:
+                oldest = next(iter(self._entries))
+                self._remove_locked(oldest)
+
+    def _remove_locked(self, entry_id: int):
+        self._entries.pop(entry_id, None)
+        self._index.remove_ids(np.array([entry_id], dtype=np.int64))
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "lookups": self.lookups,
+                "hits": self.hits,
+                "hit_rate": self.hits / self.lookups if self.lookups else 0.0,
+                "saved_latency_s": round(self.saved_latency, 3),
+                "size": len(self._entries),
+            }
@@ -0,0 +1,100 @@
+import os
+import logging
+from typing import TYPE_CHECKING
+import numpy as np
+import pyarrow as pa
+import pyarrow.ipc as ipc
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+STORE_PATH = "data/processed/chunks.arrow"
+STORE_COLUMNS = ["vector_id", "doc_id", "title", "page", "chunk_id", "text"]
+
+
+def store_path_for(chunks_path: str) -> str:
+    """El store vive junto a chunks.parquet (chunks.arrow)."""
+    return os.path.splitext(chunks_path)[0] + ".arrow"
+
+
+def write_chunk_store(df: "pd.DataFrame", path: str = STORE_PATH):
+    """
+    Escribe los chunks como archivo Arrow IPC sin compresión, ordenados por
+    vector_id: así se puede mapear en memoria y ubicar un id con búsqueda binaria
+    directamente sobre la columna, sin construir estructuras por proceso.
+    """
+    columns = [c for c in STORE_COLUMNS if c in df.columns]
+    table = pa.Table.from_pandas(df[columns].sort_values("vector_id"), preserve_index=False)
+    table = table.combine_chunks()
+    tmp_path = path + ".tmp"
+    with pa.OSFile(tmp_path, "wb") as sink:
+        with ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+    os.replace(tmp_path, path)
+
+
+class ChunkStore:
+    """
+    Almacén de chunks de solo lectura mapeado en memoria.
+
+    Las páginas del archivo las comparte el sistema operativo entre todos los
+    procesos (workers de gunicorn, CLI, evaluador); el texto solo se lee para
+    las filas pedidas por id.
+    """
+
+    def __init__(self, table: pa.Table, source=None):
+        self._source = source  # mantiene vivo el memory map
+        self.table = table
+        self._vector_ids = table.column("vector_id").to_numpy()
+
+    @classmethod
+    def open(cls, path: str = STORE_PATH) -> "ChunkStore":
+        source = pa.memory_map(path, "r")
+        table = ipc.open_file(source).read_all()
+        return cls(table, source)
+
+    @classmethod
+    def from_parquet(cls, chunks_path: str) -> "ChunkStore":
+        """Carga en memoria (sin mmap) a partir de chunks.parquet; para formatos antiguos."""
+        import pandas as pd
+        df = pd.read_parquet(chunks_path)
+        if "vector_id" not in df.columns:
+            # Índice antiguo sin IndexIDMap: el id de FAISS es la posición de la fila
+            df = df.assign(vector_id=np.arange(len(df), dtype=np.int64))
+        columns = [c for c in STORE_COLUMNS if c in df.columns]
+        table = pa.Table.from_pandas(df[columns].sort_values("vector_id"), preserve_index=False)
+        return cls(table.combine_chunks())
+
+    def __len__(self):
+        return self.table.num_rows
+
+    def positions(self, ids: np.ndarray) -> np.ndarray:
+        """Traduce ids de FAISS a posiciones de fila (-1 si no existen)."""
+        if len(self._vector_ids) == 0:
+            return np.full_like(ids, -1)
+        pos = np.searchsorted(self._vector_ids, ids)
+        pos = np.minimum(pos, len(self._vector_ids) - 1)
+        found = (ids != -1) & (self._vector_ids[pos] == ids)
+        return np.where(found, pos, -1)
+
+    def take(self, positions) -> list[dict]:
+        """Filas (como dicts) en las posiciones indicadas; solo se leen esas filas."""
+        if len(positions) == 0:
+            return []
+        return self.table.take(pa.array(positions, type=pa.int64())).to_pylist()
+
+    def to_pandas(self) -> "pd.DataFrame":
+        return self.table.to_pandas()
+
+
+def open_chunk_store(chunks_path: str) -> ChunkStore:
+    """Abre chunks.arrow si está al día respecto de chunks.parquet; si no, carga el parquet."""
+    store_path = store_path_for(chunks_path)
+    if os.path.exists(store_path) and (
+        not os.path.exists(chunks_path) or os.path.getmtime(store_path) >= os.path.getmtime(chunks_path)
+    ):
+        return ChunkStore.open(store_path)
+    logger.warning(f"No se encontró {store_path} actualizado; se cargan los chunks desde {chunks_path}.")
+    return ChunkStore.from_parquet(chunks_path)
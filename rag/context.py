@@ -0,0 +1,172 @@
+import re
+import logging
+from typing import Optional
+import numpy as np
+from .metrics import TOKEN_BUCKETS, observe
+
+logger = logging.getLogger(__name__)
+
+# Tokens máximos de contexto que se envían a `synthesize`
+CONTEXT_TOKEN_BUDGET = 1500
+# Similitud coseno a partir de la cual dos chunks se consideran repetidos
+NEAR_DUPLICATE_THRESHOLD = 0.95
+# Solape mínimo/máximo (en caracteres) para unir chunks contiguos de una página;
+# rag.ingest usa chunk_overlap=150, el margen cubre los cortes en espacios
+MIN_OVERLAP_CHARS = 20
+MAX_OVERLAP_CHARS = 400
+# Un chunk recortado debe conservar al menos estos tokens para valer la pena
+MIN_TRUNCATED_TOKENS = 64
+# Estimación cuando tiktoken no está instalado (texto en español)
+CHARS_PER_TOKEN = 4
+TOKENIZER_ENCODING = "cl100k_base"
+
+_encoding = None
+
+
+def _get_encoding():
+    global _encoding
+    if _encoding is None:
+        try:
+            import tiktoken
+            _encoding = tiktoken.get_encoding(TOKENIZER_ENCODING)
+        except ImportError:  # dependencia opcional: sin ella se estima por caracteres
+            _encoding = False
+        except Exception as e:  # p. ej. sin red para descargar el vocabulario
+            logger.warning(f"No se pudo cargar tiktoken ({e}); se estiman tokens por caracteres.")
+            _encoding = False
+    return _encoding or None
+
+
+def count_tokens(text: str) -> int:
+    encoding = _get_encoding()
+    if encoding is not None:
+        return len(encoding.encode(text))
+    return -(-len(text) // CHARS_PER_TOKEN)
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """Recorta `text` a `max_tokens`, cortando en un espacio cuando es posible."""
+    encoding = _get_encoding()
+    if encoding is not None:
+        tokens = encoding.encode(text)
+        if len(tokens) <= max_tokens:
+            return text
+        cut = encoding.decode(tokens[:max_tokens])
+    else:
+        if len(text) <= max_tokens * CHARS_PER_TOKEN:
+            return text
+        cut = text[:max_tokens * CHARS_PER_TOKEN]
+    space = cut.rfind(" ")
+    if space > len(cut) // 2:
+        cut = cut[:space]
+    return cut.rstrip() + "…"
+
+
+def format_context_part(doc: dict) -> str:
+    """Un chunk tal como aparece en el prompt de síntesis."""
+    return f"[{doc['doc_id']}-{doc.get('page', 'N/A')}] {doc['text']}"
+
+
+def _chunk_index(doc: dict) -> Optional[int]:
+    match = re.search(r"-(\d+)$", str(doc.get("chunk_id") or ""))
+    return int(match.group(1)) if match else None
+
+
+def _overlap_length(left: str, right: str) -> int:
+    """Largo del sufijo de `left` que coincide con el prefijo de `right` (0 si no hay)."""
+    longest = min(len(left), len(right), MAX_OVERLAP_CHARS)
+    for size in range(longest, MIN_OVERLAP_CHARS - 1, -1):
+        if left.endswith(right[:size]):
+            return size
+    return 0
+
+
+def merge_adjacent_chunks(docs: list) -> list:
+    """
+    Une chunks consecutivos de la misma página cuyo texto se solapa, quitando
+    el texto repetido. El chunk unido ocupa el lugar del mejor rankeado y
+    conserva su cita (doc_id-page); los ids originales quedan en `merged_chunk_ids`.
+    """
+    groups = {}
+    for rank, doc in enumerate(docs):
+        groups.setdefault((doc.get("doc_id"), doc.get("page")), []).append((rank, doc))
+
+    merged = []
+    for members in groups.values():
+        members.sort(key=lambda m: (_chunk_index(m[1]) is None, _chunk_index(m[1]) or 0))
+        current_rank, current = members[0]
+        current_ids = [current.get("chunk_id")]
+        for rank, doc in members[1:]:
+            prev_index, index = _chunk_index({"chunk_id": current_ids[-1]}), _chunk_index(doc)
+            overlap = _overlap_length(current["text"], doc["text"]) if (
+                prev_index is not None and index == prev_index + 1) else 0
+            if overlap:
+                current = {**current, "text": current["text"] + doc["text"][overlap:]}
+                current_ids.append(doc.get("chunk_id"))
+                current_rank = min(current_rank, rank)
+                continue
+            merged.append((current_rank, current, current_ids))
+            current_rank, current, current_ids = rank, doc, [doc.get("chunk_id")]
+        merged.append((current_rank, current, current_ids))
+
+    merged.sort(key=lambda m: m[0])
+    result = []
+    for _, doc, chunk_ids in merged:
+        if len(chunk_ids) > 1:
+            doc = {**doc, "merged_chunk_ids": chunk_ids}
+        result.append(doc)
+    return result
+
+
+def drop_near_duplicates(docs: list, vectors: np.ndarray, threshold: float = NEAR_DUPLICATE_THRESHOLD) -> list:
+    """
+    Descarta los chunks casi idénticos a otro mejor rankeado del mismo documento.
+    Entre documentos distintos (ej. dos reglamentos con el mismo artículo) se
+    conservan ambos para no perder la cita del segundo.
+    `vectors` son los embeddings normalizados de `docs`, en el mismo orden.
+    """
+    kept_by_doc = {}
+    kept = []
+    for i, doc in enumerate(docs):
+        same_doc = kept_by_doc.setdefault(doc.get("doc_id"), [])
+        if same_doc and float(np.max(vectors[same_doc] @ vectors[i])) >= threshold:
+            continue
+        same_doc.append(i)
+        kept.append(i)
+    return [docs[i] for i in kept]
+
+
+def pack_context(docs: list, token_budget: Optional[int] = CONTEXT_TOKEN_BUDGET,
+                 vectors: Optional[np.ndarray] = None,
+                 dedup_threshold: float = NEAR_DUPLICATE_THRESHOLD) -> list:
+    """
+    Prepara los chunks para el prompt: quita casi duplicados (si hay `vectors`),
+    une solapes de una misma página y llena hasta `token_budget` tokens en orden
+    de ranking, recortando el último chunk si queda espacio suficiente.
+    """
+    if not docs:
+        return []
+    tokens_before = sum(count_tokens(format_context_part(d)) for d in docs)
+
+    if vectors is not None and len(vectors) == len(docs):
+        docs = drop_near_duplicates(docs, vectors, dedup_threshold)
+    docs = merge_adjacent_chunks(docs)
+
+    packed, used = [], 0
+    for doc in docs:
+        tokens = count_tokens(format_context_part(doc))
+        if token_budget is None or used + tokens <= token_budget:
+            packed.append(doc)
+            used += tokens
+            continue
+        remaining = token_budget - used - count_tokens(format_context_part({**doc, "text": ""}))
+        if remaining >= MIN_TRUNCATED_TOKENS or not packed:
+            doc = {**doc, "text": truncate_to_tokens(doc["text"], max(remaining, 1)), "truncated": True}
+            packed.append(doc)
+            used += count_tokens(format_context_part(doc))
+        break
+
+    observe("rag_context_tokens", used, TOKEN_BUCKETS)
+    logger.info(f"Contexto: {len(packed)} chunks, {tokens_before} → {used} tokens "
+                f"(presupuesto {token_budget}).")
+    return packed
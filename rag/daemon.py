@@ -0,0 +1,246 @@
+import os
+import copy
+import json
+import stat
+import time
+import signal
+import socket
+import logging
+import argparse
+import threading
+import socketserver
+
+logger = logging.getLogger(__name__)
+
+# Daemon local que mantiene cargados el Retriever (modelo, índice FAISS, chunks)
+# y los proveedores: `python app.py` le envía la pregunta por un socket Unix y
+# se ahorra importar torch/faiss/pandas y cargar todo en cada ejecución.
+# Protocolo: una línea JSON de petición y una línea JSON de respuesta por conexión.
+# Este módulo solo importa la biblioteca estándar al cargarse: el cliente (`ask`)
+# debe ser barato; lo pesado se importa dentro de RAGDaemon.
+
+DAEMON_SOCKET = os.getenv("RAG_DAEMON_SOCKET", "data/rag.sock")
+# Tiempo máximo esperando la respuesta (incluye la llamada al LLM)
+DAEMON_REQUEST_TIMEOUT_S = 120.0
+MAX_REQUEST_BYTES = 1 << 20
+
+
+class DaemonUnavailable(ConnectionError):
+    """No hay un daemon escuchando en el socket (o la plataforma no tiene AF_UNIX)."""
+
+
+def ask(request: dict, socket_path: str = DAEMON_SOCKET, timeout: float = DAEMON_REQUEST_TIMEOUT_S) -> dict:
+    """
+    Envía una petición al daemon y devuelve su respuesta.
+
+    Lanza DaemonUnavailable si no se pudo conectar (el llamador puede ejecutar
+    en el proceso) y RuntimeError si el daemon respondió con un error.
+    """
+    if not hasattr(socket, "AF_UNIX"):
+        raise DaemonUnavailable("Sockets Unix no disponibles en esta plataforma")
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.settimeout(timeout)
+    try:
+        try:
+            sock.connect(socket_path)
+        except OSError as e:  # no existe, nadie escucha, sin permiso, no es un socket...
+            raise DaemonUnavailable(f"{socket_path}: {e}") from e
+        sock.sendall(json.dumps(request, ensure_ascii=False).encode("utf-8") + b"\n")
+        with sock.makefile("rb") as f:
+            line = f.readline()
+    finally:
+        sock.close()
+    if not line:
+        raise RuntimeError("El daemon cerró la conexión sin responder")
+    response = json.loads(line)
+    if "error" in response:
+        raise RuntimeError(f"Error en el daemon: {response['error']}")
+    return response
+
+
+class RAGDaemon:
+    """Componentes cargados una sola vez y compartidos por todas las peticiones."""
+
+    def __init__(self, retrieval_mode: str = "dense", warm_providers=("chatgpt",)):
+        from .retrieve import Retriever
+
+        start = time.perf_counter()
+        self.retriever = Retriever(mode=retrieval_mode)
+        # Primer encode fuera del camino de las preguntas (inicializa torch)
+        self.retriever.embed_query("calentamiento")
+        self.started_at = time.time()
+        self.requests = 0
+        self._providers = {}
+        self._cache = None
+        self._reranker = None
+        self._lock = threading.Lock()
+        # Crea los proveedores de antemano (importa el SDK de OpenAI); sin clave no es fatal
+        for name in warm_providers:
+            try:
+                self.provider(name)
+            except Exception as e:
+                logger.warning(f"No se pudo precargar el proveedor {name}: {e}")
+        self.load_s = time.perf_counter() - start
+
+    def provider(self, name: str):
+        from providers.registry import create_provider
+        with self._lock:
+            if name not in self._providers:
+                self._providers[name] = create_provider(name)
+            return self._providers[name]
+
+    def cache(self):
+        from .cache import PipelineCache, SQLiteCache
+        with self._lock:
+            if self._cache is None:
+                self._cache = PipelineCache(SQLiteCache(), watch_paths=(self.retriever.index_path,
+                                                                        self.retriever.chunks_path))
+            return self._cache
+
+    def reranker(self, budget_s: float):
+        from .rerank import Reranker
+        with self._lock:
+            if self._reranker is None:
+                self._reranker = Reranker()
+        # Comparte modelo e hilos; solo cambia el presupuesto de esta petición
+        reranker = copy.copy(self._reranker)
+        reranker.budget_s = budget_s
+        return reranker
+
+    def handle(self, request: dict) -> dict:
+        from .fusion import RETRIEVAL_MODES
+        from .pipeline import RAGPipeline
+        from .rerank import RERANK_CANDIDATES, RERANK_BUDGET_S
+        from .context import CONTEXT_TOKEN_BUDGET
+
+        question = request.get("question")
+        if not question:
+            raise ValueError("La petición no trae 'question'")
+        retriever = self.retriever
+        mode = request.get("retrieval_mode") or retriever.mode
+        if mode not in RETRIEVAL_MODES:
+            raise ValueError(f"Modo de recuperación desconocido: {mode}")
+        overrides = {"mode": mode, "doc_filter": request.get("doc_filter"),
+                     "top_groups": request.get("top_groups", retriever.top_groups),
+                     "hierarchical": bool(request.get("hierarchical")) and retriever.hierarchy is not None}
+        if any(getattr(retriever, name) != value for name, value in overrides.items()):
+            # Copia superficial: mismo modelo e índices, otras opciones de búsqueda
+            retriever = copy.copy(retriever)
+            for name, value in overrides.items():
+                setattr(retriever, name, value)
+
+        provider = self.provider(request.get("provider", "chatgpt"))
+        cache = self.cache() if request.get("cache") == "sqlite" else None
+        reranker = self.reranker(request.get("rerank_budget", RERANK_BUDGET_S)) if request.get("rerank") else None
+        pipeline = RAGPipeline(provider=provider, retriever=retriever, k=request.get("k", 4), cache=cache,
+                               strategy=request.get("strategy", "hyde"),
+                               hyde_skip_threshold=request.get("hyde_skip_threshold"),
+                               reranker=reranker,
+                               rerank_candidates=request.get("rerank_candidates", RERANK_CANDIDATES),
+                               context_budget=request.get("context_budget", CONTEXT_TOKEN_BUDGET) or None)
+
+        start = time.perf_counter()
+        result = pipeline.run(question)
+        with self._lock:
+            self.requests += 1
+        return {"answer": result["answer"], "sources": result["sources"], "provider": provider.name,
+                "pipeline_s": time.perf_counter() - start,
+                "cache": cache.stats() if cache is not None else None}
+
+    def status(self) -> dict:
+        return {"status": "ok", "pid": os.getpid(), "requests": self.requests,
+                "uptime_s": round(time.time() - self.started_at, 1), "load_s": round(self.load_s, 3),
+                "retrieval_mode": self.retriever.mode, "encoder_backend": self.retriever.encoder_backend,
+                "providers": sorted(self._providers)}
+
+
+class _RequestHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        from .cache import _json_default
+        try:
+            request = json.loads(self.rfile.readline(MAX_REQUEST_BYTES))
+            if request.get("op") == "status":
+                response = self.server.rag.status()
+            else:
+                response = self.server.rag.handle(request)
+        except Exception as e:
+            logger.error(f"Error atendiendo la petición: {e}", exc_info=True)
+            response = {"error": str(e)}
+        payload = json.dumps(response, ensure_ascii=False, default=_json_default)
+        self.wfile.write(payload.encode("utf-8") + b"\n")
+
+
+if hasattr(socket, "AF_UNIX"):  # socketserver solo define UnixStreamServer en ese caso
+    class _DaemonServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+        daemon_threads = True
+
+        def __init__(self, socket_path: str, rag: RAGDaemon):
+            self.rag = rag
+            super().__init__(socket_path, _RequestHandler)
+
+
+def _claim_socket(socket_path: str):
+    """
+    Borra un socket abandonado; falla si ya hay otro daemon escuchando o si
+    la ruta existe pero no es un socket (nunca se borra un fichero normal).
+    """
+    if not os.path.lexists(socket_path):
+        os.makedirs(os.path.dirname(socket_path) or ".", exist_ok=True)
+        return
+    if not stat.S_ISSOCK(os.lstat(socket_path).st_mode):
+        raise RuntimeError(f"{socket_path} existe y no es un socket; no se borra")
+    try:
+        status = ask({"op": "status"}, socket_path, timeout=2.0)
+    except (DaemonUnavailable, OSError, RuntimeError, ValueError):
+        os.unlink(socket_path)
+        return
+    raise RuntimeError(f"Ya hay un daemon escuchando en {socket_path} (pid {status.get('pid')})")
+
+
+def _stop(signum, frame):
+    raise SystemExit(0)
+
+
+def serve(socket_path: str = DAEMON_SOCKET, retrieval_mode: str = "dense", warm_providers=("chatgpt",)):
+    from . import metrics
+    if not hasattr(socket, "AF_UNIX"):
+        raise RuntimeError("El daemon necesita sockets Unix")
+    metrics.set_enabled(False)  # atiende a la CLI; no expone /metrics
+    _claim_socket(socket_path)
+    rag = RAGDaemon(retrieval_mode=retrieval_mode, warm_providers=warm_providers)
+    server = _DaemonServer(socket_path, rag)
+    os.chmod(socket_path, 0o600)  # solo el usuario dueño puede hacer preguntas
+    logger.info(f"Daemon listo en {socket_path} (carga {rag.load_s:.2f} s, "
+                f"{rag.retriever.index.ntotal} vectores).")
+    # Con SIGTERM (kill, systemd) también se borra el socket al salir
+    signal.signal(signal.SIGTERM, _stop)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        logger.info("Deteniendo el daemon.")
+    finally:
+        server.server_close()
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+
+
+def main():
+    from .fusion import RETRIEVAL_MODES
+    from providers.registry import provider_names
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(name)s - %(message)s')
+    parser = argparse.ArgumentParser(description="Daemon local con el Retriever y los proveedores precargados")
+    parser.add_argument("--socket", default=DAEMON_SOCKET, help="Ruta del socket Unix")
+    parser.add_argument("--retrieval-mode", default="dense", choices=RETRIEVAL_MODES,
+                        help="Modo de recuperación por defecto (cada petición puede pedir otro)")
+    parser.add_argument("--providers", nargs="*", default=["chatgpt"], choices=provider_names(),
+                        help="Proveedores a crear al iniciar (el resto se crea en su primera pregunta)")
+    parser.add_argument("--status", action="store_true", help="Muestra el estado del daemon en ejecución y sale")
+    args = parser.parse_args()
+    if args.status:
+        print(json.dumps(ask({"op": "status"}, args.socket, timeout=2.0), indent=2))
+        return
+    serve(args.socket, args.retrieval_mode, args.providers)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,17 +1,92 @@
 import os
+import time
+import argparse
 from pathlib import Path
+from typing import Optional
 import pandas as pd
 import numpy as np
 from tqdm import tqdm
-from sentence_transformers import SentenceTransformer
 import faiss
 
+from .manifest import EmbeddingCache, embed_cache_path, text_hash, vector_id
+from .encoders import MODEL_NAME, ENCODER_BACKENDS, DEFAULT_BACKEND, encoder_meta, index_encoder, load_encoder
+from .chunk_store import store_path_for, write_chunk_store
+from .hierarchy import HIERARCHY_LEVELS, DEFAULT_LEVEL, build_hierarchy
+from .index_factory import (INDEX_TYPES, DEFAULT_INDEX_TYPE, build_index, load_meta, make_meta,
+                            prepare_vectors, save_meta, supports_removal)
+
 # ---------------------
 # Configuración
 # ---------------------
-MODEL_NAME = "all-MiniLM-L6-v2"   # SentenceTransformers
 DATA_PATH = Path("data/processed/chunks.parquet")
 INDEX_PATH = Path("data/index.faiss")
+BATCH_SIZE = 64
+NUM_WORKERS = 1
+# Por debajo de este número de textos no compensa levantar procesos extra
+MIN_TEXTS_PER_WORKER = 256
+
+# ---------------------
+# Motor de embeddings
+# ---------------------
+class EmbeddingEngine:
+    """
+    Carga el modelo una sola vez y codifica textos en lotes.
+
+    Los textos se ordenan por longitud antes de codificar para que cada lote
+    tenga un padding mínimo; los vectores se escriben directamente en un
+    arreglo float32 preasignado, en el orden original de entrada.
+    `backend` elige PyTorch u ONNX (fp32/int8, ver rag.encoders).
+    """
+
+    def __init__(self, model_name: str = MODEL_NAME, batch_size: int = BATCH_SIZE,
+                 num_workers: int = NUM_WORKERS, backend: str = DEFAULT_BACKEND):
+        self.model_name = model_name
+        self.backend = backend
+        self.batch_size = batch_size
+        self.num_workers = max(1, num_workers)
+        if backend != "torch" and self.num_workers > 1:
+            # ONNX Runtime ya reparte cada lote entre los núcleos
+            print(f"[INFO] El backend {backend} no usa procesos extra; se ignora workers={self.num_workers}")
+            self.num_workers = 1
+        self.model = load_encoder(model_name, backend)
+        self.dim = self.model.get_sentence_embedding_dimension()
+
+    def encode(self, texts: list[str], show_progress: bool = True) -> np.ndarray:
+        n = len(texts)
+        embeddings = np.empty((n, self.dim), dtype=np.float32)
+        if n == 0:
+            return embeddings
+
+        # Orden por longitud: lotes homogéneos → menos padding
+        order = np.argsort([len(t) for t in texts], kind="stable")
+        sorted_texts = [texts[i] for i in order]
+
+        if self.num_workers > 1 and n >= self.num_workers * MIN_TEXTS_PER_WORKER:
+            embeddings[order] = self._encode_multi_process(sorted_texts)
+            return embeddings
+
+        batches = range(0, n, self.batch_size)
+        for start in tqdm(batches, desc="Generando embeddings", disable=not show_progress):
+            end = min(start + self.batch_size, n)
+            batch = self.model.encode(
+                sorted_texts[start:end],
+                batch_size=self.batch_size,
+                convert_to_numpy=True,
+            )
+            embeddings[order[start:end]] = batch
+        return embeddings
+
+    def _encode_multi_process(self, sorted_texts: list[str]) -> np.ndarray:
+        """Reparte la codificación entre varios procesos CPU."""
+        pool = self.model.start_multi_process_pool(target_devices=["cpu"] * self.num_workers)
+        try:
+            return self.model.encode_multi_process(
+                sorted_texts,
+                pool,
+                batch_size=self.batch_size,
+            ).astype(np.float32, copy=False)
+        finally:
+            self.model.stop_multi_process_pool(pool)
 
 # ---------------------
 # Funciones
@@ -21,38 +96,178 @@ def load_chunks(path: Path = DATA_PATH) -> pd.DataFrame:
         raise FileNotFoundError(f"No se encontró el archivo de chunks: {path}")
     return pd.read_parquet(path)
 
-def get_embeddings(texts: list[str], model_name: str = MODEL_NAME) -> np.ndarray:
+def get_embeddings(texts: list[str], model_name: str = MODEL_NAME,
+                   batch_size: int = BATCH_SIZE, num_workers: int = NUM_WORKERS,
+                   backend: str = DEFAULT_BACKEND) -> np.ndarray:
+    """
+    Genera embeddings usando sentence-transformers (o su exportación ONNX).
+    """
+    engine = EmbeddingEngine(model_name, batch_size=batch_size, num_workers=num_workers, backend=backend)
+    return engine.encode(texts)
+
+def ensure_vector_ids(df: pd.DataFrame) -> pd.DataFrame:
+    """Completa `text_hash`/`vector_id` para chunks generados con el formato antiguo."""
+    if "text_hash" not in df.columns:
+        df = df.assign(text_hash=[text_hash(t) for t in df["text"]])
+    if "vector_id" not in df.columns:
+        df = df.assign(vector_id=[vector_id(c, h) for c, h in zip(df["chunk_id"], df["text_hash"])])
+    return df
+
+def load_index_ids(index_path: Path = INDEX_PATH, index_type: str = DEFAULT_INDEX_TYPE,
+                   encoder: tuple = (MODEL_NAME, DEFAULT_BACKEND)):
+    """
+    Carga un índice existente con ids estables, o (None, None) si no se puede
+    actualizar en sitio (no existe, es de otro tipo, se construyó con otro
+    modelo/backend de embeddings o no admite borrar ids).
+    """
+    if not index_path.exists():
+        return None, None
+    meta = load_meta(index_path)
+    if meta.get("index_type") != index_type or not supports_removal(index_type):
+        return None, None
+    if index_encoder(meta) != tuple(encoder):
+        return None, None
+    index = faiss.read_index(str(index_path))
+    if not isinstance(index, faiss.IndexIDMap):
+        return None, None
+    return index, faiss.vector_to_array(index.id_map)
+
+def embed_with_cache(texts: list[str], hashes: list[str], cache: EmbeddingCache,
+                     engine_factory) -> tuple[np.ndarray, int]:
     """
-    Genera embeddings usando sentence-transformers.
+    Devuelve los embeddings de `texts`, codificando solo los que no están en caché.
+    El motor se crea únicamente si hay algo que codificar.
     """
-    model = SentenceTransformer(model_name)
-    embeddings = []
-    for text in tqdm(texts, desc="Generando embeddings"):
-        emb = model.encode(text, convert_to_numpy=True)
-        embeddings.append(emb.astype(np.float32))
-    return np.vstack(embeddings)
+    missing = [i for i, h in enumerate(hashes) if cache.get(h) is None]
+    if missing:
+        engine = engine_factory()
+        new_vectors = engine.encode([texts[i] for i in missing])
+        cache.put_many([hashes[i] for i in missing], new_vectors)
+    if not texts:
+        return np.empty((0, 0), dtype=np.float32), 0
+    embeddings = np.vstack([cache.get(h) for h in hashes]).astype(np.float32, copy=False)
+    return embeddings, len(missing)
 
-def build_faiss_index(df: pd.DataFrame, index_path: Path = INDEX_PATH):
+def build_faiss_index(df: pd.DataFrame, index_path: Path = INDEX_PATH,
+                      engine: Optional[EmbeddingEngine] = None, incremental: bool = True,
+                      batch_size: int = BATCH_SIZE, num_workers: int = NUM_WORKERS,
+                      index_type: str = DEFAULT_INDEX_TYPE, index_params: Optional[dict] = None,
+                      backend: str = DEFAULT_BACKEND, hierarchy_level: str = DEFAULT_LEVEL):
     """
     Construye y guarda índice FAISS + chunks.parquet
+
+    En modo incremental reutiliza el índice existente: elimina los ids que ya no
+    están en los chunks y agrega solo los nuevos, tomando sus vectores de la
+    caché de embeddings cuando el texto ya se había codificado antes. Si cambia
+    el tipo de índice (o es HNSW) se reconstruye completo desde la caché.
+    El tipo, sus parámetros y el modelo/backend de embeddings quedan registrados
+    en data/index.meta.json: el Retriever codifica las consultas con el mismo backend.
+    También se genera el índice de grupos por página o documento para la
+    búsqueda jerárquica (ver rag.hierarchy).
     """
-    texts = df["text"].tolist()
-    embeddings = get_embeddings(texts)
-    dim = embeddings.shape[1]
+    df = ensure_vector_ids(df)
+    model_name = engine.model_name if engine is not None else MODEL_NAME
+    backend = engine.backend if engine is not None else backend
+    # Vectores de modelos o backends distintos no se mezclan: una caché por par
+    cache = EmbeddingCache(embed_cache_path(backend, None if model_name == MODEL_NAME else model_name))
+
+    engines = []
+    def engine_factory():
+        if not engines:
+            engines.append(engine or EmbeddingEngine(batch_size=batch_size, num_workers=num_workers,
+                                                     backend=backend))
+        return engines[0]
+
+    index, existing_ids = (None, None)
+    if incremental and index_params is None:
+        index, existing_ids = load_index_ids(index_path, index_type, (model_name, backend))
+    wanted_ids = df["vector_id"].to_numpy(dtype=np.int64)
 
-    index = faiss.IndexFlatL2(dim)  # o IndexFlatIP para similitud coseno
-    index.add(embeddings)
+    start = time.perf_counter()
+    if index is not None:
+        meta = load_meta(index_path)
+        stale = np.setdiff1d(existing_ids, wanted_ids)
+        if len(stale):
+            index.remove_ids(stale)
+        to_add = df[~np.isin(wanted_ids, existing_ids)]
+        print(f"[INFO] Índice incremental: {len(stale)} eliminados, {len(to_add)} nuevos, "
+              f"{len(df) - len(to_add)} sin cambios")
+    else:
+        meta = None
+        to_add = df
+
+    texts = to_add["text"].tolist()
+    embeddings, encoded = embed_with_cache(texts, to_add["text_hash"].tolist(), cache, engine_factory)
+    elapsed = time.perf_counter() - start
+
+    build_start = time.perf_counter()
+    ids_to_add = to_add["vector_id"].to_numpy(dtype=np.int64)
+    if index is None:
+        meta = {**make_meta(index_type, embeddings.shape[1], index_params),
+                "encoder": encoder_meta(model_name, backend)}
+        index = build_index(meta, prepare_vectors(embeddings, meta), ids_to_add)
+    elif len(texts):
+        index.add_with_ids(prepare_vectors(embeddings, meta), ids_to_add)
+    print(f"[INFO] Índice '{meta['index_type']}' listo en {time.perf_counter() - build_start:.2f}s "
+          f"(parámetros: {meta['params']}, embeddings: {backend})")
 
     # Guardar índice FAISS
     faiss.write_index(index, str(index_path))
-    print(f"[INFO] Index FAISS guardado en {index_path}")
+
+    # Índice de grupos: necesita los vectores de todos los chunks (los sin cambios salen de la caché)
+    all_embeddings = embeddings
+    if len(to_add) != len(df):
+        all_embeddings, _ = embed_with_cache(df["text"].tolist(), df["text_hash"].tolist(), cache, engine_factory)
+    groups = build_hierarchy(df, all_embeddings, index_path, hierarchy_level)
+    print(f"[INFO] Índice de grupos: {len(groups)} grupos por {hierarchy_level}")
+
+    save_meta(index_path, {**meta, "encoder": encoder_meta(model_name, backend), "ntotal": int(index.ntotal),
+                           "hierarchy": {"level": hierarchy_level, "groups": len(groups)}})
+    print(f"[INFO] Index FAISS guardado en {index_path} ({index.ntotal} vectores)")
 
     # Guardar chunks.parquet (ya deberían estar)
     df.to_parquet(DATA_PATH, index=False)
     print(f"[INFO] Chunks guardados en {DATA_PATH}")
+    store_path = store_path_for(str(DATA_PATH))
+    write_chunk_store(df, store_path)
+    print(f"[INFO] Chunk store (Arrow, mapeable en memoria) guardado en {store_path}")
+    cache.save(keep=set(df["text_hash"]))
+
+    rate = encoded / elapsed if elapsed > 0 else float("inf")
+    if engines:
+        batch_size, num_workers = engines[0].batch_size, engines[0].num_workers
+    print(f"[INFO] {encoded} chunks embebidos ({len(texts) - encoded} desde caché) en {elapsed:.2f}s "
+          f"({rate:.1f} chunks/s, batch={batch_size}, workers={num_workers})")
 # ---------------------
 # CLI rápido
 # ---------------------
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Genera embeddings e índice FAISS")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE, help="Tamaño de lote para el encoder")
+    parser.add_argument("--workers", type=int, default=NUM_WORKERS, help="Procesos CPU para codificar")
+    parser.add_argument("--backend", type=str, choices=ENCODER_BACKENDS, default=DEFAULT_BACKEND,
+                        help="Backend de embeddings; las consultas usarán el mismo (ver rag.encoders)")
+    parser.add_argument("--full", action="store_true", help="Reconstruye el índice desde cero")
+    parser.add_argument("--index-type", type=str, choices=INDEX_TYPES, default=DEFAULT_INDEX_TYPE,
+                        help="Tipo de índice FAISS")
+    parser.add_argument("--nlist", type=int, default=None, help="Centroides IVF (ivf/ivfpq)")
+    parser.add_argument("--nprobe", type=int, default=None, help="Listas IVF visitadas por búsqueda")
+    parser.add_argument("--hnsw-m", type=int, default=None, help="Vecinos por nodo en HNSW")
+    parser.add_argument("--ef-search", type=int, default=None, help="efSearch de HNSW")
+    parser.add_argument("--pq-m", type=int, default=None, help="Subcuantizadores de PQ (ivfpq)")
+    parser.add_argument("--hierarchy-level", type=str, choices=HIERARCHY_LEVELS, default=DEFAULT_LEVEL,
+                        help="Grupos de la etapa gruesa de la búsqueda jerárquica")
+    args = parser.parse_args()
+
+    index_params = {
+        key: value for key, value in {
+            "nlist": args.nlist, "nprobe": args.nprobe, "M": args.hnsw_m,
+            "efSearch": args.ef_search, "m": args.pq_m,
+        }.items() if value is not None
+    } or None
+
     df = load_chunks()
-    build_faiss_index(df)
+    build_faiss_index(df, incremental=not args.full,
+                      batch_size=args.batch_size, num_workers=args.workers,
+                      index_type=args.index_type, index_params=index_params,
+                      backend=args.backend, hierarchy_level=args.hierarchy_level)
@@ -0,0 +1,243 @@
+import json
+import shutil
+import logging
+import argparse
+import tempfile
+from pathlib import Path
+from typing import Optional
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# ---------------------
+# Configuración
+# ---------------------
+MODEL_NAME = "all-MiniLM-L6-v2"   # SentenceTransformers
+# "torch"     → SentenceTransformer sobre PyTorch (el de siempre)
+# "onnx"      → el mismo modelo exportado a ONNX (fp32); no importa torch
+# "onnx-int8" → ONNX con cuantización dinámica int8 de las capas lineales
+ENCODER_BACKENDS = ("torch", "onnx", "onnx-int8")
+DEFAULT_BACKEND = "torch"
+ONNX_DIR = Path("data/models")
+ONNX_OPSET = 14
+# Coseno mínimo (por texto) aceptado frente a PyTorch al exportar
+MIN_AGREEMENT = {"onnx": 0.999, "onnx-int8": 0.98}
+AGREEMENT_SAMPLE = 256
+_SAMPLE_TEXTS = [
+    "¿Cuál es la nota mínima para aprobar una asignatura?",
+    "El estudiante podrá solicitar la convalidación de asignaturas cursadas en otra institución.",
+    "Artículo 23: la asistencia mínima a las actividades prácticas será de un 75%.",
+    "Reglamento de régimen de estudios de pregrado de la Universidad de La Frontera.",
+]
+
+
+def onnx_dir(model_name: str = MODEL_NAME) -> Path:
+    """Carpeta del modelo exportado (data/models/<modelo>)."""
+    return ONNX_DIR / model_name.replace("/", "__")
+
+
+def encoder_meta(model_name: str, backend: str) -> dict:
+    """Lo que se guarda en data/index.meta.json para codificar consultas igual que el índice."""
+    return {"model": model_name, "backend": backend}
+
+
+def index_encoder(meta: dict, model_name: str = MODEL_NAME) -> tuple[str, str]:
+    """(modelo, backend) con que se construyó el índice; los índices antiguos usan PyTorch."""
+    encoder = meta.get("encoder") or {}
+    return encoder.get("model", model_name), encoder.get("backend", DEFAULT_BACKEND)
+
+
+class OnnxEncoder:
+    """
+    Codificador sobre ONNX Runtime con la interfaz de SentenceTransformer que usa
+    el proyecto (`encode`, `get_sentence_embedding_dimension`).
+
+    Tokeniza con `tokenizers` (Rust, relleno solo hasta el texto más largo del
+    lote) y hace el mean pooling y la normalización en numpy, así que no carga
+    torch: menos latencia por consulta y menos memoria por worker.
+    """
+
+    def __init__(self, model_name: str = MODEL_NAME, quantized: bool = True,
+                 model_dir: Optional[Path] = None, num_threads: Optional[int] = None):
+        import onnxruntime as ort
+        from tokenizers import Tokenizer
+
+        self.model_dir = Path(model_dir) if model_dir else onnx_dir(model_name)
+        config_path = self.model_dir / "encoder.json"
+        if not config_path.exists():
+            raise FileNotFoundError(f"No se encontró {config_path}; "
+                                    f"genera el modelo con `python -m rag.encoders --model {model_name}`")
+        with open(config_path, "r", encoding="utf-8") as f:
+            self.config = json.load(f)
+
+        self.tokenizer = Tokenizer.from_file(str(self.model_dir / "tokenizer.json"))
+        self.tokenizer.enable_truncation(max_length=self.config["max_seq_length"])
+        self.tokenizer.enable_padding(pad_id=self.config["pad_token_id"], pad_token=self.config["pad_token"])
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if num_threads:
+            options.intra_op_num_threads = num_threads
+        model_file = "model.int8.onnx" if quantized else "model.onnx"
+        self.session = ort.InferenceSession(str(self.model_dir / model_file), options,
+                                            providers=["CPUExecutionProvider"])
+        self.input_names = {i.name for i in self.session.get_inputs()}
+
+    def get_sentence_embedding_dimension(self) -> int:
+        return self.config["dim"]
+
+    def _encode_batch(self, texts: list[str]) -> np.ndarray:
+        encodings = self.tokenizer.encode_batch(texts)
+        input_ids = np.array([e.ids for e in encodings], dtype=np.int64)
+        attention_mask = np.array([e.attention_mask for e in encodings], dtype=np.int64)
+        feeds = {"input_ids": input_ids, "attention_mask": attention_mask}
+        if "token_type_ids" in self.input_names:
+            feeds["token_type_ids"] = np.array([e.type_ids for e in encodings], dtype=np.int64)
+        hidden = self.session.run(None, feeds)[0]
+
+        # Mean pooling sobre los tokens reales (sin relleno), como SentenceTransformer
+        mask = attention_mask[..., None].astype(np.float32)
+        embeddings = (hidden * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+        if self.config.get("normalize"):
+            embeddings /= np.clip(np.linalg.norm(embeddings, axis=1, keepdims=True), 1e-12, None)
+        return embeddings.astype(np.float32, copy=False)
+
+    def encode(self, sentences, batch_size: int = 32, convert_to_numpy: bool = True,
+               show_progress_bar: bool = False, **kwargs) -> np.ndarray:
+        single = isinstance(sentences, str)
+        texts = [sentences] if single else list(sentences)
+        embeddings = np.empty((len(texts), self.get_sentence_embedding_dimension()), dtype=np.float32)
+        for start in range(0, len(texts), batch_size):
+            embeddings[start:start + batch_size] = self._encode_batch(texts[start:start + batch_size])
+        return embeddings[0] if single else embeddings
+
+
+def load_encoder(model_name: str = MODEL_NAME, backend: str = DEFAULT_BACKEND):
+    """Modelo de embeddings del backend pedido; torch solo se importa con "torch"."""
+    if backend not in ENCODER_BACKENDS:
+        raise ValueError(f"Backend de embeddings desconocido: {backend}")
+    if backend == "torch":
+        from sentence_transformers import SentenceTransformer
+        return SentenceTransformer(model_name)
+    return OnnxEncoder(model_name, quantized=backend == "onnx-int8")
+
+
+def cosine_agreement(vectors: np.ndarray, reference: np.ndarray) -> dict:
+    """Coseno fila a fila entre dos juegos de embeddings de los mismos textos."""
+    a = vectors / np.clip(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12, None)
+    b = reference / np.clip(np.linalg.norm(reference, axis=1, keepdims=True), 1e-12, None)
+    cos = (a * b).sum(axis=1)
+    return {"mean": round(float(cos.mean()), 6), "min": round(float(cos.min()), 6),
+            "p01": round(float(np.percentile(cos, 1)), 6), "texts": int(len(cos))}
+
+
+def agreement_texts(chunks_path: Path = Path("data/processed/chunks.parquet"),
+                    sample: int = AGREEMENT_SAMPLE) -> list[str]:
+    """Muestra de chunks reales (si existen) más algunas preguntas de ejemplo."""
+    texts = list(_SAMPLE_TEXTS)
+    if chunks_path.exists():
+        import pandas as pd
+        df = pd.read_parquet(chunks_path, columns=["text"])
+        texts += df["text"].sample(min(sample, len(df)), random_state=0).tolist()
+    return texts
+
+
+def export_onnx(model_name: str = MODEL_NAME, output_dir: Optional[Path] = None,
+                quantize: bool = True, opset: int = ONNX_OPSET) -> dict:
+    """
+    Exporta el transformer del SentenceTransformer a ONNX (y su versión int8),
+    guarda el tokenizer y verifica la concordancia coseno contra PyTorch.
+    Todo se escribe en una carpeta temporal junto al destino, que solo reemplaza
+    a `output_dir` si la concordancia alcanza `MIN_AGREEMENT`; si no, se borra y
+    el modelo exportado antes (si lo hay) queda intacto.
+    Devuelve la configuración escrita en encoder.json.
+    """
+    output_dir = Path(output_dir) if output_dir else onnx_dir(model_name)
+    output_dir.parent.mkdir(parents=True, exist_ok=True)
+    staging = Path(tempfile.mkdtemp(prefix=f".{output_dir.name}.", dir=output_dir.parent))
+    try:
+        config = _export_to(staging, model_name, quantize, opset)
+        failed = {b: a for b, a in config["agreement"].items() if a["min"] < MIN_AGREEMENT[b]}
+        if failed:
+            raise RuntimeError(f"Los embeddings de {', '.join(failed)} no coinciden con PyTorch "
+                               f"({failed}); no se modifica {output_dir}")
+        if output_dir.exists():
+            shutil.rmtree(output_dir)
+        staging.rename(output_dir)
+    finally:
+        shutil.rmtree(staging, ignore_errors=True)
+    logger.info(f"Modelo ONNX guardado en {output_dir}")
+    return config
+
+
+def _export_to(output_dir: Path, model_name: str, quantize: bool, opset: int) -> dict:
+    """Exporta en `output_dir` y mide la concordancia (sin decidir si se acepta)."""
+    import torch
+    from sentence_transformers import SentenceTransformer
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+
+    model = SentenceTransformer(model_name, device="cpu")
+    transformer = model[0]
+    pooling = next((m for m in model if type(m).__name__ == "Pooling"), None)
+    if pooling is None or not pooling.get_config_dict().get("pooling_mode_mean_tokens"):
+        raise ValueError(f"{model_name} no usa mean pooling; el backend ONNX no lo soporta")
+    tokenizer = transformer.tokenizer
+    dummy = tokenizer(["texto de ejemplo"], return_tensors="pt")
+    input_names = [n for n in ("input_ids", "attention_mask", "token_type_ids") if n in dummy]
+
+    class _LastHiddenState(torch.nn.Module):
+        def __init__(self, auto_model):
+            super().__init__()
+            self.auto_model = auto_model
+
+        def forward(self, *inputs):
+            return self.auto_model(**dict(zip(input_names, inputs)), return_dict=False)[0]
+
+    dynamic_axes = {name: {0: "batch", 1: "sequence"} for name in [*input_names, "last_hidden_state"]}
+    model_path = output_dir / "model.onnx"
+    with torch.no_grad():
+        torch.onnx.export(_LastHiddenState(transformer.auto_model.eval()), tuple(dummy[n] for n in input_names),
+                          str(model_path), input_names=input_names, output_names=["last_hidden_state"],
+                          dynamic_axes=dynamic_axes, opset_version=opset)
+    if quantize:
+        quantize_dynamic(str(model_path), str(output_dir / "model.int8.onnx"), weight_type=QuantType.QInt8)
+
+    tokenizer.save_pretrained(str(output_dir))
+    config = {
+        "model_name": model_name,
+        "dim": model.get_sentence_embedding_dimension(),
+        "max_seq_length": model.get_max_seq_length(),
+        "normalize": any(type(m).__name__ == "Normalize" for m in model),
+        "pad_token": tokenizer.pad_token,
+        "pad_token_id": tokenizer.pad_token_id,
+        "opset": opset,
+    }
+    with open(output_dir / "encoder.json", "w", encoding="utf-8") as f:
+        json.dump(config, f, ensure_ascii=False, indent=2)
+
+    # Concordancia con PyTorch: mismos textos, coseno por texto
+    texts = agreement_texts()
+    reference = model.encode(texts, convert_to_numpy=True)
+    config["agreement"] = {}
+    for backend in ("onnx", "onnx-int8") if quantize else ("onnx",):
+        encoder = OnnxEncoder(model_name, quantized=backend == "onnx-int8", model_dir=output_dir)
+        agreement = cosine_agreement(encoder.encode(texts), reference)
+        config["agreement"][backend] = agreement
+        level = logging.INFO if agreement["min"] >= MIN_AGREEMENT[backend] else logging.WARNING
+        logger.log(level, f"Concordancia {backend} vs torch: {agreement} (mínimo esperado {MIN_AGREEMENT[backend]})")
+    with open(output_dir / "encoder.json", "w", encoding="utf-8") as f:
+        json.dump(config, f, ensure_ascii=False, indent=2)
+    return config
+
+
+# ---------------------
+# CLI: exportar el modelo
+# ---------------------
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description="Exporta el modelo de embeddings a ONNX (fp32 e int8)")
+    parser.add_argument("--model", default=MODEL_NAME)
+    parser.add_argument("--output-dir", type=Path, default=None, help="Por defecto data/models/<modelo>")
+    parser.add_argument("--no-quantize", action="store_true", help="Solo exporta el modelo fp32")
+    args = parser.parse_args()
+    export_onnx(args.model, args.output_dir, quantize=not args.no_quantize)
@@ -0,0 +1,29 @@
+# rag/fusion.py
+
+# Modos de recuperación del Retriever: "dense" (FAISS), "lexical" (BM25) o
+# "hybrid" (ambos fusionados por reciprocal rank). Viven aquí, sin dependencias
+# pesadas, para que la CLI pueda ofrecerlos sin importar FAISS ni el modelo.
+RETRIEVAL_MODES = ("dense", "lexical", "hybrid")
+
+def doc_key(doc: dict):
+    """Identificador de un chunk recuperado (chunk_id si existe)."""
+    return doc.get("chunk_id") or (doc.get("doc_id"), doc.get("page"), doc.get("text"))
+
+
+def reciprocal_rank_fusion(result_lists: list[list[dict]], top_k: int, k: int = 60) -> list[dict]:
+    """
+    Fusiona varias listas de resultados por Reciprocal Rank Fusion.
+
+    Cada chunk suma 1 / (k + rango) por cada lista en que aparece; los
+    duplicados se colapsan en un solo resultado con su puntaje `rrf_score`.
+    """
+    scores = {}
+    docs = {}
+    for results in result_lists:
+        for rank, doc in enumerate(results, start=1):
+            key = doc_key(doc)
+            scores[key] = scores.get(key, 0.0) + 1.0 / (k + rank)
+            docs.setdefault(key, doc)
+
+    ranked = sorted(scores, key=scores.get, reverse=True)[:top_k]
+    return [{**docs[key], "rrf_score": scores[key]} for key in ranked]
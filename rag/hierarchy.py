@@ -0,0 +1,163 @@
+import logging
+from pathlib import Path
+from typing import Optional, TYPE_CHECKING
+import numpy as np
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+# Recuperación jerárquica en dos etapas:
+# 1. Etapa gruesa: un índice pequeño con un vector por página (o por documento),
+#    el promedio normalizado de los vectores de sus chunks, elige los
+#    `top_groups` grupos más parecidos a la consulta.
+# 2. Etapa fina: los chunks se buscan solo entre los de esos grupos.
+# El costo de la etapa fina depende del tamaño de los grupos elegidos y no del
+# total de chunks. Los filtros por metadatos (`doc_filter`) descartan grupos
+# antes de la etapa gruesa.
+# rag.embed genera el índice de grupos junto al índice FAISS (data/index.groups.npz).
+
+HIERARCHY_LEVELS = ("page", "document")
+DEFAULT_LEVEL = "page"
+TOP_GROUPS = 8
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    """Copia float32 con norma 1 por fila (sin faiss: la CLI importa este módulo al arrancar)."""
+    vectors = np.array(vectors, dtype=np.float32, ndmin=2)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+def hierarchy_path(index_path) -> Path:
+    """Archivo de grupos que acompaña al índice (data/index.groups.npz)."""
+    index_path = Path(index_path)
+    return index_path.with_name(index_path.stem + ".groups.npz")
+
+
+def matches_filter(doc_id: str, doc_filter) -> bool:
+    """`doc_filter` es una lista de fragmentos: basta que uno aparezca en el doc_id (sin mayúsculas)."""
+    doc_id = str(doc_id).lower()
+    return any(f.lower() in doc_id for f in doc_filter)
+
+
+def top_k_subset(vectors: np.ndarray, ids: np.ndarray, query: np.ndarray, k: int,
+                 metric: str = "ip") -> tuple[np.ndarray, np.ndarray]:
+    """
+    Búsqueda exacta sobre un subconjunto ya reunido: (puntajes, ids) de los `k`
+    mejores, con la misma escala que FAISS (producto interno o L2 al cuadrado).
+    """
+    if len(ids) == 0:
+        return np.empty(0, dtype=np.float32), np.empty(0, dtype=np.int64)
+    if metric == "l2":
+        scores = ((vectors - query) ** 2).sum(axis=1)
+        order = scores
+    else:
+        scores = vectors @ query
+        order = -scores
+    k = min(k, len(ids))
+    top = np.argpartition(order, k - 1)[:k]
+    top = top[np.argsort(order[top], kind="stable")]
+    return scores[top], ids[top]
+
+
+class GroupIndex:
+    """
+    Índice grueso: un vector por grupo (página o documento) y, para cada grupo,
+    los ids de FAISS de sus chunks (`members[offsets[g]:offsets[g + 1]]`).
+    """
+
+    def __init__(self, vectors: np.ndarray, doc_ids: np.ndarray, pages: np.ndarray,
+                 offsets: np.ndarray, members: np.ndarray, level: str = DEFAULT_LEVEL):
+        self.vectors = vectors
+        self.doc_ids = doc_ids
+        self.pages = pages
+        self.offsets = offsets
+        self.members = members
+        self.level = level
+        self._masks = {}  # filtro → máscara de grupos
+
+    def __len__(self):
+        return len(self.vectors)
+
+    @classmethod
+    def build(cls, df: "pd.DataFrame", embeddings: np.ndarray, level: str = DEFAULT_LEVEL) -> "GroupIndex":
+        """Agrupa los chunks (filas de `df`, alineadas con `embeddings`) por documento y página."""
+        if level not in HIERARCHY_LEVELS:
+            raise ValueError(f"Nivel de jerarquía desconocido: {level}")
+        keys = ["doc_id"] if level == "document" else ["doc_id", "page"]
+        group = df.groupby(keys, sort=True).ngroup().to_numpy()
+        order = np.argsort(group, kind="stable")
+        offsets = np.concatenate([[0], np.cumsum(np.bincount(group))]).astype(np.int64)
+
+        vectors = _normalize(embeddings)[order]
+        sums = np.add.reduceat(vectors, offsets[:-1], axis=0) if len(vectors) else vectors
+        first = order[offsets[:-1]]
+        pages = df["page"].to_numpy(dtype=np.int64)[first] if level == "page" else np.full(len(first), -1)
+        return cls(
+            vectors=_normalize(sums),
+            doc_ids=np.asarray(df["doc_id"].to_numpy()[first], dtype=str),
+            pages=pages,
+            offsets=offsets,
+            members=df["vector_id"].to_numpy(dtype=np.int64)[order],
+            level=level,
+        )
+
+    def save(self, path: Path):
+        tmp_path = path.with_suffix(".tmp")
+        with open(tmp_path, "wb") as f:
+            np.savez(f, vectors=self.vectors, doc_ids=self.doc_ids, pages=self.pages,
+                     offsets=self.offsets, members=self.members, level=np.array(self.level))
+        tmp_path.replace(path)
+
+    @classmethod
+    def load(cls, path: Path) -> "GroupIndex":
+        data = np.load(path, allow_pickle=False)
+        return cls(data["vectors"], data["doc_ids"], data["pages"], data["offsets"],
+                   data["members"], str(data["level"]))
+
+    def allowed(self, doc_filter) -> Optional[np.ndarray]:
+        """Máscara de grupos que pasan el filtro (None = todos)."""
+        if not doc_filter:
+            return None
+        key = tuple(doc_filter)
+        if key not in self._masks:
+            self._masks[key] = np.array([matches_filter(d, doc_filter) for d in self.doc_ids], dtype=bool)
+        return self._masks[key]
+
+    def candidates(self, query_vecs: np.ndarray, top_groups: int, doc_filter=None) -> list[np.ndarray]:
+        """Ids de FAISS de los chunks de los `top_groups` grupos más parecidos a cada consulta."""
+        scores = _normalize(query_vecs) @ self.vectors.T
+        mask = self.allowed(doc_filter)
+        if mask is not None:
+            scores[:, ~mask] = -np.inf
+            top_groups = min(top_groups, int(mask.sum()))
+        top_groups = min(top_groups, len(self))
+        if top_groups <= 0:
+            return [np.empty(0, dtype=np.int64) for _ in range(len(scores))]
+        best = np.argpartition(-scores, top_groups - 1, axis=1)[:, :top_groups]
+        return [
+            np.concatenate([self.members[self.offsets[g]:self.offsets[g + 1]] for g in row])
+            for row in best
+        ]
+
+
+def build_hierarchy(df: "pd.DataFrame", embeddings: np.ndarray, index_path,
+                    level: str = DEFAULT_LEVEL) -> GroupIndex:
+    groups = GroupIndex.build(df, embeddings, level)
+    groups.save(hierarchy_path(index_path))
+    return groups
+
+
+def load_hierarchy(index_path, ntotal: int) -> Optional[GroupIndex]:
+    """Índice de grupos del índice FAISS, o None si no existe o no corresponde a sus `ntotal` vectores."""
+    path = hierarchy_path(index_path)
+    if not path.exists():
+        return None
+    groups = GroupIndex.load(path)
+    if len(groups.members) != ntotal:
+        logger.warning(f"{path} no corresponde al índice ({len(groups.members)} chunks, {ntotal} vectores); "
+                       f"se ignora hasta volver a ejecutar rag.embed.")
+        return None
+    return groups
@@ -0,0 +1,130 @@
+import json
+import math
+from pathlib import Path
+from typing import Optional
+import numpy as np
+import faiss
+
+# ---------------------
+# Configuración
+# ---------------------
+# "flat"     → búsqueda exacta por producto interno sobre vectores normalizados (coseno)
+# "flat_l2"  → formato antiguo: distancia L2 sin normalizar
+# "ivf"      → IVF con centroides entrenados; `nprobe` regula precisión/latencia
+# "hnsw"     → grafo HNSW; `efSearch` regula precisión/latencia (no admite borrar ids)
+# "ivfpq"    → IVF + Product Quantization, para hosts con poca memoria
+INDEX_TYPES = ("flat", "flat_l2", "ivf", "hnsw", "ivfpq")
+DEFAULT_INDEX_TYPE = "flat"
+
+DEFAULT_PARAMS = {
+    "ivf": {"nlist": None, "nprobe": 8},
+    "hnsw": {"M": 32, "efConstruction": 80, "efSearch": 64},
+    "ivfpq": {"nlist": None, "nprobe": 8, "m": 48, "nbits": 8},
+}
+
+# FAISS recomienda al menos ~39 puntos de entrenamiento por centroide
+MIN_POINTS_PER_CENTROID = 39
+
+
+def meta_path(index_path) -> Path:
+    """Ruta del archivo de metadatos que acompaña al índice (data/index.meta.json)."""
+    index_path = Path(index_path)
+    return index_path.with_name(index_path.stem + ".meta.json")
+
+
+def load_meta(index_path) -> dict:
+    """Metadatos del índice; los índices sin metadatos son del formato antiguo (flat_l2)."""
+    path = meta_path(index_path)
+    if not path.exists():
+        return {"index_type": "flat_l2", "metric": "l2", "normalize": False, "params": {}}
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_meta(index_path, meta: dict):
+    with open(meta_path(index_path), "w", encoding="utf-8") as f:
+        json.dump(meta, f, ensure_ascii=False, indent=2)
+
+
+def make_meta(index_type: str, dim: int, params: Optional[dict] = None) -> dict:
+    if index_type not in INDEX_TYPES:
+        raise ValueError(f"Tipo de índice desconocido: {index_type}")
+    merged = {**DEFAULT_PARAMS.get(index_type, {}), **(params or {})}
+    return {
+        "index_type": index_type,
+        "dim": dim,
+        "metric": "l2" if index_type == "flat_l2" else "ip",
+        "normalize": index_type != "flat_l2",
+        "params": merged,
+    }
+
+
+def supports_removal(index_type: str) -> bool:
+    """HNSW no permite eliminar vectores; el resto sí (a través de IndexIDMap)."""
+    return index_type != "hnsw"
+
+
+def prepare_vectors(vectors: np.ndarray, meta: dict) -> np.ndarray:
+    """Copia contigua float32, normalizada si el índice usa similitud coseno."""
+    vectors = np.array(vectors, dtype=np.float32, order="C")
+    if meta.get("normalize"):
+        faiss.normalize_L2(vectors)
+    return vectors
+
+
+def _nlist_for(n: int, requested: Optional[int]) -> int:
+    if requested:
+        return max(1, min(requested, n // MIN_POINTS_PER_CENTROID or 1))
+    return max(1, min(int(4 * math.sqrt(n)), n // MIN_POINTS_PER_CENTROID or 1))
+
+
+def build_index(meta: dict, vectors: np.ndarray, ids: np.ndarray) -> faiss.Index:
+    """
+    Crea, entrena (si corresponde) y llena un índice según `meta`.
+    `vectors` ya debe venir preparado con `prepare_vectors`.
+    Siempre se envuelve en IndexIDMap para conservar ids estables.
+    """
+    index_type = meta["index_type"]
+    params = meta["params"]
+    n, dim = vectors.shape
+
+    if index_type == "flat_l2":
+        base = faiss.IndexFlatL2(dim)
+    elif index_type == "flat":
+        base = faiss.IndexFlatIP(dim)
+    elif index_type == "hnsw":
+        base = faiss.IndexHNSWFlat(dim, params["M"], faiss.METRIC_INNER_PRODUCT)
+        base.hnsw.efConstruction = params["efConstruction"]
+    elif index_type == "ivf":
+        nlist = _nlist_for(n, params.get("nlist"))
+        params["nlist"] = nlist
+        quantizer = faiss.IndexFlatIP(dim)
+        base = faiss.IndexIVFFlat(quantizer, dim, nlist, faiss.METRIC_INNER_PRODUCT)
+        base.train(vectors)
+    else:  # ivfpq
+        nlist = _nlist_for(n, params.get("nlist"))
+        m = params["m"]
+        if dim % m != 0:
+            m = next(d for d in range(min(m, dim), 0, -1) if dim % d == 0)
+        # Con pocos puntos no se pueden entrenar 2^8 centroides por subespacio
+        nbits = max(1, min(params["nbits"], int(math.log2(max(2, n // MIN_POINTS_PER_CENTROID)))))
+        params.update({"nlist": nlist, "m": m, "nbits": nbits})
+        quantizer = faiss.IndexFlatIP(dim)
+        base = faiss.IndexIVFPQ(quantizer, dim, nlist, m, nbits, faiss.METRIC_INNER_PRODUCT)
+        base.train(vectors)
+
+    index = faiss.IndexIDMap(base)
+    if n:
+        index.add_with_ids(vectors, np.asarray(ids, dtype=np.int64))
+    apply_search_params(index, meta)
+    return index
+
+
+def apply_search_params(index: faiss.Index, meta: dict):
+    """Aplica los parámetros de búsqueda (nprobe / efSearch) registrados en los metadatos."""
+    params = meta.get("params", {})
+    space = faiss.ParameterSpace()
+    if meta.get("index_type") in ("ivf", "ivfpq") and params.get("nprobe"):
+        space.set_index_parameter(index, "nprobe", params["nprobe"])
+    elif meta.get("index_type") == "hnsw" and params.get("efSearch"):
+        space.set_index_parameter(index, "efSearch", params["efSearch"])
@@ -1,12 +1,43 @@
 import os
 import re
+import time
+import argparse
+from typing import Iterator, Optional
+from concurrent.futures import ProcessPoolExecutor
 import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
 from pypdf import PdfReader
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 import logging
 
+from .manifest import file_hash, text_hash, vector_id, load_manifest, save_manifest
+from .lexical import LexicalIndex
+
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
+CHUNK_SIZE = 1000
+CHUNK_OVERLAP = 150
+WRITE_BATCH_SIZE = 512  # filas por lote al escribir el parquet
+
+CHUNK_SCHEMA = pa.schema([
+    ("doc_id", pa.string()),
+    ("title", pa.string()),
+    ("page", pa.int64()),
+    ("chunk_id", pa.string()),
+    ("text", pa.string()),
+    ("text_hash", pa.string()),
+    ("vector_id", pa.int64()),
+])
+
+def make_text_splitter() -> RecursiveCharacterTextSplitter:
+    return RecursiveCharacterTextSplitter(
+        chunk_size=CHUNK_SIZE,
+        chunk_overlap=CHUNK_OVERLAP,
+        separators=["\n\n", "\n", ". ", " ", ""],
+        length_function=len
+    )
+
 def clean_text(text: str) -> str:
     text = re.sub(r'\s+', ' ', text)
     return text.strip()
@@ -42,59 +73,217 @@ def extract_text_from_txt(file_path: str) -> list[tuple[int, str]]:
         logging.error(f"No se pudo leer el TXT {file_path}: {e}")
         return []
 
-def ingest_data(raw_data_path: str) -> list[dict]:
-    all_chunks = []
-    text_splitter = RecursiveCharacterTextSplitter(
-        chunk_size=1000,
-        chunk_overlap=150,
-        separators=["\n\n", "\n", ". ", " ", ""],
-        length_function=len
-    )
+# ---------------------
+# Trabajo por página (ejecutable en un pool de procesos)
+# ---------------------
+_worker_splitter = None
+_worker_readers = {}
+
+def _split_page(task: tuple[str, int]) -> list[str]:
+    """
+    Extrae, limpia y divide una página de un PDF. Cada proceso mantiene su
+    propio splitter y un lector abierto por archivo.
+    """
+    global _worker_splitter
+    file_path, page_index = task
+    if _worker_splitter is None:
+        _worker_splitter = make_text_splitter()
+    try:
+        reader = _worker_readers.get(file_path)
+        if reader is None:
+            reader = _worker_readers[file_path] = PdfReader(file_path)
+        page_text = reader.pages[page_index].extract_text()
+    except Exception as e:
+        logging.error(f"No se pudo leer la página {page_index + 1} de {file_path}: {e}")
+        return []
+    if not page_text:
+        return []
+    return _worker_splitter.split_text(clean_text(page_text))
+
+def count_pdf_pages(file_path: str) -> int:
+    try:
+        return len(PdfReader(file_path).pages)
+    except Exception as e:
+        logging.error(f"No se pudo leer el PDF {file_path}: {e}")
+        return 0
+
+def make_chunk(doc_id: str, page_num: int, i: int, chunk_text: str) -> dict:
+    chunk_id = f"{doc_id}-{page_num}-{i}"
+    chunk_text_hash = text_hash(chunk_text)
+    return {
+        "doc_id": doc_id,
+        "title": doc_id.replace('_', ' ').replace('-', ' '),
+        "page": page_num, # ¡AQUÍ ESTÁ LA MAGIA!
+        "chunk_id": chunk_id,
+        "text": chunk_text,
+        "text_hash": chunk_text_hash,
+        "vector_id": vector_id(chunk_id, chunk_text_hash),
+    }
+
+def _split_pages_sequential(file_path: str, extension: str, text_splitter) -> Iterator[tuple[int, list[str]]]:
+    if extension == '.pdf':
+        pages_content = extract_text_from_pdf(file_path)
+    else:
+        pages_content = extract_text_from_txt(file_path)
+    for page_num, page_text in pages_content:
+        yield page_num, text_splitter.split_text(clean_text(page_text))
+
+def _split_pages_parallel(file_path: str, executor: ProcessPoolExecutor,
+                          workers: int) -> Iterator[tuple[int, list[str]]]:
+    logging.info(f"Extrayendo texto de PDF en paralelo: {os.path.basename(file_path)}")
+    n_pages = count_pdf_pages(file_path)
+    tasks = [(file_path, i) for i in range(n_pages)]
+    chunksize = max(1, n_pages // (workers * 4))
+    # executor.map conserva el orden de las páginas
+    for i, page_chunks in enumerate(executor.map(_split_page, tasks, chunksize=chunksize)):
+        yield i + 1, page_chunks
+
+# ---------------------
+# Ingesta
+# ---------------------
+def iter_document_chunks(raw_data_path: str, manifest: Optional[dict] = None,
+                         previous_chunks: Optional[pd.DataFrame] = None,
+                         workers: int = 1) -> Iterator[list[dict]]:
+    """
+    Genera, documento a documento, los chunks de los archivos en `raw_data_path`.
+
+    Si se entrega un `manifest` y los chunks de la ejecución anterior, los
+    archivos cuyo hash no cambió reutilizan sus chunks sin volver a parsearse.
+    El manifest se actualiza en sitio (archivo → hash y chunk_ids); los
+    archivos eliminados desaparecen de él. Con `workers > 1` las páginas de
+    los PDF se procesan en un pool de procesos, manteniendo ids y orden.
+    """
+    text_splitter = make_text_splitter()
     file_names = [f for f in os.listdir(raw_data_path) if os.path.isfile(os.path.join(raw_data_path, f))]
 
-    for file_name in file_names:
-        file_path = os.path.join(raw_data_path, file_name)
-        doc_id, extension = os.path.splitext(file_name)
-        
-        pages_content = []
-        if extension.lower() == '.pdf':
-            pages_content = extract_text_from_pdf(file_path)
-        elif extension.lower() == '.txt':
-            pages_content = extract_text_from_txt(file_path)
-        else:
-            continue
-            
-        if not pages_content:
-            continue
-
-        for page_num, page_text in pages_content:
-            cleaned_text = clean_text(page_text)
-            chunks = text_splitter.split_text(cleaned_text)
-            
-            for i, chunk_text in enumerate(chunks):
-                all_chunks.append({
-                    "doc_id": doc_id,
-                    "title": doc_id.replace('_', ' ').replace('-', ' '),
-                    "page": page_num, # ¡AQUÍ ESTÁ LA MAGIA!
-                    "chunk_id": f"{doc_id}-{page_num}-{i}",
-                    "text": chunk_text
-                })
+    previous_files = manifest.get("files", {}) if manifest is not None else {}
+    current_files = {}
+    previous_by_doc = {}
+    if previous_chunks is not None and not previous_chunks.empty:
+        previous_by_doc = {doc_id: group for doc_id, group in previous_chunks.groupby("doc_id", sort=False)}
+
+    executor = ProcessPoolExecutor(max_workers=workers) if workers > 1 else None
+    try:
+        for file_name in file_names:
+            file_path = os.path.join(raw_data_path, file_name)
+            doc_id, extension = os.path.splitext(file_name)
+            extension = extension.lower()
+            if extension not in ('.pdf', '.txt'):
+                continue
+
+            t0 = time.perf_counter()
+            digest = file_hash(file_path)
+            previous = previous_files.get(file_name)
+            if previous and previous.get("sha256") == digest and doc_id in previous_by_doc:
+                reused = previous_by_doc[doc_id]
+                if list(reused["chunk_id"]) == previous.get("chunk_ids"):
+                    logging.info(f"Sin cambios, se reutilizan {len(reused)} chunks: {file_name}")
+                    current_files[file_name] = previous
+                    yield reused.to_dict("records")
+                    continue
+
+            if executor is not None and extension == '.pdf':
+                pages = _split_pages_parallel(file_path, executor, workers)
+            else:
+                pages = _split_pages_sequential(file_path, extension, text_splitter)
+
+            file_chunks = [
+                make_chunk(doc_id, page_num, i, chunk_text)
+                for page_num, chunks in pages
+                for i, chunk_text in enumerate(chunks)
+            ]
+            logging.info(f"[timing] {file_name}: {len(file_chunks)} chunks en {time.perf_counter() - t0:.2f}s")
+            if not file_chunks:
+                continue
+
+            current_files[file_name] = {
+                "sha256": digest,
+                "chunk_ids": [c["chunk_id"] for c in file_chunks],
+            }
+            yield file_chunks
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+    if manifest is not None:
+        removed = set(previous_files) - set(current_files)
+        for file_name in sorted(removed):
+            logging.info(f"Archivo eliminado, se descartan sus chunks: {file_name}")
+        manifest["files"] = current_files
+
+def ingest_data(raw_data_path: str, manifest: Optional[dict] = None,
+                previous_chunks: Optional[pd.DataFrame] = None, workers: int = 1) -> list[dict]:
+    """Genera todos los chunks en memoria (ver `iter_document_chunks`)."""
+    all_chunks = []
+    for file_chunks in iter_document_chunks(raw_data_path, manifest, previous_chunks, workers):
+        all_chunks.extend(file_chunks)
     return all_chunks
 
+def write_chunks_parquet(document_chunks: Iterator[list[dict]], output_file: str,
+                         batch_size: int = WRITE_BATCH_SIZE) -> int:
+    """
+    Escribe los chunks al parquet por lotes, sin acumularlos todos en memoria.
+    Se escribe a un archivo temporal que reemplaza al final el de salida.
+    Devuelve el número de filas escritas.
+    """
+    tmp_file = output_file + ".tmp"
+    total = 0
+    buffer = []
+    with pq.ParquetWriter(tmp_file, CHUNK_SCHEMA) as writer:
+        for file_chunks in document_chunks:
+            buffer.extend(file_chunks)
+            while len(buffer) >= batch_size:
+                writer.write_table(pa.Table.from_pylist(buffer[:batch_size], schema=CHUNK_SCHEMA))
+                total += batch_size
+                buffer = buffer[batch_size:]
+        if buffer:
+            writer.write_table(pa.Table.from_pylist(buffer, schema=CHUNK_SCHEMA))
+            total += len(buffer)
+    if total:
+        os.replace(tmp_file, output_file)
+    else:
+        os.remove(tmp_file)
+    return total
+
 def main():
+    parser = argparse.ArgumentParser(description="Ingesta de documentos en data/raw")
+    parser.add_argument("--full", action="store_true", help="Ignora el manifest y re-procesa todos los archivos")
+    parser.add_argument("--workers", type=int, default=1, help="Procesos para extraer y dividir páginas de PDF")
+    args = parser.parse_args()
+
     logging.info("--- Iniciando el proceso de ingesta de datos ---")
     RAW_DATA_PATH = 'data/raw'
     PROCESSED_DATA_PATH = 'data/processed'
     OUTPUT_FILE = os.path.join(PROCESSED_DATA_PATH, 'chunks.parquet')
     os.makedirs(PROCESSED_DATA_PATH, exist_ok=True)
-    chunks = ingest_data(RAW_DATA_PATH)
-    if not chunks:
+
+    start = time.perf_counter()
+    manifest = {"files": {}} if args.full else load_manifest()
+    previous_chunks = None
+    if not args.full and os.path.exists(OUTPUT_FILE):
+        previous_chunks = pd.read_parquet(OUTPUT_FILE)
+        if "vector_id" not in previous_chunks.columns:
+            previous_chunks = None  # formato antiguo: se re-procesa todo
+    logging.info(f"[timing] carga de manifest y chunks previos: {time.perf_counter() - start:.2f}s")
+
+    document_chunks = iter_document_chunks(RAW_DATA_PATH, manifest=manifest,
+                                           previous_chunks=previous_chunks, workers=args.workers)
+    total = write_chunks_parquet(document_chunks, OUTPUT_FILE)
+    if not total:
         logging.error("No se generaron chunks. Finalizando.")
         return
-    df = pd.DataFrame(chunks)
-    df.to_parquet(OUTPUT_FILE)
+    save_manifest(manifest)
+
+    # Índice léxico (BM25) junto a chunks.parquet
+    t0 = time.perf_counter()
+    lexical_file = os.path.join(PROCESSED_DATA_PATH, 'lexical.npz')
+    chunk_columns = pd.read_parquet(OUTPUT_FILE, columns=["text", "vector_id"])
+    LexicalIndex.build(chunk_columns["text"].tolist(), chunk_columns["vector_id"].to_numpy()).save(lexical_file)
+    logging.info(f"[timing] índice léxico BM25 ({lexical_file}): {time.perf_counter() - t0:.2f}s")
+
     logging.info(f"--- Proceso de ingesta finalizado ---")
-    logging.info(f"Se guardaron {len(df)} chunks en: {OUTPUT_FILE}")
+    logging.info(f"Se guardaron {total} chunks en: {OUTPUT_FILE}")
+    logging.info(f"[timing] ingesta total: {time.perf_counter() - start:.2f}s (workers={args.workers})")
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
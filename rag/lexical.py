@@ -0,0 +1,132 @@
+import re
+import logging
+import unicodedata
+from collections import Counter
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+LEXICAL_PATH = "data/processed/lexical.npz"
+
+# Parámetros BM25 habituales
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+# Palabras vacías en español (ya sin tildes)
+STOPWORDS = frozenset("""
+a al algo algun alguna algunas alguno algunos ante antes como con contra cual cuales cuando de del
+desde donde durante e el ella ellas ellos en entre era eran es esa esas ese eso esos esta estan estas
+este esto estos fue fueron ha han hasta hay la las le les lo los mas me mi mis muy ni no nos o os otra
+otras otro otros para pero poco por porque que quien quienes se sea sean segun ser si sido sin sobre
+su sus tambien tan tanto te tiene tienen todo todos tu tus u un una unas uno unos y ya
+""".split())
+
+# Sufijos frecuentes en la normativa, del más largo al más corto
+_SUFFIXES = (
+    "amientos", "imientos", "aciones", "uciones", "amiento", "imiento", "idades", "mente",
+    "acion", "ucion", "cion", "idad", "ables", "ibles", "able", "ible", "ando", "iendo",
+    "ados", "idos", "adas", "idas", "ado", "ido", "ada", "ida", "es", "s",
+)
+_MIN_STEM = 4
+
+_TOKEN_RE = re.compile(r"\w+")
+
+
+def fold_accents(text: str) -> str:
+    """Minúsculas y sin tildes (la ñ también se pliega a n)."""
+    text = unicodedata.normalize("NFKD", text.lower())
+    return "".join(ch for ch in text if not unicodedata.combining(ch))
+
+
+def stem(token: str) -> str:
+    """Stemmer liviano para español: recorta plurales y sufijos derivativos comunes."""
+    if token.isdigit():
+        return token
+    for suffix in _SUFFIXES:
+        if token.endswith(suffix) and len(token) - len(suffix) >= _MIN_STEM:
+            return token[: -len(suffix)]
+    return token
+
+
+def tokenize(text: str) -> list[str]:
+    return [stem(tok) for tok in _TOKEN_RE.findall(fold_accents(text)) if tok not in STOPWORDS]
+
+
+class LexicalIndex:
+    """
+    Índice invertido con pesos BM25 precalculados por posting.
+
+    Para cada término se guardan las filas donde aparece y su peso BM25 ya
+    multiplicado por el idf, así una consulta solo suma pesos con numpy.
+    Las filas se identifican por `vector_ids` (los mismos ids estables de FAISS).
+    """
+
+    def __init__(self, terms, indptr, postings, weights, vector_ids):
+        self.vocab = {term: i for i, term in enumerate(terms)}
+        self.terms = terms
+        self.indptr = indptr
+        self.postings = postings
+        self.weights = weights
+        self.vector_ids = vector_ids
+
+    @classmethod
+    def build(cls, texts: list[str], vector_ids, k1: float = BM25_K1, b: float = BM25_B) -> "LexicalIndex":
+        n_docs = len(texts)
+        term_postings = {}
+        doc_len = np.zeros(n_docs, dtype=np.float32)
+        for row, text in enumerate(texts):
+            counts = Counter(tokenize(text))
+            doc_len[row] = sum(counts.values())
+            for term, tf in counts.items():
+                term_postings.setdefault(term, []).append((row, tf))
+
+        avgdl = float(doc_len.mean()) if n_docs else 0.0
+        terms = sorted(term_postings)
+        indptr = np.zeros(len(terms) + 1, dtype=np.int64)
+        postings, weights = [], []
+        for i, term in enumerate(terms):
+            rows, tfs = zip(*term_postings[term])
+            rows = np.array(rows, dtype=np.int32)
+            tfs = np.array(tfs, dtype=np.float32)
+            df = len(rows)
+            idf = np.log(1.0 + (n_docs - df + 0.5) / (df + 0.5))
+            norm = tfs + k1 * (1.0 - b + b * doc_len[rows] / max(avgdl, 1e-9))
+            postings.append(rows)
+            weights.append((idf * tfs * (k1 + 1.0) / norm).astype(np.float32))
+            indptr[i + 1] = indptr[i] + df
+
+        return cls(
+            np.array(terms),
+            indptr,
+            np.concatenate(postings) if postings else np.zeros(0, dtype=np.int32),
+            np.concatenate(weights) if weights else np.zeros(0, dtype=np.float32),
+            np.asarray(vector_ids, dtype=np.int64),
+        )
+
+    def save(self, path: str = LEXICAL_PATH):
+        np.savez(path, terms=self.terms, indptr=self.indptr, postings=self.postings,
+                 weights=self.weights, vector_ids=self.vector_ids)
+
+    @classmethod
+    def load(cls, path: str = LEXICAL_PATH) -> "LexicalIndex":
+        data = np.load(path, allow_pickle=False)
+        return cls(data["terms"], data["indptr"], data["postings"], data["weights"], data["vector_ids"])
+
+    def search(self, query: str, top_k: int = 3) -> tuple[np.ndarray, np.ndarray]:
+        """Devuelve (vector_ids, puntajes BM25) de los `top_k` mejores chunks."""
+        scores = np.zeros(len(self.vector_ids), dtype=np.float32)
+        for term in set(tokenize(query)):
+            i = self.vocab.get(term)
+            if i is None:
+                continue
+            start, end = self.indptr[i], self.indptr[i + 1]
+            # Cada fila aparece una sola vez por término: la suma directa es segura
+            scores[self.postings[start:end]] += self.weights[start:end]
+
+        nonzero = np.flatnonzero(scores)
+        if len(nonzero) == 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+        if len(nonzero) > top_k:
+            nonzero = nonzero[np.argpartition(-scores[nonzero], top_k - 1)[:top_k]]
+        best = nonzero[np.argsort(-scores[nonzero], kind="stable")]
+        return self.vector_ids[best], scores[best]
@@ -0,0 +1,100 @@
+import json
+import hashlib
+from pathlib import Path
+from typing import Optional
+import numpy as np
+
+# ---------------------
+# Configuración
+# ---------------------
+MANIFEST_PATH = Path("data/processed/manifest.json")
+EMBED_CACHE_PATH = Path("data/processed/embeddings_cache.npz")
+
+# ---------------------
+# Hashes
+# ---------------------
+def file_hash(file_path: str) -> str:
+    """SHA-256 del contenido de un archivo (leído por bloques)."""
+    h = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+def text_hash(text: str) -> str:
+    """Hash corto y estable del texto de un chunk."""
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=16).hexdigest()
+
+def vector_id(chunk_id: str, chunk_text_hash: str) -> int:
+    """
+    Id estable (int64 positivo) de un chunk dentro del índice FAISS.
+
+    Depende del chunk_id y del contenido, así un chunk modificado recibe un id
+    nuevo y el anterior se elimina del índice.
+    """
+    digest = hashlib.blake2b(f"{chunk_id}\x00{chunk_text_hash}".encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "little") & 0x7FFFFFFFFFFFFFFF
+
+# ---------------------
+# Manifest (archivo → hash y chunk_ids)
+# ---------------------
+def load_manifest(path: Path = MANIFEST_PATH) -> dict:
+    if not path.exists():
+        return {"files": {}}
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+def save_manifest(manifest: dict, path: Path = MANIFEST_PATH):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_suffix(".tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    tmp_path.replace(path)
+
+# ---------------------
+# Caché de embeddings (hash de texto → vector)
+# ---------------------
+def embed_cache_path(backend: str = "torch", model_name: Optional[str] = None) -> Path:
+    """
+    Caché por (modelo, backend) de embeddings; el modelo por defecto (None)
+    conserva los nombres originales y PyTorch el archivo original.
+    """
+    suffix = "" if backend == "torch" else f".{backend}"
+    if model_name is not None:
+        # "org/modelo" -> "org--modelo": un archivo por modelo, sin subcarpetas
+        suffix = f".{model_name.replace('/', '--')}{suffix}"
+    return EMBED_CACHE_PATH.with_name(f"embeddings_cache{suffix}.npz")
+
+class EmbeddingCache:
+    """Caché persistente de embeddings indexada por el hash del texto del chunk."""
+
+    def __init__(self, path: Path = EMBED_CACHE_PATH):
+        self.path = path
+        self._vectors: dict[str, np.ndarray] = {}
+        if path.exists():
+            data = np.load(path, allow_pickle=False)
+            for h, vec in zip(data["hashes"], data["vectors"]):
+                self._vectors[str(h)] = vec
+
+    def __len__(self):
+        return len(self._vectors)
+
+    def get(self, chunk_text_hash: str):
+        return self._vectors.get(chunk_text_hash)
+
+    def put_many(self, hashes: list[str], vectors: np.ndarray):
+        for h, vec in zip(hashes, vectors):
+            self._vectors[h] = vec
+
+    def save(self, keep: Optional[set] = None):
+        """Guarda la caché; si se indica `keep`, descarta los hashes que ya no se usan."""
+        if keep is not None:
+            self._vectors = {h: v for h, v in self._vectors.items() if h in keep}
+        if not self._vectors:
+            return
+        hashes = np.array(list(self._vectors.keys()))
+        vectors = np.vstack(list(self._vectors.values())).astype(np.float32, copy=False)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.path.with_name(self.path.stem + ".tmp.npz")
+        np.savez(tmp_path, hashes=hashes, vectors=vectors)
+        tmp_path.replace(self.path)
@@ -0,0 +1,314 @@
+import os
+import json
+import time
+import bisect
+import threading
+import contextvars
+from typing import Optional
+
+# Instrumentación liviana (solo biblioteca estándar):
+# - `span("etapa")` mide la duración de una etapa y la agrega al histograma
+#   rag_stage_duration_seconds{stage="etapa"}; si hay una traza activa
+#   (`start_trace`) también queda registrada en ella con sus atributos.
+# - `inc` / `observe` para contadores e histogramas sueltos.
+# - `render()` entrega todo en el formato de texto de Prometheus (/metrics).
+# Con `set_enabled(False)` (CLI) todas las funciones son no-op.
+# Con varios workers de gunicorn (RAG_METRICS_DIR definido), cada proceso
+# escribe sus contadores e histogramas en RAG_METRICS_DIR/<pid>.json (`flush`)
+# y `render` suma los de todos, como el modo multiproceso de prometheus_client.
+# Los archivos de workers que ya terminaron se conservan para que los
+# contadores no retrocedan; gunicorn.conf.py vacía la carpeta al arrancar.
+
+METRICS_DIR_ENV = "RAG_METRICS_DIR"
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+TOKEN_BUCKETS = (64, 128, 256, 512, 1024, 1536, 2048, 4096, 8192)
+
+STAGE_METRIC = "rag_stage_duration_seconds"
+METRIC_HELP = {
+    STAGE_METRIC: "Duración de cada etapa (cache, hyde, embed, groups, faiss, bm25, rerank, context, synthesize, ...)",
+    "rag_context_tokens": "Tokens de contexto enviados al LLM por pregunta",
+    "rag_llm_tokens_total": "Tokens informados por el proveedor (prompt/completion)",
+    "rag_cache_requests_total": "Consultas a las cachés del pipeline, por caché y resultado",
+    "rag_http_requests_total": "Peticiones HTTP por endpoint y código de estado",
+    "rag_http_request_duration_seconds": "Duración de las peticiones HTTP por endpoint",
+}
+
+_enabled = True
+_current_trace = contextvars.ContextVar("rag_trace", default=None)
+
+
+def set_enabled(enabled: bool):
+    """Activa o desactiva la instrumentación (desactivada, `span` no mide nada)."""
+    global _enabled
+    _enabled = enabled
+
+
+def is_enabled() -> bool:
+    return _enabled
+
+
+def _label_key(labels: dict) -> tuple:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(key: tuple, extra: Optional[tuple] = None) -> str:
+    pairs = [*key, extra] if extra else list(key)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in pairs) + "}"
+
+
+class Histogram:
+    """Conteos por bucket (no acumulados), suma y total; el registro los protege con su lock."""
+
+    def __init__(self, buckets: tuple):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._histograms = {}  # nombre → {labels: Histogram}
+        self._counters = {}    # nombre → {labels: valor}
+
+    def observe(self, name: str, value: float, buckets: tuple = LATENCY_BUCKETS, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            series = self._histograms.setdefault(name, {})
+            histogram = series.get(key)
+            if histogram is None:
+                histogram = series[key] = Histogram(buckets)
+            histogram.observe(value)
+
+    def inc(self, name: str, value: float = 1, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            series = self._counters.setdefault(name, {})
+            series[key] = series.get(key, 0) + value
+
+    def clear(self):
+        with self._lock:
+            self._histograms.clear()
+            self._counters.clear()
+
+    def snapshot(self) -> dict:
+        """Contadores e histogramas en una forma serializable a JSON (para `merge` en otro proceso)."""
+        with self._lock:
+            return {
+                "counters": {name: [[key, value] for key, value in series.items()]
+                             for name, series in self._counters.items()},
+                "histograms": {name: [[key, h.buckets, h.counts, h.sum, h.count] for key, h in series.items()]
+                               for name, series in self._histograms.items()},
+            }
+
+    def merge(self, snapshot: dict):
+        """Suma a este registro un `snapshot` (de otro worker)."""
+        with self._lock:
+            for name, series in snapshot.get("counters", {}).items():
+                target = self._counters.setdefault(name, {})
+                for key, value in series:
+                    key = tuple(tuple(pair) for pair in key)
+                    target[key] = target.get(key, 0) + value
+            for name, series in snapshot.get("histograms", {}).items():
+                target = self._histograms.setdefault(name, {})
+                for key, buckets, counts, total, count in series:
+                    key = tuple(tuple(pair) for pair in key)
+                    histogram = target.get(key)
+                    if histogram is None:
+                        histogram = target[key] = Histogram(tuple(buckets))
+                    histogram.counts = [a + b for a, b in zip(histogram.counts, counts)]
+                    histogram.sum += total
+                    histogram.count += count
+
+    def render(self, gauges: Optional[dict] = None, counters: Optional[dict] = None) -> str:
+        """
+        Formato de exposición de texto de Prometheus (versión 0.0.4).
+        `gauges` y `counters` agregan valores leídos al momento: {nombre: (ayuda, valor)};
+        los de `counters` solo crecen y sus nombres terminan en `_total`.
+        """
+        lines = []
+        for metric_type, values in (("gauge", gauges), ("counter", counters)):
+            for name, (help_text, value) in sorted((values or {}).items()):
+                lines += [f"# HELP {name} {help_text}", f"# TYPE {name} {metric_type}", f"{name} {value:g}"]
+        with self._lock:
+            for name, series in sorted(self._counters.items()):
+                lines.append(f"# HELP {name} {METRIC_HELP.get(name, name)}")
+                lines.append(f"# TYPE {name} counter")
+                for key, value in sorted(series.items()):
+                    lines.append(f"{name}{_format_labels(key)} {value:g}")
+            for name, series in sorted(self._histograms.items()):
+                lines.append(f"# HELP {name} {METRIC_HELP.get(name, name)}")
+                lines.append(f"# TYPE {name} histogram")
+                for key, h in sorted(series.items()):
+                    cumulative = 0
+                    for bound, count in zip(h.buckets, h.counts):
+                        cumulative += count
+                        lines.append(f"{name}_bucket{_format_labels(key, ('le', f'{bound:g}'))} {cumulative}")
+                    lines.append(f"{name}_bucket{_format_labels(key, ('le', '+Inf'))} {h.count}")
+                    lines.append(f"{name}_sum{_format_labels(key)} {h.sum:.6f}")
+                    lines.append(f"{name}_count{_format_labels(key)} {h.count}")
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+
+class Trace:
+    """Etapas de una petición, en orden de inicio (para el modo debug)."""
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.spans = []
+
+    def add(self, stage: str, start: float, duration: float, attrs: dict):
+        self.spans.append((stage, start, duration, attrs))
+
+    def to_list(self) -> list[dict]:
+        return [
+            {"stage": stage, "start_ms": round((start - self.start) * 1000, 2),
+             "duration_ms": round(duration * 1000, 2), **attrs}
+            for stage, start, duration, attrs in sorted(self.spans, key=lambda s: s[1])
+        ]
+
+
+class _Span:
+    __slots__ = ("stage", "labels", "attrs", "start")
+
+    def __init__(self, stage: str, labels: dict):
+        self.stage = stage
+        self.labels = labels
+        self.attrs = {}
+
+    def __enter__(self) -> dict:
+        self.start = time.perf_counter()
+        return self.attrs
+
+    def __exit__(self, exc_type, exc, tb):
+        duration = time.perf_counter() - self.start
+        registry.observe(STAGE_METRIC, duration, **{"stage": self.stage, **self.labels})
+        trace = _current_trace.get()
+        if trace is not None:
+            attrs = {**self.labels, **self.attrs}
+            if exc_type is not None:
+                attrs["error"] = exc_type.__name__
+            trace.add(self.stage, self.start, duration, attrs)
+        return False
+
+
+class _NoopSpan:
+    __slots__ = ()
+
+    def __enter__(self) -> dict:
+        return {}
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NOOP_SPAN = _NoopSpan()
+
+
+def span(stage: str, **labels):
+    """
+    Mide una etapa: `with span("faiss"):`. Las etiquetas (pocas y de baja
+    cardinalidad, ej. provider) van al histograma; el dict que devuelve el
+    `with` acepta atributos extra que solo se guardan en la traza.
+    """
+    if not _enabled:
+        return _NOOP_SPAN
+    return _Span(stage, labels)
+
+
+def inc(name: str, value: float = 1, **labels):
+    if _enabled:
+        registry.inc(name, value, **labels)
+
+
+def observe(name: str, value: float, buckets: tuple = LATENCY_BUCKETS, **labels):
+    if _enabled:
+        registry.observe(name, value, buckets, **labels)
+
+
+def record_cache(cache: str, hit: bool):
+    inc("rag_cache_requests_total", cache=cache, result="hit" if hit else "miss")
+
+
+def record_usage(provider: str, usage):
+    """Tokens de prompt/completion de una respuesta del SDK de OpenAI (si los trae)."""
+    if not _enabled or usage is None:
+        return
+    prompt_tokens = getattr(usage, "prompt_tokens", None) or 0
+    completion_tokens = getattr(usage, "completion_tokens", None) or 0
+    registry.inc("rag_llm_tokens_total", prompt_tokens, provider=provider, kind="prompt")
+    registry.inc("rag_llm_tokens_total", completion_tokens, provider=provider, kind="completion")
+    trace = _current_trace.get()
+    if trace is not None:
+        now = time.perf_counter()
+        trace.add("tokens", now, 0.0, {"provider": provider, "prompt_tokens": prompt_tokens,
+                                        "completion_tokens": completion_tokens})
+
+
+def start_trace() -> Optional[Trace]:
+    """Empieza a registrar las etapas de esta petición (hilo/tarea actual y sus hijos)."""
+    if not _enabled:
+        return None
+    trace = Trace()
+    _current_trace.set(trace)
+    return trace
+
+
+def end_trace():
+    _current_trace.set(None)
+
+
+def flush(counters: Optional[dict] = None):
+    """
+    Escribe las métricas de este proceso en RAG_METRICS_DIR/<pid>.json (no hace
+    nada sin esa variable). `counters` son contadores leídos al momento,
+    {nombre: (ayuda, valor)}, que se suman entre workers igual que los demás.
+    """
+    directory = os.getenv(METRICS_DIR_ENV)
+    if not directory or not _enabled:
+        return
+    snapshot = registry.snapshot()
+    for name, (help_text, value) in (counters or {}).items():
+        METRIC_HELP.setdefault(name, help_text)
+        snapshot["counters"][name] = [[(), value]]
+    path = os.path.join(directory, f"{os.getpid()}.json")
+    tmp_path = f"{path}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(snapshot, f)
+    os.replace(tmp_path, path)
+
+
+def render(gauges: Optional[dict] = None, counters: Optional[dict] = None) -> str:
+    """
+    Texto de /metrics. Con RAG_METRICS_DIR suma los contadores e histogramas de
+    todos los workers; los `gauges` son siempre los del proceso que responde.
+    """
+    directory = os.getenv(METRICS_DIR_ENV)
+    if not directory:
+        return registry.render(gauges, counters)
+    flush(counters)
+    merged = MetricsRegistry()
+    for name in sorted(os.listdir(directory)):
+        if not name.endswith(".json"):
+            continue
+        try:
+            with open(os.path.join(directory, name), "r", encoding="utf-8") as f:
+                merged.merge(json.load(f))
+        except (OSError, ValueError):
+            continue  # borrado entre listdir y open: se omite en este scrape
+    return merged.render(gauges)
@@ -1,58 +1,436 @@
 import re
+import ast
+import time
+import asyncio
 import logging
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
 from . import prompts
-from .retrieve import Retriever
+from typing import Iterator, Optional, TYPE_CHECKING
+from .cache import PipelineCache, SemanticCache, make_key
+from .singleflight import SingleFlight
+from .fusion import reciprocal_rank_fusion
+from .rerank import RERANK_CANDIDATES
+from .context import CONTEXT_TOKEN_BUDGET, NEAR_DUPLICATE_THRESHOLD, format_context_part, pack_context
+from .metrics import STAGE_METRIC, observe, record_cache, span
 from providers.base import Provider
 
+if TYPE_CHECKING:
+    from .retrieve import Retriever
+    from .rerank import Reranker
+
 logger = logging.getLogger(__name__)
 
+RETRIEVAL_STRATEGIES = ("direct", "hyde", "hybrid", "multi_query")
+MAX_QUERY_VARIANTS = 5
+
+# Hilos para lanzar HyDE en paralelo a la búsqueda directa (estrategia "hybrid")
+_hyde_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="hyde")
+
+def parse_query_list(text: str) -> list[str]:
+    """
+    Interpreta la salida de MULTI_QUERY_SYSTEM (una lista de Python) sin
+    ejecutar código; si no es una lista válida, toma una pregunta por línea.
+    """
+    match = re.search(r"\[.*\]", text, re.S)
+    if match:
+        try:
+            parsed = ast.literal_eval(match.group(0))
+            if isinstance(parsed, (list, tuple)):
+                return [q.strip() for q in parsed if isinstance(q, str) and q.strip()][:MAX_QUERY_VARIANTS]
+        except (ValueError, SyntaxError):
+            pass
+    lines = [re.sub(r'^\s*(?:[-*•]|\d+[.)])\s*', '', line).strip().strip('"\'') for line in text.splitlines()]
+    return [line for line in lines if line][:MAX_QUERY_VARIANTS]
+
+
+class CitationStreamFilter:
+    """
+    Aplica `postprocess` (deduplicación de citas) sobre texto que llega por partes.
+
+    Retiene lo que aún puede cambiar: una cita sin cerrar ("[doc-") y los
+    espacios finales que podrían preceder a una cita repetida.
+    """
+
+    def __init__(self, postprocess):
+        self.postprocess = postprocess
+        self.raw = ""
+        self.emitted = ""
+
+    def _stable_prefix(self) -> str:
+        text = self.raw
+        open_idx = text.rfind("[")
+        if open_idx != -1 and "]" not in text[open_idx:]:
+            text = text[:open_idx]
+        return text.rstrip()
+
+    def _advance(self, processed: str) -> str:
+        if not processed.startswith(self.emitted):
+            return ""
+        delta = processed[len(self.emitted):]
+        self.emitted = processed
+        return delta
+
+    def feed(self, fragment: str) -> str:
+        """Agrega un fragmento y devuelve el texto nuevo que ya es seguro emitir."""
+        self.raw += fragment
+        return self._advance(self.postprocess(self._stable_prefix()))
+
+    def finish(self) -> tuple[str, str]:
+        """Devuelve (texto pendiente, respuesta final post-procesada)."""
+        final_answer = self.postprocess(self.raw)
+        return self._advance(final_answer), final_answer
+
+
 class RAGPipeline:
-    def __init__(self, provider: Provider, retriever: Retriever, k: int = 3):
+    def __init__(self, provider: Provider, retriever: "Retriever", k: int = 3,
+                 cache: Optional[PipelineCache] = None,
+                 semantic_cache: Optional[SemanticCache] = None,
+                 strategy: str = "hyde", hyde_skip_threshold: Optional[float] = None,
+                 reranker: Optional["Reranker"] = None, rerank_candidates: int = RERANK_CANDIDATES,
+                 context_budget: Optional[int] = CONTEXT_TOKEN_BUDGET,
+                 dedup_threshold: Optional[float] = NEAR_DUPLICATE_THRESHOLD,
+                 singleflight: Optional[SingleFlight] = None):
+        """
+        Args:
+            strategy: cómo se busca el contexto.
+                "direct": embedding de la pregunta original (sin LLM).
+                "hyde": embedding de una respuesta hipotética generada por el LLM.
+                "hybrid": búsqueda directa inmediata mientras HyDE corre en
+                paralelo; los resultados se fusionan por reciprocal rank.
+                "multi_query": el LLM genera variantes de la pregunta; todas
+                (más la original) se buscan en un solo lote y se fusionan.
+            hyde_skip_threshold: si la búsqueda directa ya alcanza esta
+                similitud coseno, se omite HyDE ("hyde") o no se espera ("hybrid").
+                Necesita la parte densa de la búsqueda: con un Retriever en modo
+                "lexical" (BM25 no da similitud coseno) se rechaza.
+            reranker: si se indica, se recuperan `rerank_candidates` chunks y el
+                cross-encoder elige los `k` mejores (con límite de tiempo).
+            context_budget: tokens máximos de contexto para `synthesize` (None = sin límite).
+            dedup_threshold: similitud coseno para descartar chunks casi
+                duplicados antes de armar el contexto (None = no se descartan).
+            singleflight: coalescencia compartida entre pipelines; las llamadas
+                concurrentes a `run`/`arun` con la misma pregunta normalizada
+                y `cache_scope` esperan una única ejecución.
+        """
+        if strategy not in RETRIEVAL_STRATEGIES:
+            raise ValueError(f"Estrategia de recuperación desconocida: {strategy}")
+        if hyde_skip_threshold is not None and retriever.mode == "lexical":
+            raise ValueError("hyde_skip_threshold compara la similitud coseno de la búsqueda densa; "
+                             "no aplica en modo de recuperación 'lexical'")
         self.provider = provider
         self.retriever = retriever
         self.final_k = k
+        self.cache = cache
+        self.semantic_cache = semantic_cache
+        self.strategy = strategy
+        self.hyde_skip_threshold = hyde_skip_threshold
+        self.reranker = reranker
+        self.rerank_candidates = rerank_candidates
+        self.context_budget = context_budget
+        self.dedup_threshold = dedup_threshold
+        self.singleflight = singleflight
 
-    def generate_hypothetical_answer(self, query: str) -> str:
+    @property
+    def cache_scope(self) -> tuple:
         """
-        Genera una respuesta hipotética (HyDE) para mejorar la búsqueda.
+        (proveedor, modelo, k, búsqueda): lo que distingue una respuesta de otra
+        para la misma pregunta. La búsqueda incluye la configuración del
+        Retriever (modo, filtro por documento, jerarquía), la estrategia y si hay
+        re-ranking, para que una caché compartida (p. ej. la del daemon) no
+        devuelva fuentes de otra configuración.
         """
-        messages = [
+        search = (*self.retriever.search_scope, self.strategy, self.reranker is not None)
+        return (self.provider.name, getattr(self.provider, "model", ""), self.final_k, search)
+
+    def _cache_get(self, kind: str, query: str):
+        if self.cache is None:
+            return None
+        value = self.cache.get(kind, query, *self.cache_scope)
+        record_cache(kind, value is not None)
+        return value
+
+    def _cache_set(self, kind: str, query: str, value):
+        if self.cache is not None:
+            provider, model, k, search = self.cache_scope
+            self.cache.set(kind, query, provider, model, k, value, search=search)
+
+    def cached_answer(self, query: str) -> Optional[dict]:
+        """Respuesta guardada en la caché exacta para esta pregunta (misma `cache_scope`), o None."""
+        return self._cache_get("answer", query)
+
+    def store_answer(self, query: str, result: dict):
+        """Guarda `{"answer", "sources"}` en la caché exacta, igual que `run`."""
+        self._cache_set("answer", query, result)
+
+    def _lookup_caches(self, query: str):
+        """Busca la respuesta en las cachés; devuelve (resultado o None, vector de la pregunta)."""
+        with span("cache_lookup") as attrs:
+            cached = self._cache_get("answer", query)
+            if cached is not None:
+                logger.info("Respuesta obtenida desde la caché.")
+                attrs["hit"] = "answer"
+                return cached, None
+
+            query_vec = None
+            if self.semantic_cache is not None:
+                query_vec = self.retriever.embed_query(query)
+                hit = self.semantic_cache.lookup(query_vec, self.cache_scope)
+                record_cache("semantic", hit is not None)
+                if hit is not None:
+                    result, similarity = hit
+                    logger.info(f"Respuesta obtenida desde la caché semántica (similitud {similarity:.3f}).")
+                    attrs["hit"] = "semantic"
+                    return result, query_vec
+            return None, query_vec
+
+    def _hypothetical_answer(self, query: str) -> str:
+        """HyDE con caché."""
+        hypothetical_answer = self._cache_get("hyde", query)
+        if hypothetical_answer is None:
+            hypothetical_answer = self.generate_hypothetical_answer(query)
+            self._cache_set("hyde", query, hypothetical_answer)
+        logger.info(f"Respuesta Hipotética para búsqueda: '{hypothetical_answer}'")
+        return hypothetical_answer
+
+    async def ahypothetical_answer(self, query: str) -> str:
+        """HyDE con caché (versión asíncrona de `_hypothetical_answer`; la usa también rag.batch)."""
+        # La caché puede ser SQLite: se consulta fuera del event loop compartido
+        hypothetical_answer = await asyncio.to_thread(self._cache_get, "hyde", query)
+        if hypothetical_answer is None:
+            hypothetical_answer = await self.agenerate_hypothetical_answer(query)
+            await asyncio.to_thread(self._cache_set, "hyde", query, hypothetical_answer)
+        return hypothetical_answer
+
+    def _query_variants(self, query: str) -> list[str]:
+        """Variantes de la pregunta con caché."""
+        variants = self._cache_get("multi_query", query)
+        if variants is None:
+            variants = self.generate_query_variants(query)
+            self._cache_set("multi_query", query, variants)
+        logger.info(f"Variantes de la pregunta: {variants}")
+        return variants
+
+    async def _aquery_variants(self, query: str) -> list[str]:
+        variants = await asyncio.to_thread(self._cache_get, "multi_query", query)
+        if variants is None:
+            variants = await self.agenerate_query_variants(query)
+            await asyncio.to_thread(self._cache_set, "multi_query", query, variants)
+        return variants
+
+    def _multi_query_search(self, query: str, variants: list[str], k: int) -> list:
+        """
+        Codifica la pregunta original y sus variantes en un solo lote, hace una
+        única búsqueda FAISS con la matriz de consultas y fusiona por RRF.
+        """
+        queries = [query] + [v for v in variants if v != query]
+        result_lists = self.retriever.search_batch(queries, top_k=k * 2)
+        return reciprocal_rank_fusion(result_lists, top_k=k)
+
+    def _is_confident(self, docs: list) -> bool:
+        return (self.hyde_skip_threshold is not None and bool(docs)
+                and docs[0].get("similarity", float("-inf")) >= self.hyde_skip_threshold)
+
+    def _retrieve_candidates(self, query: str, k: int) -> list:
+        """Recupera `k` chunks según la estrategia configurada."""
+        if self.strategy == "direct":
+            return self.retriever.search(query, top_k=k)
+
+        if self.strategy == "multi_query":
+            return self._multi_query_search(query, self._query_variants(query), k)
+
+        if self.strategy == "hyde":
+            if self.hyde_skip_threshold is not None:
+                direct = self.retriever.search(query, top_k=k)
+                if self._is_confident(direct):
+                    logger.info("Búsqueda directa suficientemente confiable; se omite HyDE.")
+                    return direct
+            logger.info("Generando respuesta hipotética (HyDE)...")
+            return self.retriever.search(self._hypothetical_answer(query), top_k=k)
+
+        # "hybrid": HyDE en paralelo mientras se hace la búsqueda directa
+        candidates = k * 2
+        # copy_context: las etapas de HyDE quedan en la traza de esta petición
+        hyde_future = _hyde_executor.submit(contextvars.copy_context().run, self._hypothetical_answer, query)
+        direct = self.retriever.search(query, top_k=candidates)
+        if self._is_confident(direct):
+            # La respuesta hipotética seguirá llegando a la caché de HyDE
+            logger.info("Búsqueda directa suficientemente confiable; no se espera a HyDE.")
+            return direct[:k]
+        try:
+            hypothetical_answer = hyde_future.result()
+        except Exception as e:
+            # La búsqueda directa se sostiene sola: un fallo del LLM no hace fallar la petición
+            logger.warning(f"HyDE falló ({e}); se usa solo la búsqueda directa.")
+            return direct[:k]
+        hyde_docs = self.retriever.search(hypothetical_answer, top_k=candidates)
+        return reciprocal_rank_fusion([direct, hyde_docs], top_k=k)
+
+    async def _aretrieve_candidates(self, query: str, k: int) -> list:
+        """Versión asíncrona de `_retrieve_candidates`."""
+        if self.strategy == "direct":
+            return await asyncio.to_thread(self.retriever.search, query, top_k=k)
+
+        if self.strategy == "multi_query":
+            variants = await self._aquery_variants(query)
+            return await asyncio.to_thread(self._multi_query_search, query, variants, k)
+
+        if self.strategy == "hyde":
+            if self.hyde_skip_threshold is not None:
+                direct = await asyncio.to_thread(self.retriever.search, query, top_k=k)
+                if self._is_confident(direct):
+                    return direct
+            hypothetical_answer = await self.ahypothetical_answer(query)
+            return await asyncio.to_thread(self.retriever.search, hypothetical_answer, top_k=k)
+
+        candidates = k * 2
+        hyde_task = asyncio.create_task(self.ahypothetical_answer(query))
+        try:
+            direct = await asyncio.to_thread(self.retriever.search, query, top_k=candidates)
+            if self._is_confident(direct):
+                return direct[:k]
+            try:
+                hypothetical_answer = await hyde_task
+            except Exception as e:
+                logger.warning(f"HyDE falló ({e}); se usa solo la búsqueda directa.")
+                return direct[:k]
+        finally:
+            # Si la búsqueda directa falla o ya es suficiente, HyDE no sigue corriendo
+            hyde_task.cancel()
+        hyde_docs = await asyncio.to_thread(self.retriever.search, hypothetical_answer, top_k=candidates)
+        return reciprocal_rank_fusion([direct, hyde_docs], top_k=k)
+
+    @property
+    def candidate_k(self) -> int:
+        """Cuántos chunks se recuperan antes del re-ranking (o `final_k` si no hay)."""
+        if self.reranker is None:
+            return self.final_k
+        return max(self.final_k, self.rerank_candidates)
+
+    def retrieve(self, query: str) -> list:
+        """Recupera los `final_k` chunks; con re-ranker, re-ordena un conjunto más amplio."""
+        with span("retrieve", strategy=self.strategy):
+            docs = self._retrieve_candidates(query, self.candidate_k)
+        if self.reranker is None:
+            return docs
+        with span("rerank"):
+            return self.reranker.rerank(query, docs, self.final_k)
+
+    async def aretrieve(self, query: str) -> list:
+        """Versión asíncrona de `retrieve`."""
+        with span("retrieve", strategy=self.strategy):
+            docs = await self._aretrieve_candidates(query, self.candidate_k)
+        if self.reranker is None:
+            return docs
+        with span("rerank"):
+            return await self.reranker.arerank(query, docs, self.final_k)
+
+    def _store_result(self, query: str, result: dict, query_vec, start: float):
+        self.store_answer(query, result)
+        if query_vec is not None:
+            self.semantic_cache.add(query_vec, self.cache_scope, result, time.perf_counter() - start)
+
+    def _hyde_messages(self, query: str) -> list[dict]:
+        return [
+            {"role": "system", "content": prompts.HYDE_SYSTEM},
+            {"role": "user", "content": query},
+        ]
+
+    def _multi_query_messages(self, query: str) -> list[dict]:
+        return [
             {"role": "system", "content": prompts.MULTI_QUERY_SYSTEM},
             {"role": "user", "content": query},
         ]
-        response = self.provider.chat(messages)
-        return response.strip()
 
-    def synthesize(self, query: str, docs: list) -> str:
+    def build_context(self, docs: list) -> list:
+        """
+        Une los solapes entre chunks contiguos, quita casi duplicados y ajusta
+        el contexto al presupuesto de tokens; las citas (doc_id-page) se conservan.
+        """
+        with span("context") as attrs:
+            attrs["chunks_in"] = len(docs)
+            if self.dedup_threshold is None or len(docs) < 2:
+                return pack_context(docs, self.context_budget)
+            return pack_context(docs, self.context_budget, self.retriever.doc_vectors(docs), self.dedup_threshold)
+
+    def _synthesize_messages(self, query: str, docs: list) -> list[dict]:
         system_prompt = prompts.SYNTHESIZE_SYSTEM
-        context_parts = []
-        for d in docs:
-            citation = f"{d['doc_id']}-{d.get('page', 'N/A')}"
-            context_parts.append(f"[{citation}] {d['text']}")
-        context = "\n\n".join(context_parts)
-        messages = [
+        context = "\n\n".join(format_context_part(d) for d in docs)
+        return [
             {"role": "system", "content": system_prompt},
             {"role": "user", "content": f"Pregunta: {query}\n\nContexto:\n{context}"},
         ]
-        return self.provider.chat(messages)
+
+    def generate_hypothetical_answer(self, query: str) -> str:
+        """
+        Genera una respuesta hipotética (HyDE) para mejorar la búsqueda.
+        """
+        with span("hyde"):
+            response = self.provider.chat(self._hyde_messages(query))
+        return response.strip()
+
+    async def agenerate_hypothetical_answer(self, query: str) -> str:
+        with span("hyde"):
+            response = await self.provider.achat(self._hyde_messages(query))
+        return response.strip()
+
+    def generate_query_variants(self, query: str) -> list[str]:
+        """
+        Pide al LLM versiones alternativas de la pregunta (MULTI_QUERY_SYSTEM).
+        """
+        with span("multi_query"):
+            return parse_query_list(self.provider.chat(self._multi_query_messages(query)))
+
+    async def agenerate_query_variants(self, query: str) -> list[str]:
+        with span("multi_query"):
+            return parse_query_list(await self.provider.achat(self._multi_query_messages(query)))
+
+    def synthesize(self, query: str, docs: list) -> str:
+        with span("synthesize"):
+            return self.provider.chat(self._synthesize_messages(query, docs))
+
+    async def asynthesize(self, query: str, docs: list) -> str:
+        with span("synthesize"):
+            return await self.provider.achat(self._synthesize_messages(query, docs))
+
+    def synthesize_stream(self, query: str, docs: list) -> Iterator[str]:
+        fragments = self.provider.chat(self._synthesize_messages(query, docs), stream=True)
+        if isinstance(fragments, str):  # proveedor sin soporte de streaming
+            fragments = [fragments]
+        return iter(fragments)
 
     def postprocess(self, answer: str) -> str:
         answer = re.sub(r'\[([\w-]+)\](\s*\[\1\])+', r'[\1]', answer)
         return answer.strip()
 
+    def flight_key(self, query: str) -> str:
+        """Clave de coalescencia: pregunta normalizada y `cache_scope`."""
+        return make_key("run", query, *self.cache_scope)
+
     def run(self, query: str) -> dict:
         """
-        Ejecuta el pipeline completo, usando HyDE pero sin re-ranking.
+        Ejecuta el pipeline completo (recuperación según `strategy` y re-ranking opcional).
+        Con `singleflight`, preguntas idénticas simultáneas comparten una sola ejecución.
         """
+        if self.singleflight is None:
+            return self._run(query)
+        return self.singleflight.do(self.flight_key(query), lambda: self._run(query))
+
+    def _run(self, query: str) -> dict:
+        with span("pipeline", strategy=self.strategy):
+            return self._run_stages(query)
+
+    def _run_stages(self, query: str) -> dict:
         try:
-            # --- FASE 1: GENERAR RESPUESTA HIPOTÉTICA (HyDE) ---
-            logger.info("Fase 1: Generando respuesta hipotética (HyDE)...")
-            hypothetical_answer = self.generate_hypothetical_answer(query)
-            logger.info(f"Respuesta Hipotética para búsqueda: '{hypothetical_answer}'")
+            start = time.perf_counter()
+            cached, query_vec = self._lookup_caches(query)
+            if cached is not None:
+                return cached
 
-            # --- FASE 2: RETRIEVE DIRECTO (SIN RE-RANK) ---
-            logger.info(f"Fase 2: Recuperando los {self.final_k} documentos más relevantes...")
-            docs = self.retriever.search(hypothetical_answer, top_k=self.final_k)
+            # --- FASE 1 Y 2: RETRIEVE SEGÚN ESTRATEGIA (+ RE-RANK OPCIONAL) ---
+            logger.info(f"Fase 1-2: Recuperando los {self.final_k} documentos más relevantes "
+                        f"(estrategia '{self.strategy}')...")
+            docs = self.build_context(self.retrieve(query))
             logger.info(f"Se recuperaron {len(docs)} documentos.")
 
             if not docs:
@@ -63,13 +441,116 @@ class RAGPipeline:
             raw_answer = self.synthesize(query, docs)
 
             logger.info("Fase 4: Post-procesando la respuesta...")
-            final_answer = self.postprocess(raw_answer)
+            with span("postprocess"):
+                final_answer = self.postprocess(raw_answer)
 
             logger.info("Pipeline completado con éxito.")
-            return {
+            result = {
+                "answer": final_answer,
+                "sources": docs
+            }
+            self._store_result(query, result, query_vec, start)
+            return result
+        except Exception as e:
+            logger.error(f"El pipeline ha fallado: {e}", exc_info=True)
+            raise
+
+    async def arun(self, query: str) -> dict:
+        """
+        Versión asíncrona de `run`: las llamadas al LLM usan `Provider.achat` y
+        el trabajo de CPU (embeddings, FAISS) corre en un hilo para no bloquear
+        el event loop.
+        """
+        if self.singleflight is None:
+            return await self._arun(query)
+        return await self.singleflight.ado(self.flight_key(query), lambda: self._arun(query))
+
+    async def _arun(self, query: str) -> dict:
+        with span("pipeline", strategy=self.strategy):
+            return await self._arun_stages(query)
+
+    async def _arun_stages(self, query: str) -> dict:
+        try:
+            start = time.perf_counter()
+            cached, query_vec = await asyncio.to_thread(self._lookup_caches, query)
+            if cached is not None:
+                return cached
+
+            logger.info(f"Fase 1-2: Recuperando los {self.final_k} documentos más relevantes "
+                        f"(estrategia '{self.strategy}')...")
+            docs = await asyncio.to_thread(self.build_context, await self.aretrieve(query))
+
+            if not docs:
+                return {"answer": "No se encontró información para esta pregunta.", "sources": []}
+
+            logger.info("Fase 3: Sintetizando la respuesta...")
+            raw_answer = await self.asynthesize(query, docs)
+            with span("postprocess"):
+                final_answer = self.postprocess(raw_answer)
+
+            result = {
+                "answer": final_answer,
+                "sources": docs
+            }
+            await asyncio.to_thread(self._store_result, query, result, query_vec, start)
+            return result
+        except Exception as e:
+            logger.error(f"El pipeline ha fallado: {e}", exc_info=True)
+            raise
+
+
+    def run_stream(self, query: str) -> Iterator[dict]:
+        """
+        Variante generadora de `run`: emite primero las fuentes y luego la
+        respuesta por fragmentos, a medida que el LLM la genera.
+
+        Eventos: {"event": "sources", "data": docs}, {"event": "token", "data": str}
+        y al final {"event": "done", "data": {"answer": ..., "sources": ...}}.
+        """
+        try:
+            start = time.perf_counter()
+            cached, query_vec = self._lookup_caches(query)
+            if cached is not None:
+                yield {"event": "sources", "data": cached["sources"]}
+                yield {"event": "token", "data": cached["answer"]}
+                yield {"event": "done", "data": cached}
+                return
+
+            logger.info(f"Fase 1-2: Recuperando los {self.final_k} documentos más relevantes "
+                        f"(estrategia '{self.strategy}')...")
+            docs = self.build_context(self.retrieve(query))
+            yield {"event": "sources", "data": docs}
+
+            if not docs:
+                result = {"answer": "No se encontró información para esta pregunta.", "sources": []}
+                yield {"event": "token", "data": result["answer"]}
+                yield {"event": "done", "data": result}
+                return
+
+            logger.info("Fase 3: Sintetizando la respuesta (streaming)...")
+            stream_filter = CitationStreamFilter(self.postprocess)
+            first_token_at = None
+            for fragment in self.synthesize_stream(query, docs):
+                text = stream_filter.feed(fragment)
+                if text:
+                    if first_token_at is None:
+                        first_token_at = time.perf_counter()
+                        observe(STAGE_METRIC, first_token_at - start, stage="first_token")
+                        logger.info(f"Primer token tras {first_token_at - start:.2f}s")
+                    yield {"event": "token", "data": text}
+
+            pending, final_answer = stream_filter.finish()
+            if pending:
+                yield {"event": "token", "data": pending}
+
+            result = {
                 "answer": final_answer,
                 "sources": docs
             }
+            self._store_result(query, result, query_vec, start)
+            observe(STAGE_METRIC, time.perf_counter() - start, stage="pipeline_stream")
+            logger.info(f"Pipeline (streaming) completado en {time.perf_counter() - start:.2f}s.")
+            yield {"event": "done", "data": result}
         except Exception as e:
             logger.error(f"El pipeline ha fallado: {e}", exc_info=True)
             raise
@@ -10,6 +10,13 @@ REGLAS DE ORO:
 3.  **SÉ FIEL AL CONTEXTO:** No añadas información que no esté en los fragmentos proporcionados. Si la respuesta no se puede construir a partir del contexto, responde exactamente: "No he encontrado información sobre este tema en los documentos disponibles."
 """
 
+HYDE_SYSTEM = """
+Eres un asistente experto en la normativa de la Universidad de La Frontera (UFRO).
+Escribe un párrafo breve que responda la pregunta del usuario como lo haría un reglamento universitario o el calendario académico.
+No importa si no conoces los datos exactos: el texto se usará solo para buscar fragmentos parecidos en los documentos.
+No añadas texto introductorio, solo el párrafo.
+"""
+
 MULTI_QUERY_SYSTEM = """
 Eres un asistente de IA que ayuda a un sistema de recuperación de información.
 Tu tarea es tomar una pregunta de un usuario y generar 3 versiones alternativas de esa misma pregunta para mejorar la búsqueda en una base de datos de documentos.
@@ -0,0 +1,115 @@
+import time
+import asyncio
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+
+logger = logging.getLogger(__name__)
+
+# Cross-encoder multilingüe pequeño (entrenado en mMARCO, incluye español)
+RERANK_MODEL_NAME = "cross-encoder/mmarco-mMiniLMv2-L12-H384-v1"
+# Candidatos que se piden a FAISS antes de re-ordenar
+RERANK_CANDIDATES = 20
+# Presupuesto por consulta; si se excede se conserva el orden de FAISS
+RERANK_BUDGET_S = 0.5
+# Tokens por par (pregunta, chunk); acota el costo del forward pass
+RERANK_MAX_LENGTH = 256
+
+
+class Reranker:
+    """
+    Re-ordena candidatos con un cross-encoder en CPU.
+
+    Todos los pares (pregunta, chunk) se puntúan en un único lote. La
+    inferencia corre en un hilo aparte con un límite de tiempo: si no termina
+    dentro de `budget_s`, se devuelven los candidatos en el orden original.
+    Una inferencia ya iniciada no se puede interrumpir, así que no se encolan
+    trabajos: si todos los hilos están ocupados se omite el re-ranking de
+    inmediato, y una tarea que empieza después de su plazo no se ejecuta.
+    """
+
+    def __init__(self, model_name: str = RERANK_MODEL_NAME, budget_s: float = RERANK_BUDGET_S,
+                 max_length: int = RERANK_MAX_LENGTH, max_workers: int = 2):
+        self.model_name = model_name
+        self.budget_s = budget_s
+        from sentence_transformers import CrossEncoder
+        self.model = CrossEncoder(model_name, max_length=max_length, device="cpu")
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="rerank")
+        self._slots = threading.BoundedSemaphore(max_workers)
+        self.reranked = 0
+        self.timeouts = 0
+        self.skipped = 0
+
+    def score(self, query: str, docs: list) -> list[float]:
+        """Puntajes del cross-encoder para cada chunk, en un solo forward pass."""
+        pairs = [(query, d.get("text", "")) for d in docs]
+        scores = self.model.predict(pairs, batch_size=len(pairs), show_progress_bar=False)
+        return [float(s) for s in scores]
+
+    def _score_until(self, deadline: float, query: str, docs: list):
+        """`score`, salvo que el plazo ya haya vencido (nadie espera el resultado): None."""
+        if time.monotonic() >= deadline:
+            return None
+        return self.score(query, docs)
+
+    def _submit(self, query: str, docs: list):
+        """Lanza la inferencia si hay un hilo libre; None si están todos ocupados."""
+        if not self._slots.acquire(blocking=False):
+            return None
+        try:
+            future = self._executor.submit(self._score_until, time.monotonic() + self.budget_s, query, docs)
+        except BaseException:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        return future
+
+    def _busy(self, docs: list, top_k: int) -> list:
+        self.skipped += 1
+        logger.warning("Re-ranker ocupado; se usa el orden de FAISS.")
+        return docs[:top_k]
+
+    def _apply(self, docs: list, scores: list[float], top_k: int) -> list:
+        self.reranked += 1
+        order = sorted(range(len(docs)), key=lambda i: scores[i], reverse=True)[:top_k]
+        return [{**docs[i], "rerank_score": scores[i]} for i in order]
+
+    def _fallback(self, docs: list, top_k: int) -> list:
+        self.timeouts += 1
+        logger.warning(f"Re-ranking excedió {self.budget_s * 1000:.0f} ms; se usa el orden de FAISS.")
+        return docs[:top_k]
+
+    def rerank(self, query: str, docs: list, top_k: int) -> list:
+        """Devuelve los `top_k` mejores candidatos según el cross-encoder."""
+        if len(docs) <= 1:
+            return docs[:top_k]
+        future = self._submit(query, docs)
+        if future is None:
+            return self._busy(docs, top_k)
+        try:
+            scores = future.result(timeout=self.budget_s)
+        except FutureTimeoutError:
+            return self._fallback(docs, top_k)
+        if scores is None:
+            return self._fallback(docs, top_k)
+        return self._apply(docs, scores, top_k)
+
+    async def arerank(self, query: str, docs: list, top_k: int) -> list:
+        """Versión asíncrona de `rerank`; no bloquea el event loop mientras espera."""
+        if len(docs) <= 1:
+            return docs[:top_k]
+        future = self._submit(query, docs)
+        if future is None:
+            return self._busy(docs, top_k)
+        try:
+            # shield: el timeout no cancela el future (ya corre en su hilo)
+            scores = await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(future)), timeout=self.budget_s)
+        except asyncio.TimeoutError:
+            return self._fallback(docs, top_k)
+        if scores is None:
+            return self._fallback(docs, top_k)
+        return self._apply(docs, scores, top_k)
+
+    def stats(self) -> dict:
+        return {"model": self.model_name, "budget_s": self.budget_s,
+                "reranked": self.reranked, "timeouts": self.timeouts, "skipped": self.skipped}
@@ -1,45 +1,346 @@
+import os
+import logging
+from typing import Optional, TYPE_CHECKING
 import faiss
 import numpy as np
-import pandas as pd
-from sentence_transformers import SentenceTransformer
+
+from .index_factory import load_meta, apply_search_params, prepare_vectors
+from .encoders import index_encoder, load_encoder
+from .chunk_store import open_chunk_store
+from .lexical import LexicalIndex
+from .fusion import reciprocal_rank_fusion, RETRIEVAL_MODES
+from .hierarchy import TOP_GROUPS, load_hierarchy, matches_filter, top_k_subset
+from .metrics import span
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+# Con filtro por documento y sin índice de grupos, BM25 y FAISS traen más
+# candidatos para que queden `top_k` tras filtrar
+FILTER_FACTOR = 4
+
+
+def read_index_mmap(index_path: str) -> faiss.Index:
+    """
+    Abre el índice con IO_FLAG_MMAP para que los vectores se lean bajo demanda
+    y se compartan entre procesos; si el tipo no lo admite, lo carga completo.
+    """
+    try:
+        return faiss.read_index(index_path, faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY)
+    except (RuntimeError, AttributeError):
+        return faiss.read_index(index_path)
 
 class Retriever:
     def __init__(self,
                  index_path="data/index.faiss",
                  chunks_path="data/processed/chunks.parquet",
-                 model_name="all-MiniLM-L6-v2"):
-        # Modelo de embeddings
-        self.model = SentenceTransformer(model_name)
+                 model_name="all-MiniLM-L6-v2",
+                 mode="dense",
+                 hierarchical=False,
+                 top_groups=TOP_GROUPS,
+                 doc_filter=None):
+        if mode not in RETRIEVAL_MODES:
+            raise ValueError(f"Modo de recuperación desconocido: {mode}")
+        self.index_path = index_path
+        self.chunks_path = chunks_path
+
+        # Cargar índice FAISS (mapeado en memoria) y sus metadatos (tipo, métrica, nprobe/efSearch)
+        self.meta = load_meta(index_path)
+        self.index = read_index_mmap(index_path)
+        self.index_type = self.meta["index_type"]
+        apply_search_params(self.index, self.meta)
+
+        # Modelo de embeddings con el mismo backend con que se construyó el índice
+        # (torch u ONNX; `model_name` solo aplica a índices sin ese registro)
+        self.model_name, self.encoder_backend = index_encoder(self.meta, model_name)
+        self.model = load_encoder(self.model_name, self.encoder_backend)
 
-        # Cargar índice FAISS
-        self.index = faiss.read_index(index_path)
+        # Chunks en un store Arrow mapeado en memoria: compartido entre procesos,
+        # el texto solo se lee para los resultados.
+        self.store = open_chunk_store(chunks_path)
+        self._df = None
+        self._sorted_ids = None
+        self._xb = None
 
-        # Cargar DataFrame con metadatos
-        self.df = pd.read_parquet(chunks_path)
+        # Búsqueda jerárquica (página/documento → chunk) y filtro por documento,
+        # con el índice de grupos que genera rag.embed
+        self.hierarchy = load_hierarchy(index_path, self.index.ntotal)
+        if self.hierarchy is None and (hierarchical or doc_filter):
+            logger.warning("No hay índice de grupos al día; se usará la búsqueda plana "
+                           "(el filtro por documento se aplica a sus resultados).")
+        self.hierarchical = hierarchical and self.hierarchy is not None
+        self.top_groups = top_groups
+        self.doc_filter = doc_filter
+        # En IVF/IVFPQ la etapa fina sondea solo las listas de sus candidatos
+        self._ivf_lists = self._load_ivf_lists() if self.hierarchy is not None else None
+
+        # Índice léxico BM25 (generado por rag.ingest junto a chunks.parquet)
+        self.lexical = None
+        lexical_path = os.path.join(os.path.dirname(chunks_path), "lexical.npz")
+        if os.path.exists(lexical_path):
+            self.lexical = LexicalIndex.load(lexical_path)
+        elif mode != "dense":
+            logger.warning(f"No se encontró {lexical_path}; se usará solo búsqueda densa.")
+            mode = "dense"
+        self.mode = mode
+
+    @property
+    def df(self) -> "pd.DataFrame":
+        """DataFrame completo de chunks; se materializa solo si alguien lo pide."""
+        if self._df is None:
+            self._df = self.store.to_pandas()
+        return self._df
+
+    def to_similarity(self, score: float) -> float:
+        """
+        Convierte el puntaje de FAISS a similitud coseno. Con producto interno
+        sobre vectores normalizados el puntaje ya es el coseno; en índices L2
+        antiguos MiniLM entrega vectores normalizados, así que cos = 1 - d/2.
+        """
+        if self.index.metric_type == faiss.METRIC_INNER_PRODUCT:
+            return score
+        return 1.0 - score / 2.0
 
     # ESTE ES EL MÉTODO QUE PROBABLEMENTE FALTA EN TU CÓDIGO
     def embed_query(self, query: str):
         """Genera el embedding (vector) de la consulta del usuario."""
-        return self.model.encode([query]).astype("float32")
-
-    def search(self, query: str, top_k: int = 3):
-        """Busca los chunks más relevantes en el índice FAISS."""
-        # 1. Convierte la pregunta de texto a un vector numérico
-        query_vec = self.embed_query(query)
-        
-        # 2. Usa el vector para buscar en el índice FAISS
-        distances, indices = self.index.search(query_vec, top_k)
-
-        results = []
-        for i, idx in enumerate(indices[0]):
-            if idx == -1:  # FAISS devuelve -1 si no encuentra suficientes resultados
-                continue
-
-            row = self.df.iloc[idx]
-            results.append({
+        with span("embed", backend=self.encoder_backend):
+            return self.model.encode([query]).astype("float32")
+
+    def embed_queries(self, queries: list[str]) -> np.ndarray:
+        """Codifica varias consultas en una sola llamada al modelo."""
+        with span("embed", backend=self.encoder_backend) as attrs:
+            attrs["queries"] = len(queries)
+            return np.asarray(self.model.encode(queries), dtype="float32")
+
+    def _index_positions(self, ids: np.ndarray) -> tuple:
+        """(índice base, posiciones de esos ids dentro de él); posiciones None si falta algún id."""
+        if not hasattr(self.index, "id_map"):
+            # Índice antiguo sin IndexIDMap: el id es la posición
+            return self.index, ids
+        if self._sorted_ids is None:
+            id_map = faiss.vector_to_array(self.index.id_map)
+            order = np.argsort(id_map)
+            self._sorted_ids = (id_map[order], order)
+        sorted_ids, order = self._sorted_ids
+        base = faiss.downcast_index(self.index.index)
+        if len(sorted_ids) == 0:
+            return base, None
+        pos = np.minimum(np.searchsorted(sorted_ids, ids), len(sorted_ids) - 1)
+        if not np.array_equal(sorted_ids[pos], ids):
+            return base, None
+        return base, order[pos]
+
+    def _reconstruct(self, vector_ids) -> Optional[np.ndarray]:
+        """
+        Recupera los vectores guardados en FAISS para esos ids; None si el tipo
+        de índice no los guarda sin pérdida (IVF/PQ) o falta algún id.
+        """
+        if self.index_type not in ("flat", "flat_l2", "hnsw") or any(i is None for i in vector_ids):
+            return None
+        base, positions = self._index_positions(np.asarray(vector_ids, dtype=np.int64))
+        if positions is None:
+            return None
+        try:
+            return np.vstack([base.reconstruct(int(p)) for p in positions])
+        except RuntimeError:
+            return None
+
+    def _stored_vectors(self, ids: np.ndarray) -> Optional[np.ndarray]:
+        """
+        Vectores de esos ids leídos directo del almacenamiento plano del índice
+        (flat y HNSW, sin copiar el resto); None en IVF/PQ.
+        """
+        if self.index_type not in ("flat", "flat_l2", "hnsw"):
+            return None
+        base, positions = self._index_positions(ids)
+        if positions is None:
+            return None
+        if self._xb is None:
+            flat = faiss.downcast_index(base.storage) if self.index_type == "hnsw" else base
+            self._xb = faiss.rev_swig_ptr(flat.get_xb(), flat.ntotal * flat.d).reshape(flat.ntotal, flat.d)
+        return self._xb[positions]
+
+    def _load_ivf_lists(self) -> Optional[tuple]:
+        """
+        (lista invertida de cada vector según su posición en el índice IVF,
+        centroides), o None si el índice no es IVF. Se lee una vez al cargar.
+        """
+        if self.index_type not in ("ivf", "ivfpq"):
+            return None
+        ivf = faiss.extract_index_ivf(self.index)
+        invlists = ivf.invlists
+        list_of = np.full(ivf.ntotal, -1, dtype=np.int64)
+        for list_no in range(ivf.nlist):
+            size = invlists.list_size(list_no)
+            if size:
+                ids_ptr = invlists.get_ids(list_no)
+                list_of[faiss.rev_swig_ptr(ids_ptr, size)] = list_no
+                invlists.release_ids(list_no, ids_ptr)
+        return list_of, ivf.quantizer.reconstruct_n(0, ivf.nlist)
+
+    def _search_ivf_lists(self, query: np.ndarray, ids: np.ndarray, top_k: int) -> Optional[tuple]:
+        """
+        Etapa fina en IVF/IVFPQ: sondea solo las listas invertidas que contienen
+        a los candidatos (no todas) y filtra dentro de ellas con un IDSelector.
+        """
+        if len(ids) == 0:
+            return np.empty(0, dtype=np.float32), np.empty(0, dtype=np.int64)
+        _, positions = self._index_positions(ids)
+        if positions is None or self._ivf_lists is None:
+            return None
+        list_of, centroids = self._ivf_lists
+        positions = np.ascontiguousarray(positions, dtype=np.int64)
+        lists = np.unique(list_of[positions])
+        if self.index.metric_type == faiss.METRIC_INNER_PRODUCT:
+            coarse = centroids[lists] @ query
+        else:
+            coarse = ((centroids[lists] - query) ** 2).sum(axis=1)
+        ivf = faiss.extract_index_ivf(self.index)
+        selector = faiss.IDSelectorBatch(len(positions), faiss.swig_ptr(positions))
+        params = faiss.SearchParametersIVF(sel=selector, nprobe=len(lists))
+        query = np.ascontiguousarray(query, dtype=np.float32)
+        coarse = np.ascontiguousarray(coarse, dtype=np.float32)
+        distances = np.empty(top_k, dtype=np.float32)
+        found = np.empty(top_k, dtype=np.int64)
+        # El envoltorio de Python de search_preassigned no acepta `params`; se llama al de C++
+        ivf.search_preassigned_c(1, faiss.swig_ptr(query), top_k, faiss.swig_ptr(lists), faiss.swig_ptr(coarse),
+                                 faiss.swig_ptr(distances), faiss.swig_ptr(found), False, params)
+        # Posiciones del índice base → ids de los chunks
+        order = np.argsort(positions)
+        valid = found != -1
+        labels = np.full(top_k, -1, dtype=np.int64)
+        labels[valid] = ids[order[np.searchsorted(positions[order], found[valid])]]
+        return distances, labels
+
+    def _search_subset(self, query: np.ndarray, ids: np.ndarray, top_k: int) -> tuple:
+        """Etapa fina: los `top_k` mejores entre los chunks `ids` (puntajes, ids)."""
+        vectors = self._stored_vectors(ids)
+        if vectors is not None:
+            metric = "ip" if self.index.metric_type == faiss.METRIC_INNER_PRODUCT else "l2"
+            return top_k_subset(vectors, ids, query, top_k, metric)
+        found = self._search_ivf_lists(query, ids, top_k)
+        if found is not None:
+            return found
+        # Algún id no está en el índice: FAISS filtra con un IDSelector recorriendo todas las listas
+        selector = faiss.IDSelectorBatch(len(ids), faiss.swig_ptr(ids))
+        params = faiss.SearchParametersIVF(sel=selector, nprobe=faiss.extract_index_ivf(self.index).nlist)
+        distances, found = self.index.search(query.reshape(1, -1), top_k, params=params)
+        return distances[0], found[0]
+
+    def _search_groups(self, query_vecs: np.ndarray, top_k: int, doc_filter=None) -> list[list[dict]]:
+        """Búsqueda en dos etapas: grupos más parecidos (o los que pasan el filtro) → chunks."""
+        top_groups = self.top_groups if self.hierarchical else len(self.hierarchy)
+        with span("groups", level=self.hierarchy.level) as attrs:
+            candidates = self.hierarchy.candidates(query_vecs, top_groups, doc_filter)
+            attrs["candidates"] = int(sum(len(c) for c in candidates))
+        prepared = prepare_vectors(query_vecs, self.meta)
+        with span("faiss", index=self.index_type):
+            found = [self._search_subset(q, ids, top_k) for q, ids in zip(prepared, candidates)]
+        with span("chunks"):
+            return [self._build_results(np.asarray(scores), self.store.positions(np.asarray(ids)))
+                    for scores, ids in found]
+
+    def doc_vectors(self, docs: list[dict]) -> np.ndarray:
+        """
+        Embeddings normalizados de resultados ya recuperados: se leen del índice
+        cuando es posible y solo se codifican de nuevo si no.
+        """
+        vectors = self._reconstruct([d.get("vector_id") for d in docs])
+        if vectors is None:
+            vectors = self.embed_queries([d.get("text", "") for d in docs])
+        return prepare_vectors(vectors, {"normalize": True})
+
+    def _build_results(self, distances_row, positions_row) -> list[dict]:
+        hits = [(score, pos) for score, pos in zip(distances_row.tolist(), positions_row.tolist())
+                if pos != -1]  # FAISS devuelve -1 si no encuentra suficientes resultados
+        rows = self.store.take([pos for _, pos in hits])
+        return [
+            {
+                "doc_id": row.get("doc_id", "unknown"),
+                "page": row.get("page", "N/A"),
+                "chunk_id": row.get("chunk_id"),
+                "vector_id": row.get("vector_id"),
+                "text": row.get("text", ""),
+                "score": score,
+                "similarity": self.to_similarity(score),
+            }
+            for (score, _), row in zip(hits, rows)
+        ]
+
+    @property
+    def search_scope(self) -> tuple:
+        """Opciones de búsqueda que cambian los resultados (forman parte de las claves de caché)."""
+        doc_filter = tuple(sorted({f.lower() for f in self.doc_filter or ()}))
+        return (self.mode, doc_filter, self.hierarchical, self.top_groups if self.hierarchical else None)
+
+    def search_by_vectors(self, query_vecs: np.ndarray, top_k: int = 3, doc_filter=None) -> list[list[dict]]:
+        """Una sola búsqueda FAISS para una matriz de consultas; una lista de resultados por fila."""
+        doc_filter = doc_filter or self.doc_filter
+        if self.hierarchy is not None and (self.hierarchical or doc_filter):
+            return self._search_groups(query_vecs, top_k, doc_filter)
+        with span("faiss", index=self.index_type):
+            distances, indices = self.index.search(prepare_vectors(query_vecs, self.meta),
+                                                   top_k * FILTER_FACTOR if doc_filter else top_k)
+        with span("chunks"):
+            positions = self.store.positions(indices)
+            results = [self._build_results(distances[r], positions[r]) for r in range(len(positions))]
+        if doc_filter:
+            # Sin índice de grupos el filtro se aplica después, igual que en BM25
+            results = [[r for r in rows if matches_filter(r["doc_id"], doc_filter)][:top_k] for rows in results]
+        return results
+
+    def search_lexical(self, query: str, top_k: int = 3, doc_filter=None) -> list[dict]:
+        """Búsqueda BM25 sobre el índice invertido."""
+        doc_filter = doc_filter or self.doc_filter
+        with span("bm25"):
+            ids, scores = self.lexical.search(query, top_k * FILTER_FACTOR if doc_filter else top_k)
+        positions = self.store.positions(ids)
+        hits = [(score, pos) for score, pos in zip(scores.tolist(), positions.tolist()) if pos != -1]
+        rows = self.store.take([pos for _, pos in hits])
+        results = [
+            {
                 "doc_id": row.get("doc_id", "unknown"),
                 "page": row.get("page", "N/A"),
-                "text": row.get("text", ""), 
-                "score": float(distances[0][i])
-            })
-        return results
\ No newline at end of file
+                "chunk_id": row.get("chunk_id"),
+                "vector_id": row.get("vector_id"),
+                "text": row.get("text", ""),
+                "bm25": score,
+            }
+            for (score, _), row in zip(hits, rows)
+        ]
+        if doc_filter:
+            results = [r for r in results if matches_filter(r["doc_id"], doc_filter)][:top_k]
+        return results
+
+    def search_batch(self, queries: list[str], top_k: int = 3, mode: str = None,
+                     doc_filter=None) -> list[list[dict]]:
+        """
+        Busca varias consultas a la vez: las codifica juntas y hace una sola
+        búsqueda FAISS. Devuelve una lista de resultados por consulta.
+        En modo "hybrid" amplía candidatos densos y BM25 y los fusiona por RRF.
+        `doc_filter` (fragmentos de doc_id) restringe los documentos; por
+        defecto se usa el del Retriever.
+        """
+        if not queries:
+            return []
+        mode = mode or self.mode
+        if mode != "dense" and self.lexical is None:
+            mode = "dense"
+        if mode == "lexical":
+            return [self.search_lexical(q, top_k, doc_filter) for q in queries]
+        if mode == "dense":
+            return self.search_by_vectors(self.embed_queries(queries), top_k, doc_filter)
+
+        candidates = top_k * 2
+        dense_lists = self.search_by_vectors(self.embed_queries(queries), candidates, doc_filter)
+        return [
+            reciprocal_rank_fusion([dense, self.search_lexical(q, candidates, doc_filter)], top_k=top_k)
+            for q, dense in zip(queries, dense_lists)
+        ]
+
+    def search(self, query: str, top_k: int = 3, mode: str = None, doc_filter=None):
+        """Busca los chunks más relevantes en el índice FAISS (y/o BM25 según `mode`)."""
+        return self.search_batch([query], top_k, mode, doc_filter)[0]
@@ -0,0 +1,97 @@
+import asyncio
+import logging
+import threading
+import weakref
+from typing import Awaitable, Callable
+
+logger = logging.getLogger(__name__)
+
+
+class _Call:
+    """Ejecución en curso (versión con hilos) que esperan los seguidores."""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+
+class SingleFlight:
+    """
+    Coalescencia de peticiones idénticas en curso ("single-flight").
+
+    La primera petición con una clave ejecuta la función; las que llegan con la
+    misma clave mientras tanto esperan y reciben el mismo resultado (o la misma
+    excepción). Al terminar la clave se libera: no es una caché.
+
+    `do` sirve para hilos (Flask/gunicorn gthread) y `ado` para corrutinas; en
+    modo asíncrono las ejecuciones se comparten dentro de un mismo event loop.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self._tasks = weakref.WeakKeyDictionary()
+        self.executions = 0
+        self.coalesced = 0
+
+    def do(self, key: str, fn: Callable[[], object]):
+        with self._lock:
+            call = self._calls.get(key)
+            if call is not None:
+                call.waiters += 1
+                self.coalesced += 1
+                leader = False
+            else:
+                call = self._calls[key] = _Call()
+                self.executions += 1
+                leader = True
+
+        if not leader:
+            logger.info("Pregunta idéntica en curso; se espera su resultado.")
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn()
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+    async def ado(self, key: str, fn: Callable[[], Awaitable]):
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            tasks = self._tasks.setdefault(loop, {})
+            task = tasks.get(key)
+            if task is not None:
+                self.coalesced += 1
+            else:
+                task = tasks[key] = loop.create_task(fn())
+                self.executions += 1
+                task.add_done_callback(lambda _t: self._forget(loop, key, _t))
+        # shield: si una de las peticiones se cancela (timeout), las demás siguen esperando
+        return await asyncio.shield(task)
+
+    def _forget(self, loop, key: str, task: asyncio.Task):
+        with self._lock:
+            tasks = self._tasks.get(loop, {})
+            if tasks.get(key) is task:
+                del tasks[key]
+        if not task.cancelled():
+            task.exception()  # evita "Task exception was never retrieved" si nadie esperaba
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "executions": self.executions,
+                "coalesced": self.coalesced,
+                "in_flight": len(self._calls) + sum(len(t) for t in self._tasks.values()),
+            }
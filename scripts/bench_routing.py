@@ -0,0 +1,167 @@
+"""
+Mide RoutedProvider contra dos servidores OpenAI falsos (scripts/fake_openai_server.py)
+y verifica el hedging y el circuit breaker. Termina con código 1 si algún chequeo falla.
+
+Uso:
+    python scripts/bench_routing.py
+    python scripts/bench_routing.py --requests 500 --slow-rate 0.05 --slow-delay 2
+
+1. Latencia: el primario tiene una cola lenta (`--slow-rate` de las respuestas
+   tarda `--slow-delay` s); se compara el p99 de ChatGPT solo con el del router.
+2. Circuito: el primario responde siempre 500 (`--error-rate`); tras
+   `FAILURE_THRESHOLD` fallos el circuito se abre y las peticiones siguen
+   saliendo por el secundario. Luego el primario se recupera y, pasado
+   `--reset-timeout`, una petición de prueba vuelve a cerrar el circuito.
+3. Prueba medio abierta: si ambos backends están abiertos y el primario
+   responde la prueba, el secundario conserva la suya.
+"""
+
+import os
+import sys
+import time
+import asyncio
+import logging
+import argparse
+import threading
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from fake_openai_server import serve  # noqa: E402
+
+MESSAGES = [{"role": "user", "content": "¿Cuándo empieza el semestre?"}]
+
+
+def start(port: int, **kwargs):
+    server = serve(port=port, **kwargs)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def stop(server):
+    server.shutdown()
+    server.server_close()
+
+
+def latencies(call, n: int) -> np.ndarray:
+    values = []
+    for _ in range(n):
+        start = time.perf_counter()
+        call()
+        values.append(time.perf_counter() - start)
+    return np.array(values)
+
+
+def report(label: str, values: np.ndarray):
+    p50, p95, p99 = np.percentile(values, [50, 95, 99])
+    print(f"{label:<22} p50={p50:.3f}s  p95={p95:.3f}s  p99={p99:.3f}s  max={values.max():.3f}s")
+    return p99
+
+
+class Checks:
+    def __init__(self):
+        self.failed = 0
+
+    def __call__(self, ok: bool, message: str):
+        print(f"[{'OK' if ok else 'FALLA'}] {message}")
+        self.failed += not ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Hedging y circuit breaker de RoutedProvider con servidores falsos")
+    parser.add_argument("--port", type=int, default=8089, help="Puerto del primario (el secundario usa el siguiente)")
+    parser.add_argument("--requests", type=int, default=300)
+    parser.add_argument("--delay", type=float, default=0.05, help="Latencia normal del primario")
+    parser.add_argument("--slow-rate", type=float, default=0.03, help="Fracción de respuestas lentas del primario")
+    parser.add_argument("--slow-delay", type=float, default=1.5, help="Segundos de las respuestas lentas")
+    parser.add_argument("--fallback-delay", type=float, default=0.08, help="Latencia del secundario")
+    parser.add_argument("--error-rate", type=float, default=1.0, help="Fracción de errores del primario en la fase 2")
+    parser.add_argument("--hedge-default", type=float, default=0.3, help="Hedge antes de tener suficientes muestras")
+    parser.add_argument("--reset-timeout", type=float, default=1.0)
+    parser.add_argument("--seed", type=int, default=0, help="Semilla de los servidores falsos")
+    args = parser.parse_args()
+    # Los errores 500 de la fase 2 son esperados: se omiten los logs de los proveedores
+    logging.disable(logging.ERROR)
+
+    primary_port, fallback_port = args.port, args.port + 1
+    os.environ.update(OPENAI_BASE_URL=f"http://127.0.0.1:{primary_port}/v1",
+                      DEEPSEEK_BASE_URL=f"http://127.0.0.1:{fallback_port}/v1",
+                      OPENAI_API_KEY=os.getenv("OPENAI_API_KEY", "fake"),
+                      DEEPSEEK_API_KEY=os.getenv("DEEPSEEK_API_KEY", "fake"))
+    from providers.chatgpt import ChatGPTProvider
+    from providers.deepseek import DeepSeekProvider
+    from providers.routed import FAILURE_THRESHOLD, RoutedProvider
+    check = Checks()
+
+    # --- 1. Cola de latencia ---
+    primary = start(primary_port, delay=args.delay, slow_rate=args.slow_rate, slow_delay=args.slow_delay,
+                    seed=args.seed)
+    fallback = start(fallback_port, delay=args.fallback_delay, seed=args.seed)
+    print(f"\n1. Latencia ({args.requests} peticiones, {args.slow_rate:.0%} del primario tarda {args.slow_delay}s)")
+    direct = ChatGPTProvider(max_retries=0)
+    direct_latencies = latencies(lambda: direct.chat(MESSAGES), args.requests)
+    direct_p99 = report("ChatGPT solo", direct_latencies)
+    # El p99 solo cae en la cola si más del 1% de las respuestas directas fueron lentas
+    slow = int((direct_latencies >= args.slow_delay).sum())
+    router = RoutedProvider([ChatGPTProvider(max_retries=0), DeepSeekProvider(max_retries=0)],
+                            hedge_default_s=args.hedge_default, reset_timeout=args.reset_timeout)
+    routed_p99 = report("routed (sync)", latencies(lambda: router.chat(MESSAGES), args.requests))
+    routed_async_p99 = report("routed (async)", latencies(lambda: asyncio.run(router.achat(MESSAGES)),
+                                                         args.requests // 3))
+    stats = router.snapshot()
+    fallback_stats = stats[DeepSeekProvider(max_retries=0).name]
+    print(f"hedges={fallback_stats['hedges']}  victorias del secundario={fallback_stats['wins']}")
+    if args.slow_rate > 0:
+        check(fallback_stats["hedges"] > 0 and fallback_stats["wins"] > 0, "se lanzan hedges y el secundario gana")
+    if slow > len(direct_latencies) / 100:
+        check(routed_p99 < direct_p99 / 2, f"p99 con enrutamiento ({routed_p99:.3f}s) < mitad del directo "
+                                           f"({direct_p99:.3f}s)")
+        check(routed_async_p99 < direct_p99 / 2, f"p99 async ({routed_async_p99:.3f}s) < mitad del directo")
+    else:
+        print(f"[--] {slow} respuestas lentas de {len(direct_latencies)}: el p99 directo no cae en la cola; "
+              f"se omite la comparación de p99 (sube --requests o --slow-rate)")
+    stop(primary)
+
+    # --- 2. Circuit breaker ---
+    print(f"\n2. Circuito (primario con error_rate={args.error_rate})")
+    primary = start(primary_port, error_rate=args.error_rate, seed=args.seed)
+    router = RoutedProvider([ChatGPTProvider(max_retries=0), DeepSeekProvider(max_retries=0)],
+                            hedge=False, reset_timeout=args.reset_timeout)
+    primary_name = router.backends[0].name
+    answers = [router.chat(MESSAGES) for _ in range(FAILURE_THRESHOLD + 5)]
+    stats = router.snapshot()[primary_name]
+    check(all(answers), "todas las peticiones se responden (por el secundario)")
+    check(stats["circuit"] == "open", f"circuito abierto tras {FAILURE_THRESHOLD} fallos seguidos")
+    check(stats["requests"] == FAILURE_THRESHOLD, f"con el circuito abierto no se envía nada al primario "
+                                                  f"({stats['requests']} peticiones)")
+
+    stop(primary)
+    primary = start(primary_port, delay=args.delay)
+    time.sleep(args.reset_timeout + 0.1)
+    router.chat(MESSAGES)
+    stats = router.snapshot()[primary_name]
+    check(stats["circuit"] == "closed", "pasado reset_timeout, la prueba al primario recuperado cierra el circuito")
+
+    # --- 3. La prueba medio abierta no se consume sin enviar ---
+    print("\n3. Prueba medio abierta")
+    for backend in router.backends:
+        for _ in range(FAILURE_THRESHOLD):
+            router.stats[backend.name].record_failure(router.failure_threshold)
+    time.sleep(args.reset_timeout + 0.1)
+    router.chat(MESSAGES)
+    fallback_name = router.backends[1].name
+    check(router.snapshot()[primary_name]["circuit"] == "closed", "el primario responde su prueba y se cierra")
+    check(router.stats[fallback_name].is_available(router.reset_timeout),
+          "el secundario (no contactado) conserva su petición de prueba")
+
+    stop(primary)
+    stop(fallback)
+    print(f"\n{'Todos los chequeos pasaron' if not check.failed else f'{check.failed} chequeos fallaron'}.")
+    sys.exit(1 if check.failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+"""
+Servidor local compatible con la API de chat completions de OpenAI, para
+probar los proveedores sin claves ni costo.
+
+Uso:
+    python scripts/fake_openai_server.py --port 8089 --delay 0.5
+    python scripts/fake_openai_server.py --port 8090 --slow-rate 0.05 --slow-delay 4 --error-rate 0.02
+    OPENAI_BASE_URL=http://127.0.0.1:8089/v1 DEEPSEEK_BASE_URL=http://127.0.0.1:8089/v1 python app.py "pregunta"
+"""
+
+import json
+import time
+import random
+import argparse
+from typing import Optional
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+def make_handler(delay: float, slow_rate: float = 0.0, slow_delay: float = 0.0, error_rate: float = 0.0,
+                 seed: Optional[int] = None):
+    """
+    `slow_rate` de las respuestas tarda `slow_delay` segundos en vez de `delay`
+    (cola de latencia) y `error_rate` responde 500, para probar el enrutamiento.
+    Con `seed` la secuencia de respuestas lentas y errores es reproducible.
+    """
+    rng = random.Random(seed)
+
+    class FakeOpenAIHandler(BaseHTTPRequestHandler):
+        def log_message(self, format, *args):
+            pass
+
+        def do_POST(self):
+            if not self.path.rstrip("/").endswith("/chat/completions"):
+                self.send_error(404)
+                return
+            length = int(self.headers.get("Content-Length", 0))
+            body = json.loads(self.rfile.read(length) or b"{}")
+            time.sleep(slow_delay if rng.random() < slow_rate else delay)
+            if rng.random() < error_rate:
+                self.send_error(500, "Error simulado")
+                return
+
+            last_message = body.get("messages", [{}])[-1].get("content", "")
+            answer = f"Respuesta simulada a: {last_message[:200]}"
+            if body.get("stream"):
+                self._send_stream(body, answer)
+                return
+            payload = {
+                "id": "chatcmpl-fake",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": body.get("model", "fake"),
+                "choices": [{
+                    "index": 0,
+                    "message": {"role": "assistant", "content": answer},
+                    "finish_reason": "stop",
+                }],
+                "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0},
+            }
+            data = json.dumps(payload).encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def _send_stream(self, body, answer):
+            """Responde como `stream=True`: un chunk SSE por palabra."""
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.end_headers()
+            words = answer.split(" ")
+            for i, word in enumerate(words):
+                chunk = {
+                    "id": "chatcmpl-fake",
+                    "object": "chat.completion.chunk",
+                    "created": int(time.time()),
+                    "model": body.get("model", "fake"),
+                    "choices": [{
+                        "index": 0,
+                        "delta": {"content": word if i == 0 else " " + word},
+                        "finish_reason": None,
+                    }],
+                }
+                self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+                self.wfile.flush()
+            self.wfile.write(b"data: [DONE]\n\n")
+            self.wfile.flush()
+
+    return FakeOpenAIHandler
+
+
+def serve(host: str = "127.0.0.1", port: int = 8089, delay: float = 0.0,
+          slow_rate: float = 0.0, slow_delay: float = 0.0, error_rate: float = 0.0,
+          seed: Optional[int] = None) -> ThreadingHTTPServer:
+    """Crea el servidor (sin iniciarlo); útil para levantarlo en un hilo desde pruebas."""
+    return ThreadingHTTPServer((host, port), make_handler(delay, slow_rate, slow_delay, error_rate, seed))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Servidor OpenAI falso para pruebas locales")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--delay", type=float, default=0.0, help="Segundos de espera por respuesta")
+    parser.add_argument("--slow-rate", type=float, default=0.0, help="Fracción de respuestas lentas")
+    parser.add_argument("--slow-delay", type=float, default=0.0, help="Segundos de espera de las respuestas lentas")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fracción de respuestas con error 500")
+    parser.add_argument("--seed", type=int, default=None, help="Semilla para respuestas lentas y errores")
+    args = parser.parse_args()
+
+    server = serve(args.host, args.port, args.delay, args.slow_rate, args.slow_delay, args.error_rate, args.seed)
+    print(f"[INFO] Servidor OpenAI falso en http://{args.host}:{args.port}/v1 (delay={args.delay}s, "
+          f"slow_rate={args.slow_rate}, error_rate={args.error_rate})")
+    server.serve_forever()
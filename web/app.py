@@ -1,22 +1,176 @@
-from flask import Flask, request, render_template, jsonify
+from flask import Flask, Response, g, request, render_template, jsonify, stream_with_context
 from providers.chatgpt import ChatGPTProvider
 from providers.deepseek import DeepSeekProvider
+from providers.routed import RoutedProvider, default_routed_provider
 from rag.pipeline import RAGPipeline
 from rag.retrieve import Retriever
+from rag.cache import PipelineCache, LRUCache, SQLiteCache, SemanticCache
+from rag.rerank import Reranker, RERANK_CANDIDATES, RERANK_BUDGET_S
+from rag.context import CONTEXT_TOKEN_BUDGET
+from rag.hierarchy import TOP_GROUPS
+from rag.singleflight import SingleFlight
+from rag import metrics
+from web.runtime import AsyncRunner, ConcurrencyLimiter, Overloaded
 from dotenv import load_dotenv
+import os
+import json
+import time
+import logging
+import threading
 
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 app = Flask(__name__)
 
-# Inicializamos los proveedores disponibles
-providers = {
-    "chatgpt": ChatGPTProvider(),
-    "deepseek": DeepSeekProvider(),
+# Proveedores disponibles; cada uno se instancia la primera vez que se usa
+PROVIDER_CLASSES = {
+    "chatgpt": ChatGPTProvider,
+    "deepseek": DeepSeekProvider,
+    # ChatGPT con DeepSeek de respaldo: hedging por p95 y circuit breaker
+    "routed": default_routed_provider,
 }
+providers = {}
+_providers_lock = threading.Lock()
+
+# Peticiones simultáneas por proveedor y proceso; si no hay cupo en
+# RAG_QUEUE_TIMEOUT segundos se responde 503 con Retry-After
+MAX_CONCURRENT_PER_PROVIDER = int(os.getenv("RAG_PROVIDER_CONCURRENCY", "8"))
+QUEUE_TIMEOUT = float(os.getenv("RAG_QUEUE_TIMEOUT", "0.5"))
+# Tiempo máximo de una petición completa (recuperación + LLM)
+REQUEST_TIMEOUT = float(os.getenv("RAG_REQUEST_TIMEOUT", "60"))
+
+limiter = ConcurrencyLimiter(MAX_CONCURRENT_PER_PROVIDER, QUEUE_TIMEOUT)
+runner = AsyncRunner()
+# Preguntas idénticas simultáneas (misma pregunta normalizada, proveedor, k y búsqueda)
+# comparten una sola ejecución del pipeline
+singleflight = SingleFlight()
+
+# Estrategia de recuperación: "direct", "hyde" (por defecto) o "hybrid"
+RETRIEVAL_STRATEGY = os.getenv("RAG_STRATEGY", "hyde")
+HYDE_SKIP_THRESHOLD = float(os.environ["RAG_HYDE_SKIP_THRESHOLD"]) if os.getenv("RAG_HYDE_SKIP_THRESHOLD") else None
+if HYDE_SKIP_THRESHOLD is not None and os.getenv("RAG_RETRIEVAL_MODE") == "lexical":
+    # BM25 no da similitud coseno: el umbral nunca se alcanzaría
+    logger.warning("RAG_HYDE_SKIP_THRESHOLD no aplica con RAG_RETRIEVAL_MODE=lexical; se ignora.")
+    HYDE_SKIP_THRESHOLD = None
+RERANK_CANDIDATES_K = int(os.getenv("RAG_RERANK_CANDIDATES", str(RERANK_CANDIDATES)))
+# Tokens máximos de contexto por pregunta (0 = sin límite)
+CONTEXT_BUDGET = int(os.getenv("RAG_CONTEXT_BUDGET", str(CONTEXT_TOKEN_BUDGET))) or None
+# Caché compartida entre requests: "memory" (LRU con TTL), "sqlite" o "none"
+CACHE_BACKEND = os.getenv("RAG_CACHE", "memory")
+# Con RAG_DEBUG_TRACE=1 (o FLASK_DEBUG=1), POST / con "debug": true devuelve
+# también las etapas de esa petición con sus tiempos
+TRACE_REQUESTS = os.getenv("RAG_DEBUG_TRACE", "0") == "1" or os.getenv("FLASK_DEBUG", "0") == "1"
+
+# Componentes pesados; los asigna load_components()
+retriever = None
+cache = None
+semantic_cache = None
+reranker = None
+load_error = None
+
+
+def load_components():
+    """
+    Carga el retriever (índice FAISS, chunks, modelo), las cachés y el re-ranker.
+
+    Con gunicorn --preload se ejecuta una vez en el master antes del fork: los
+    workers heredan el modelo y los índices mapeados en memoria (copy-on-write)
+    sin volver a leerlos. /readyz responde 200 solo cuando terminó.
+    """
+    global retriever, cache, semantic_cache, reranker, load_error
+    try:
+        # RAG_RETRIEVAL_MODE: "dense" (por defecto), "lexical" o "hybrid"
+        # RAG_HIERARCHICAL=1: búsqueda página → chunk (RAG_TOP_GROUPS páginas)
+        loaded = Retriever(mode=os.getenv("RAG_RETRIEVAL_MODE", "dense"),
+                           hierarchical=os.getenv("RAG_HIERARCHICAL", "0") == "1",
+                           top_groups=int(os.getenv("RAG_TOP_GROUPS", str(TOP_GROUPS))))
+        watch_paths = (loaded.index_path, loaded.chunks_path)
+
+        if CACHE_BACKEND != "none":
+            backend = SQLiteCache() if CACHE_BACKEND == "sqlite" else LRUCache()
+            cache = PipelineCache(backend, watch_paths=watch_paths)
+
+        # Caché semántica opcional (paráfrasis de preguntas ya respondidas)
+        if os.getenv("RAG_SEMANTIC_CACHE", "0") == "1":
+            semantic_cache = SemanticCache(
+                threshold=float(os.getenv("RAG_SEMANTIC_THRESHOLD", "0.92")),
+                max_size=int(os.getenv("RAG_SEMANTIC_MAX_SIZE", "512")),
+                watch_paths=watch_paths,
+            )
+
+        # Re-ranking opcional con cross-encoder (RAG_RERANK=1); el modelo se carga una vez
+        if os.getenv("RAG_RERANK", "0") == "1":
+            reranker = Reranker(budget_s=float(os.getenv("RAG_RERANK_BUDGET", str(RERANK_BUDGET_S))))
+
+        retriever = loaded
+        logger.info(f"Retriever listo: {retriever.index.ntotal} vectores ({retriever.index_type}, "
+                    f"embeddings {retriever.encoder_backend}).")
+    except Exception as e:
+        load_error = str(e)
+        logger.error(f"No se pudo cargar el retriever: {e}", exc_info=True)
+        raise
+
+
+# RAG_BACKGROUND_LOAD=1 carga en un hilo para que /healthz responda de inmediato.
+# Solo sirve con el servidor de desarrollo: con gunicorn --preload el master
+# importa este módulo y hace fork enseguida, y los workers no heredan el hilo
+# (quedarían sin retriever para siempre). web/gunicorn.conf.py marca
+# RAG_GUNICORN=1 y en ese caso se carga al importar, como siempre.
+if os.getenv("RAG_BACKGROUND_LOAD", "0") == "1" and os.getenv("RAG_GUNICORN") == "1":
+    logger.warning("RAG_BACKGROUND_LOAD se ignora con gunicorn (preload_app); se carga antes del fork.")
+    load_components()
+elif os.getenv("RAG_BACKGROUND_LOAD", "0") == "1":
+    threading.Thread(target=load_components, name="rag-load", daemon=True).start()
+else:
+    load_components()
+
+
+def get_provider(name: str):
+    """Instancia el proveedor la primera vez que se pide (KeyError si no existe)."""
+    with _providers_lock:
+        if name not in providers:
+            providers[name] = PROVIDER_CLASSES[name]()
+        return providers[name]
+
+
+def format_sources(sources: list) -> list[str]:
+    return [f"{doc['doc_id']} (p. {doc.get('page','N/A')})" for doc in sources]
+
+
+def sse_event(event: str, data) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+def make_pipeline(provider, k_value: int) -> RAGPipeline:
+    return RAGPipeline(provider, retriever, k=k_value, cache=cache, semantic_cache=semantic_cache,
+                       strategy=RETRIEVAL_STRATEGY, hyde_skip_threshold=HYDE_SKIP_THRESHOLD,
+                       reranker=reranker, rerank_candidates=RERANK_CANDIDATES_K,
+                       context_budget=CONTEXT_BUDGET)
+
+
+def error_response(message: str, status: int, retry_after: int = None):
+    response = jsonify({"error": message})
+    response.status_code = status
+    if retry_after is not None:
+        response.headers["Retry-After"] = str(retry_after)
+    return response
+
+
+def parse_request():
+    """Lee la pregunta del JSON; devuelve (query, nombre del proveedor, k) o una respuesta de error."""
+    data = request.get_json(force=True)
+    query = data.get("message")
+    provider_name = data.get("provider", "chatgpt")
+    if not query:
+        return None, error_response("Falta el campo 'message'.", 400)
+    if provider_name not in PROVIDER_CLASSES:
+        return None, error_response(f"Proveedor desconocido: {provider_name}", 400)
+    if retriever is None:
+        return None, error_response("El índice aún se está cargando.", 503, retry_after=5)
+    return (query, provider_name, int(data.get("k", 4))), None
 
-# Inicializamos el retriever global (para no recargar FAISS cada vez)
-retriever = Retriever()
 
 @app.route("/", methods=["GET", "POST"])
 def index():
@@ -27,37 +181,174 @@ def index():
 
     if request.method == "POST":
         # ⚠️ tu frontend manda JSON, no form-data → cambiamos request.form por request.json
-        data = request.get_json(force=True)
-        query = data.get("message")
-        selected_provider = data.get("provider", "chatgpt")
-        k_value = int(data.get("k", 4))
+        parsed, error = parse_request()
+        if error is not None:
+            return error
+        query, selected_provider, k_value = parsed
+        debug = TRACE_REQUESTS and bool(request.get_json(force=True).get("debug"))
+
+        pipeline = make_pipeline(get_provider(selected_provider), k_value)
 
-        # Obtenemos el proveedor elegido
-        provider = providers[selected_provider]
+        async def traced_run():
+            # La traza se inicia dentro del event loop para que la hereden las tareas del pipeline
+            trace = metrics.start_trace()
+            return await pipeline.arun(query), trace
 
-        # Creamos una instancia del pipeline con ese proveedor y el retriever
-        pipeline = RAGPipeline(provider, retriever, k=k_value)
+        def execute():
+            # Cupo por proveedor: si está saturado se responde 503 en vez de encolar
+            with limiter.slot(selected_provider):
+                # El pipeline asíncrono corre en el event loop compartido del proceso
+                return runner.run(traced_run(), timeout=REQUEST_TIMEOUT)
+
+        try:
+            # La coalescencia va antes del cupo: las peticiones que esperan a una
+            # idéntica en curso no ocupan lugar ni llaman al LLM (y comparten la traza)
+            result, trace = singleflight.do(pipeline.flight_key(query), execute)
+        except Overloaded as e:
+            return error_response("Servidor ocupado, intenta nuevamente.", 503, retry_after=e.retry_after)
+        except TimeoutError:
+            return error_response("La respuesta tardó demasiado.", 504)
 
-        # Ejecutamos el pipeline RAG
-        result = pipeline.run(query)
         answer = result["answer"]
         sources = result["sources"]
 
-        return jsonify({
+        payload = {
             "answer": answer,
-            "sources": [f"{doc['doc_id']} (p. {doc.get('page','N/A')})" for doc in sources]
-        })
+            "sources": format_sources(sources)
+        }
+        if debug and trace is not None:
+            payload["trace"] = trace.to_list()
+        return jsonify(payload)
 
     # Render inicial cuando entras por GET
     return render_template(
         "index.html",
         answer=answer,
         sources=sources,
-        providers=list(providers.keys()),
+        providers=list(PROVIDER_CLASSES.keys()),
         selected_provider=selected_provider,
         k_value=k_value,
     )
 
 
+@app.route("/stream", methods=["POST"])
+def stream():
+    """Igual que POST /, pero entrega fuentes y tokens como Server-Sent Events."""
+    parsed, error = parse_request()
+    if error is not None:
+        return error
+    query, provider_name, k_value = parsed
+
+    pipeline = make_pipeline(get_provider(provider_name), k_value)
+
+    def generate():
+        try:
+            for item in pipeline.run_stream(query):
+                if item["event"] == "sources":
+                    yield sse_event("sources", format_sources(item["data"]))
+                elif item["event"] == "token":
+                    yield sse_event("token", item["data"])
+                else:
+                    yield sse_event("done", {
+                        "answer": item["data"]["answer"],
+                        "sources": format_sources(item["data"]["sources"]),
+                    })
+        except Exception:
+            yield sse_event("error", {"error": "Ocurrió un error al procesar la pregunta."})
+
+    # El cupo se toma antes de responder (para poder devolver 503), después de
+    # crear el proveedor (si falla no queda tomado), y se libera al cerrar la
+    # respuesta: al terminar el stream, si el cliente se desconecta o incluso
+    # si el generador nunca llegó a empezar.
+    try:
+        limiter.acquire(provider_name)
+    except Overloaded as e:
+        return error_response("Servidor ocupado, intenta nuevamente.", 503, retry_after=e.retry_after)
+    response = Response(
+        stream_with_context(generate()),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+    response.call_on_close(lambda: limiter.release(provider_name))
+    return response
+
+
+@app.before_request
+def start_timer():
+    g.request_start = time.perf_counter()
+
+
+@app.after_request
+def record_request(response):
+    endpoint = request.endpoint or "unknown"
+    metrics.inc("rag_http_requests_total", endpoint=endpoint, status=response.status_code)
+    if "request_start" in g and endpoint != "stream":  # /stream sigue respondiendo después
+        metrics.observe("rag_http_request_duration_seconds", time.perf_counter() - g.request_start,
+                        endpoint=endpoint)
+    if endpoint == "stream":
+        response.call_on_close(lambda: metrics.flush(process_counters()))
+    else:
+        metrics.flush(process_counters())
+    return response
+
+
+def process_counters() -> dict:
+    """Contadores de este worker que se leen al momento (se suman entre workers en /metrics)."""
+    flights = singleflight.stats()
+    return {
+        "rag_limiter_rejected_total": ("Peticiones rechazadas con 503 por falta de cupo", limiter.rejected),
+        "rag_singleflight_coalesced_total": ("Peticiones que esperaron a una idéntica en curso",
+                                             flights["coalesced"]),
+    }
+
+
+@app.route("/metrics", methods=["GET"])
+def prometheus_metrics():
+    """Histogramas por etapa, tokens, cachés y peticiones en formato Prometheus (de todos los workers)."""
+    # Los gauges son del worker que responde; contadores e histogramas se suman
+    # entre workers cuando gunicorn define RAG_METRICS_DIR
+    gauges = {
+        "rag_ready": ("1 si el índice está cargado", int(retriever is not None)),
+        "rag_singleflight_in_flight": ("Ejecuciones del pipeline en curso (en este worker)",
+                                       singleflight.stats()["in_flight"]),
+    }
+    return Response(metrics.render(gauges, process_counters()), mimetype="text/plain; version=0.0.4")
+
+
+@app.route("/healthz", methods=["GET"])
+def healthz():
+    """El proceso está vivo (no revisa dependencias)."""
+    return jsonify({"status": "ok"})
+
+
+@app.route("/readyz", methods=["GET"])
+def readyz():
+    """Listo para recibir tráfico solo cuando el índice FAISS está cargado."""
+    if retriever is None:
+        status = {"ready": False, "error": load_error} if load_error else {"ready": False}
+        return jsonify(status), 503
+    return jsonify({
+        "ready": True,
+        "vectors": int(retriever.index.ntotal),
+        "index_type": retriever.index_type,
+        "rejected": limiter.rejected,
+    })
+
+
+@app.route("/cache/stats", methods=["GET"])
+def cache_stats():
+    stats = {"enabled": cache is not None}
+    if cache is not None:
+        stats.update({"backend": CACHE_BACKEND, **cache.stats()})
+    if semantic_cache is not None:
+        stats["semantic"] = semantic_cache.stats()
+    stats["singleflight"] = singleflight.stats()
+    routed = providers.get("routed")
+    if isinstance(routed, RoutedProvider):
+        stats["routing"] = routed.snapshot()
+    return jsonify(stats)
+
+
 if __name__ == "__main__":
-    app.run(debug=True, host='0.0.0.0', port=8081)
+    # Servidor de desarrollo; en producción usar gunicorn (ver web/gunicorn.conf.py)
+    app.run(debug=os.getenv("FLASK_DEBUG", "0") == "1", host='0.0.0.0', port=8081, threaded=True)
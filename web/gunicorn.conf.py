@@ -0,0 +1,49 @@
+# Configuración de gunicorn para producción:
+#     gunicorn -c web/gunicorn.conf.py web.app:app
+#
+# Modelo de workers: pocos procesos "gthread", cada uno con varios hilos.
+# - preload_app: el master importa web.app una sola vez (modelo de embeddings,
+#   índice FAISS y chunks.arrow mapeados en memoria) y luego hace fork; los
+#   workers comparten esas páginas copy-on-write en vez de cargarlas N veces.
+# - Los hilos atienden las vistas; las llamadas al LLM corren en un event loop
+#   asíncrono por worker (web.runtime.AsyncRunner) con un pool de conexiones.
+# - La concurrencia real por proveedor la limita RAG_PROVIDER_CONCURRENCY
+#   (por worker); lo que excede ese cupo recibe 503 con Retry-After.
+# - Métricas: cada worker escribe las suyas en RAG_METRICS_DIR y /metrics las
+#   suma, así un scrape no depende de qué worker lo atiende.
+
+import os
+import glob
+import tempfile
+import multiprocessing
+
+bind = os.getenv("RAG_BIND", "0.0.0.0:8081")
+worker_class = "gthread"
+workers = int(os.getenv("RAG_WORKERS", str(min(4, multiprocessing.cpu_count()))))
+threads = int(os.getenv("RAG_THREADS", "16"))
+preload_app = True
+# web.app carga los componentes al importar (en el master) aunque se pida RAG_BACKGROUND_LOAD
+os.environ["RAG_GUNICORN"] = "1"
+os.environ.setdefault("RAG_METRICS_DIR", tempfile.mkdtemp(prefix="rag-metrics-"))
+
+
+def on_starting(server):
+    # Los contadores empiezan de cero con cada arranque del master (Prometheus
+    # lo trata como un reinicio); se borran los archivos de una ejecución anterior.
+    for path in glob.glob(os.path.join(os.environ["RAG_METRICS_DIR"], "*.json")):
+        os.remove(path)
+
+
+def post_fork(server, worker):
+    # Lo que el master registró al precargar no se cuenta una vez por worker
+    from rag import metrics
+    metrics.registry.clear()
+
+# Un poco más que RAG_REQUEST_TIMEOUT para que la app responda 504 antes de que
+# gunicorn mate al worker
+timeout = int(float(os.getenv("RAG_REQUEST_TIMEOUT", "60"))) + 15
+graceful_timeout = 30
+keepalive = 5
+
+accesslog = "-"
+errorlog = "-"
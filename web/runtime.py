@@ -0,0 +1,92 @@
+import os
+import asyncio
+import logging
+import threading
+from contextlib import contextmanager
+from concurrent.futures import TimeoutError as FutureTimeoutError
+
+logger = logging.getLogger(__name__)
+
+
+class Overloaded(Exception):
+    """No hay cupo para atender la petición; el cliente debe reintentar más tarde."""
+
+    def __init__(self, name: str, retry_after: int):
+        super().__init__(f"Proveedor {name} saturado")
+        self.name = name
+        self.retry_after = retry_after
+
+
+class AsyncRunner:
+    """
+    Event loop en un hilo de fondo, uno por proceso.
+
+    Los hilos de la vista (gthread) envían corrutinas con `run`; todas comparten
+    el loop y, con él, el pool de conexiones de `providers.pool`. Con
+    `--preload` el master hace fork después de importar la app, así que el
+    hilo se crea en cada worker la primera vez que se usa.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._loop = None
+        self._pid = None
+
+    def _ensure_loop(self) -> asyncio.AbstractEventLoop:
+        with self._lock:
+            if self._loop is None or self._pid != os.getpid():
+                loop = asyncio.new_event_loop()
+                thread = threading.Thread(target=loop.run_forever, name="rag-async", daemon=True)
+                thread.start()
+                self._loop, self._pid = loop, os.getpid()
+            return self._loop
+
+    def run(self, coro, timeout: float):
+        """Ejecuta `coro` en el loop de fondo; si excede `timeout` la cancela y lanza TimeoutError."""
+        future = asyncio.run_coroutine_threadsafe(coro, self._ensure_loop())
+        try:
+            return future.result(timeout=timeout)
+        except FutureTimeoutError:
+            future.cancel()
+            raise TimeoutError(f"La petición excedió {timeout:.0f}s")
+
+
+class ConcurrencyLimiter:
+    """
+    Límite de peticiones simultáneas por proveedor (por proceso).
+
+    Si no se libera un cupo dentro de `queue_timeout` segundos se lanza
+    `Overloaded` en vez de encolar indefinidamente: el servidor responde 503.
+    """
+
+    def __init__(self, max_concurrent: int, queue_timeout: float, retry_after: int = 2):
+        self.max_concurrent = max_concurrent
+        self.queue_timeout = queue_timeout
+        self.retry_after = retry_after
+        self._semaphores = {}
+        self._lock = threading.Lock()
+        self.rejected = 0
+
+    def _semaphore(self, name: str) -> threading.BoundedSemaphore:
+        with self._lock:
+            if name not in self._semaphores:
+                self._semaphores[name] = threading.BoundedSemaphore(self.max_concurrent)
+            return self._semaphores[name]
+
+    def acquire(self, name: str):
+        if not self._semaphore(name).acquire(timeout=self.queue_timeout):
+            with self._lock:
+                self.rejected += 1
+            logger.warning(f"Proveedor {name} sin cupo ({self.max_concurrent} en curso); se responde 503.")
+            raise Overloaded(name, self.retry_after)
+
+    def release(self, name: str):
+        self._semaphore(name).release()
+
+    @contextmanager
+    def slot(self, name: str):
+        self.acquire(name)
+        try:
+            yield
+        finally:
+            self.release(name)